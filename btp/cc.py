@@ -15,11 +15,14 @@
 # along with CC/iC-Blender-Pipeline-Plugin.  If not, see <https://www.gnu.org/licenses/>.
 
 from RLPy import *
-import os, json, math
+import os, json, math, hashlib
 from . import utils, vars
 from enum import IntEnum
 
 
+EXPRESSION_ROTATION_CACHE = {}
+EXPRESSION_ROTATION_CACHE_FILES = 32
+
 SHADER_MAPS = { # { "Json_shader_name" : "CC3_shader_name", }
     "Tra": "Traditional",
     "Pbr": "PBR",
@@ -1394,6 +1397,121 @@ def get_avatar_profile_name(avatar: RIAvatar):
     return profile_type_string
 
 
+def get_expression_rotation_cache_key(avatar: RIAvatar):
+    """Hash of the facial profile of the avatar: expression names, skin bone names and generation."""
+    FC: RIFaceComponent = avatar.GetFaceComponent()
+    SC: RISkeletonComponent = avatar.GetSkeletonComponent()
+    expressions = FC.GetExpressionNames("") if FC else []
+    bones = [ bone.GetName() for bone in SC.GetSkinBones() ] if SC else []
+    generation = avatar.GetGeneration() if is_avatar(avatar) else 0
+    profile = json.dumps([ list(expressions), bones, str(generation), get_avatar_profile_name(avatar) ])
+    return hashlib.sha1(profile.encode("utf-8")).hexdigest()
+
+
+def get_expression_rotation_fingerprint(avatar: RIAvatar, bone_names):
+    """Hash of a sample of the expression bone rotations of the avatar: each expression
+       against one of the bone_names in turn. Avatars with the same expression and bone names,
+       or edits in the facial profile editor, will not share the same fingerprint."""
+    FC: RIFaceComponent = avatar.GetFaceComponent()
+    expressions = sorted(FC.GetExpressionNames("")) if FC else []
+    samples = []
+    if bone_names:
+        for i, expression in enumerate(expressions):
+            bone_name = bone_names[i % len(bone_names)]
+            try:
+                ERM: RMatrix3 = FC.GetExpressionBoneRotation(bone_name, expression)
+                ERQ = RQuaternion()
+                ERQ.FromRotationMatrix(ERM)
+                samples.append([ round(ERQ.x, 4), round(ERQ.y, 4), round(ERQ.z, 4), round(ERQ.w, 4) ])
+            except:
+                samples.append(None)
+    return hashlib.sha1(json.dumps(samples).encode("utf-8")).hexdigest()
+
+
+def get_expression_rotation_cache_path(folder, key):
+    if folder:
+        return os.path.join(folder, "cache", f"expression_rotations_{key}.json")
+    return None
+
+
+def load_expression_rotation_cache(folder, key, fingerprint):
+    """Returns the cached expression bone rotations { expression: { bone_name: [x,y,z,w] } }
+       from memory, or from the cache folder, or None if not cached or the fingerprint has changed."""
+    if key in EXPRESSION_ROTATION_CACHE:
+        cached_fingerprint, rotations = EXPRESSION_ROTATION_CACHE[key]
+        if cached_fingerprint == fingerprint:
+            return rotations
+        return None
+    cache_path = get_expression_rotation_cache_path(folder, key)
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r") as read_file:
+                cache_json = json.load(read_file)
+            if cache_json.get("fingerprint") != fingerprint:
+                return None
+            rotations = cache_json["rotations"]
+            EXPRESSION_ROTATION_CACHE[key] = (fingerprint, rotations)
+            # keep recently used caches from being pruned
+            os.utime(cache_path)
+            return rotations
+        except:
+            utils.log_warn(f"Unable to read expression rotation cache: {cache_path}")
+    return None
+
+
+def save_expression_rotation_cache(folder, key, fingerprint, rotations):
+    """Caches the expression bone rotations, replacing any cache with the same key
+       but a different fingerprint."""
+    EXPRESSION_ROTATION_CACHE[key] = (fingerprint, rotations)
+    cache_path = get_expression_rotation_cache_path(folder, key)
+    if cache_path:
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(cache_path, "w") as write_file:
+                json.dump({ "key": key, "fingerprint": fingerprint, "rotations": rotations }, write_file)
+        except:
+            utils.log_warn(f"Unable to write expression rotation cache: {cache_path}")
+        prune_expression_rotation_cache(folder)
+
+
+def prune_expression_rotation_cache(folder, max_files=EXPRESSION_ROTATION_CACHE_FILES):
+    """Removes all but the most recently used expression rotation caches in the cache folder,
+       so caches orphaned by renamed expressions or bones, or by deleted avatars, don't accumulate."""
+    cache_folder = os.path.join(folder, "cache") if folder else None
+    if not cache_folder or not os.path.exists(cache_folder):
+        return
+    try:
+        cache_paths = [ os.path.join(cache_folder, file) for file in os.listdir(cache_folder)
+                        if file.startswith("expression_rotations_") and file.endswith(".json") ]
+        cache_paths.sort(key=os.path.getmtime, reverse=True)
+    except:
+        utils.log_warn(f"Unable to list expression rotation caches: {cache_folder}")
+        return
+    for cache_path in cache_paths[max_files:]:
+        try:
+            os.remove(cache_path)
+        except:
+            utils.log_warn(f"Unable to remove expression rotation cache: {cache_path}")
+
+
+def invalidate_expression_rotation_cache(avatar: RIAvatar, folder, old_key=None):
+    """Removes the cached expression bone rotations of the avatar's facial profile,
+       call after the facial profile has been changed. old_key is the cache key from
+       before the change, as the expression names may have changed with it."""
+    keys = [ get_expression_rotation_cache_key(avatar) ]
+    if old_key and old_key not in keys:
+        keys.append(old_key)
+    for key in keys:
+        if key in EXPRESSION_ROTATION_CACHE:
+            EXPRESSION_ROTATION_CACHE.pop(key)
+        cache_path = get_expression_rotation_cache_path(folder, key)
+        if cache_path and os.path.exists(cache_path):
+            try:
+                os.remove(cache_path)
+            except:
+                utils.log_warn(f"Unable to remove expression rotation cache: {cache_path}")
+
+
 def is_avatar_non_standard(avatar: RIAvatar):
     avatar_generation = avatar.GetGeneration()
     avatar_type = avatar.GetAvatarType()
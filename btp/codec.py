@@ -0,0 +1,218 @@
+# Copyright (C) 2023 Victor Soupday
+# This file is part of CC/iC-Blender-Pipeline-Plugin <https://github.com/soupday/CC/iC-Blender-Pipeline-Plugin>
+#
+# CC/iC-Blender-Pipeline-Plugin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CC/iC-Blender-Pipeline-Plugin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CC/iC-Blender-Pipeline-Plugin.  If not, see <https://www.gnu.org/licenses/>.
+
+# Quantized pose frame codec.
+#
+# A compact actor block replaces the float32 bone transforms and weights with:
+#   object transform: 10 x float32 (unchanged)
+#   header: translation bounds minimum (3 x float32) and extent (float32), flags (uint8)
+#   bones: largest component index (uint8), smallest three rotation components (3 x int16),
+#          translation within the bounds (3 x int16), scale (3 x float16, only with COMPACT_SCALE)
+#   weights: uint16, or uint8 with COMPACT_WEIGHTS8, over [WEIGHT_MIN, WEIGHT_MAX]
+
+import math, struct
+from array import array
+
+FLOAT32 = "FLOAT32"
+COMPACT16 = "COMPACT16"
+COMPACT8 = "COMPACT8"
+# supported codecs in order of preference, FLOAT32 is always available
+LINK_CODECS = [ COMPACT16, COMPACT8 ]
+
+COMPACT_HEADER = struct.Struct("!3ffB")
+COMPACT_BONE = struct.Struct("!B3h3h")
+COMPACT_BONE_SCALED = struct.Struct("!B3h3h3e")
+COMPACT_SCALE = 1
+COMPACT_WEIGHTS8 = 2
+
+INT16_MAX = 32767
+# translations span the full int16 range across the bounds
+TRANSLATION_STEPS = 2 * INT16_MAX
+ROTATION_SCALE = INT16_MAX * math.sqrt(2) # the smallest three components lie within +/- 1/sqrt(2)
+SCALE_EPSILON = 0.0001
+# 0 and 1 both land exactly on a quantization step in this range, for 8 and 16 bits
+WEIGHT_MIN = -1.0
+WEIGHT_MAX = 2.0
+
+
+def get_link_codecs(use_compact):
+    """The codecs to advertise. The compact codecs are lossy, so only when the user has enabled them."""
+    return LINK_CODECS if use_compact else []
+
+
+def negotiate(remote_codecs, local_codecs=LINK_CODECS):
+    """Returns the first of our codecs the remote also supports, or FLOAT32."""
+    if remote_codecs:
+        for codec in local_codecs:
+            if codec in remote_codecs:
+                return codec
+    return FLOAT32
+
+
+def is_compact(codec):
+    return codec == COMPACT16 or codec == COMPACT8
+
+
+def get_codec_flags(codec, has_scale):
+    flags = COMPACT_SCALE if has_scale else 0
+    if codec == COMPACT8:
+        flags |= COMPACT_WEIGHTS8
+    return flags
+
+
+def get_bone_struct(flags) -> struct.Struct:
+    return COMPACT_BONE_SCALED if flags & COMPACT_SCALE else COMPACT_BONE
+
+
+def get_weight_size(flags):
+    return 1 if flags & COMPACT_WEIGHTS8 else 2
+
+
+def get_weight_struct(flags, count) -> struct.Struct:
+    return struct.Struct(f"!{count}B" if flags & COMPACT_WEIGHTS8 else f"!{count}H")
+
+
+def clamp_int16(v):
+    return INT16_MAX if v > INT16_MAX else -INT16_MAX if v < -INT16_MAX else v
+
+
+def quantize_rotation(x, y, z, w):
+    """Smallest three quaternion: the index of the largest component, which is dropped,
+       and the other three scaled to int16. q and -q are the same rotation,
+       so the sign is flipped to make the dropped component positive."""
+    ax, ay, az, aw = abs(x), abs(y), abs(z), abs(w)
+    if ax >= ay and ax >= az and ax >= aw:
+        index, m, a, b, c = 0, x, y, z, w
+    elif ay >= az and ay >= aw:
+        index, m, a, b, c = 1, y, x, z, w
+    elif az >= aw:
+        index, m, a, b, c = 2, z, x, y, w
+    else:
+        index, m, a, b, c = 3, w, x, y, z
+    length = math.sqrt(x*x + y*y + z*z + w*w)
+    if length < 1e-12:
+        return 3, 0, 0, 0
+    s = ROTATION_SCALE / length
+    if m < 0:
+        s = -s
+    return index, clamp_int16(round(a * s)), clamp_int16(round(b * s)), clamp_int16(round(c * s))
+
+
+def dequantize_rotation(index, qa, qb, qc):
+    """Returns the x, y, z, w of a smallest three quaternion."""
+    a = qa / ROTATION_SCALE
+    b = qb / ROTATION_SCALE
+    c = qc / ROTATION_SCALE
+    d = 1.0 - a*a - b*b - c*c
+    m = math.sqrt(d) if d > 0.0 else 0.0
+    if index == 0:
+        return m, a, b, c
+    elif index == 1:
+        return a, m, b, c
+    elif index == 2:
+        return a, b, m, c
+    else:
+        return a, b, c, m
+
+
+def get_translation_bounds(transforms):
+    """Returns the minimum (x,y,z) and the largest extent along any axis of the translations
+       of the (tx,ty,tz,...) transforms, which the translations are quantized within.
+       The precision only depends on the size of the actor, not how far it is from the origin."""
+    if not transforms:
+        return (0.0, 0.0, 0.0), 1.0
+    min_x = min(T[0] for T in transforms)
+    min_y = min(T[1] for T in transforms)
+    min_z = min(T[2] for T in transforms)
+    extent = max(max(T[0] for T in transforms) - min_x,
+                 max(T[1] for T in transforms) - min_y,
+                 max(T[2] for T in transforms) - min_z)
+    return (min_x, min_y, min_z), extent if extent > 1e-6 else 1.0
+
+
+def has_scale(transforms):
+    for T in transforms:
+        if (abs(T[7] - 1.0) > SCALE_EPSILON or
+            abs(T[8] - 1.0) > SCALE_EPSILON or
+            abs(T[9] - 1.0) > SCALE_EPSILON):
+            return True
+    return False
+
+
+def pack_transforms_into(buffer, offset, transforms, tra_min, tra_extent, flags):
+    """Packs the (tx,ty,tz,rx,ry,rz,rw,sx,sy,sz) transforms as compact bones,
+       with the translations quantized within the bounds from get_translation_bounds."""
+    bone_struct = get_bone_struct(flags)
+    scaled = flags & COMPACT_SCALE
+    t_scale = TRANSLATION_STEPS / tra_extent
+    min_x, min_y, min_z = tra_min
+    for T in transforms:
+        index, qa, qb, qc = quantize_rotation(T[3], T[4], T[5], T[6])
+        qx = clamp_int16(round((T[0] - min_x) * t_scale) - INT16_MAX)
+        qy = clamp_int16(round((T[1] - min_y) * t_scale) - INT16_MAX)
+        qz = clamp_int16(round((T[2] - min_z) * t_scale) - INT16_MAX)
+        if scaled:
+            bone_struct.pack_into(buffer, offset, index, qa, qb, qc, qx, qy, qz, T[7], T[8], T[9])
+        else:
+            bone_struct.pack_into(buffer, offset, index, qa, qb, qc, qx, qy, qz)
+        offset += bone_struct.size
+    return offset
+
+
+def unpack_transforms(buffer, offset, count, tra_min, tra_extent, flags):
+    """Unpacks count compact bones into a flat float array of 10 floats per bone."""
+    bone_struct = get_bone_struct(flags)
+    scaled = flags & COMPACT_SCALE
+    t_scale = tra_extent / TRANSLATION_STEPS
+    min_x, min_y, min_z = tra_min
+    values = array("f", bytes(count * 40))
+    i = 0
+    for B in bone_struct.iter_unpack(memoryview(buffer)[offset:offset + count * bone_struct.size]):
+        values[i] = min_x + (B[4] + INT16_MAX) * t_scale
+        values[i+1] = min_y + (B[5] + INT16_MAX) * t_scale
+        values[i+2] = min_z + (B[6] + INT16_MAX) * t_scale
+        values[i+3], values[i+4], values[i+5], values[i+6] = dequantize_rotation(B[0], B[1], B[2], B[3])
+        if scaled:
+            values[i+7], values[i+8], values[i+9] = B[7], B[8], B[9]
+        else:
+            values[i+7] = values[i+8] = values[i+9] = 1.0
+        i += 10
+    return values, offset + count * bone_struct.size
+
+
+def quantize_weights(weights, flags):
+    steps = 255 if flags & COMPACT_WEIGHTS8 else 65535
+    s = steps / (WEIGHT_MAX - WEIGHT_MIN)
+    return [ round((min(WEIGHT_MAX, max(WEIGHT_MIN, w)) - WEIGHT_MIN) * s) for w in weights ]
+
+
+def unpack_weights(buffer, offset, count, flags):
+    """Unpacks count quantized weights into a float array."""
+    weight_struct = get_weight_struct(flags, count)
+    steps = 255 if flags & COMPACT_WEIGHTS8 else 65535
+    s = (WEIGHT_MAX - WEIGHT_MIN) / steps
+    values = array("f", [ q * s + WEIGHT_MIN for q in weight_struct.unpack_from(buffer, offset) ])
+    return values, offset + weight_struct.size
+
+
+def get_transform_error(a, b):
+    """Returns the translation distance and rotation angle (radians) between two transforms."""
+    dt = math.sqrt((a[0] - b[0])**2 + (a[1] - b[1])**2 + (a[2] - b[2])**2)
+    # chord length between the quaternions (acos of the dot product is too imprecise near 1)
+    d = min(math.sqrt(sum((a[i] - b[i])**2 for i in range(3, 7))),
+            math.sqrt(sum((a[i] + b[i])**2 for i in range(3, 7))))
+    angle = 4.0 * math.asin(min(1.0, d / 2.0))
+    return dt, angle
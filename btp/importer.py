@@ -703,6 +703,8 @@ class Importer:
 
             profile_json = json_data[self.name]["Facial_Profile"]
             facial_profile:RLPy.RIFacialProfileComponent = avatar.GetFacialProfileComponent()
+            # the expression names may change with the profile
+            old_cache_key = cc.get_expression_rotation_cache_key(avatar)
 
             if self.option_import_profile:
 
@@ -741,6 +743,10 @@ class Importer:
 
                 self.update_progress(2, "Importing Expressions", True)
 
+            if self.option_import_profile or self.option_import_expressions:
+                # the expression bone rotations of the old facial profile are no longer valid
+                cc.invalidate_expression_rotation_cache(avatar, prefs.DATALINK_FOLDER, old_cache_key)
+
 
     def import_hik_profile(self):
         if self.option_import_hik:
@@ -21,8 +21,10 @@ from PySide2.QtWidgets import *
 from PySide2.QtCore import *
 from PySide2.QtGui import *
 from shiboken2 import wrapInstance
-import os, socket, select, struct, time, json, random, atexit, traceback
-from . import blender, importer, exporter, morph, cc, qt, prefs, tests, utils, vars
+import os, sys, socket, select, selectors, struct, time, json, random, atexit, traceback, threading, zlib
+from array import array
+from collections import deque
+from . import blender, importer, exporter, morph, cc, codec, posemath, qt, prefs, tests, utils, vars
 from enum import IntEnum
 import math
 
@@ -35,19 +37,75 @@ MAX_CHUNK_SIZE = 32768
 HANDSHAKE_TIMEOUT_S = 60
 KEEPALIVE_TIMEOUT_S = 300
 PING_INTERVAL_S = 1
+# ping and keepalive run from their own low rate timer, which keeps running with socket notifiers
+IDLE_TIMER_INTERVAL = 250
 SERVER_ONLY = True
 CLIENT_ONLY = False
 EMPTY_SOCKETS = []
 MAX_RECEIVE = 24
+MAX_CLIENTS = 4
 USE_PING = False
 USE_KEEPALIVE = False
 USE_BLOCKING = False
 SOCKET_TIMEOUT = 5.0
+USE_IO_THREAD = False
+USE_SOCKET_NOTIFIERS = False
+RECV_BYTE_BUDGET = 4 * 1024 * 1024
+SEND_HIGH_WATER = 4 * 1024 * 1024
+# Windows sockets have no sendmsg
+HAS_SENDMSG = hasattr(socket.socket, "sendmsg")
+# without sendmsg, up to this much of the payload is joined to the header to go out in one send
+SEND_JOIN_SIZE = 64 * 1024
+# payload compression, the flag is set in the op_code of compressed messages
+COMPRESSED_FLAG = 0x80000000
+COMPRESS_THRESHOLD = 4096
+COMPRESS_LEVEL = 6
+IO_THREAD_TIMEOUT = 0.1
+IO_SEND = 0
+IO_CANCEL = 1
+IO_CHUNKED = 2
+MAX_BATCH_FRAMES = 30
+# sequence flow control
+FLOW_TIMER_RATE = 120
+FLOW_INITIAL_WINDOW = 4
+FLOW_MIN_WINDOW = 1
+FLOW_MAX_WINDOW = 120
+FLOW_MAX_SEND_COUNT = 4
+FLOW_LATENCY_FACTOR = 2.0
+FLOW_LATENCY_SLACK = 0.005
+RECEIVE_CREDIT_TIME = 0.25
+# a sequence client that acks nothing for this long, while another keeps up, is dropped from the sequence
+SEQUENCE_STALL_TIMEOUT = 10.0
+# solve received poses with the pose math engine, once it agrees with the host math
+USE_POSE_MATH = True
+POSE_MATH_TOLERANCE = 0.001
+# recorded sequences: live preview of every Nth frame (0 for none) and frames keyed per pass at the end
+RECORD_PREVIEW_INTERVAL = 10
+TAKE_COMMIT_FRAMES = 500
+# key reduction tolerances: rotation (radians), translation and expression weight
+KEY_REDUCE_ROTATION = math.radians(0.05)
+KEY_REDUCE_TRANSLATION = 0.01
+KEY_REDUCE_WEIGHT = 0.002
+# reduced bone keys are written with linear transitions, so the keys that linear interpolation
+# reproduces can be dropped, where the host lets us set key transitions
+HAS_KEY_TRANSITIONS = hasattr(RControl, "SetKeyTransition")
+KEY_TRANSITION_STRENGTH = 50.0
+# version of the HELLO capabilities block
+CAPABILITIES_VERSION = 1
+# optional protocol features, only used when both ends of the link support them
+LINK_FEATURES = [
+    "ACTOR_TABLE", # pose frames refer to actors by their slot in the template
+    "DELTA_FRAMES", # sequence frames only send the values that changed since the previous frame
+    "BATCH_FRAMES", # sequence frames are sent in batches of consecutive frames with a single ack
+    "CHUNKED", # large messages are sent in chunks, so control messages can go between them
+    "BINARY_ACK", # fixed size binary sequence acks, and timestamped pings for round trip times
+]
 
 class OpCodes(IntEnum):
     NONE = 0
     HELLO = 1
     PING = 2
+    CHUNK = 5
     STOP = 10
     DISCONNECT = 11
     DEBUG = 15
@@ -70,6 +128,7 @@ class OpCodes(IntEnum):
     SEQUENCE_FRAME = 221
     SEQUENCE_END = 222
     SEQUENCE_ACK = 223
+    SEQUENCE_FRAMES = 224
     LIGHTS = 230
     CAMERA_SYNC = 231
     FRAME_SYNC = 232
@@ -136,6 +195,72 @@ FACE_DRIVERS = {
 }
 
 
+class PoseBone():
+    """A single entry in a LinkActor's compiled pose plan."""
+    bone: RINode = None
+    name: str = None
+    pose_index: int = -1
+    parent: int = -1
+    lock_translation: bool = False
+    face_driver: bool = False
+    exp_rotations: list = None
+    t_pose_tra: RVector3 = None
+    t_pose_rot: RQuaternion = None
+    t_pose_sca: RVector3 = None
+    # (shape index, (x,y,z,w)) for the pose math engine
+    exp_quats: list = None
+    face_quats: list = None
+
+    def __init__(self, bone: RINode, name, pose_index, parent, lock_translation, face_driver, exp_rotations, t_pose_data):
+        self.bone = bone
+        self.name = name
+        self.pose_index = pose_index
+        self.parent = parent
+        self.lock_translation = lock_translation
+        self.face_driver = face_driver
+        self.exp_rotations = exp_rotations
+        self.t_pose_tra, self.t_pose_rot, self.t_pose_sca = fetch_transform(t_pose_data)
+        if exp_rotations:
+            self.exp_quats = [ (shape_index, quaternion_tuple(ERQ)) for shape_index, ERQ in exp_rotations ]
+
+
+class BoneControls():
+    """The resolved layer controls of a bone (or effector) in a clip."""
+    rot_x: RControl = None
+    rot_y: RControl = None
+    rot_z: RControl = None
+    pos_x: RControl = None
+    pos_y: RControl = None
+    pos_z: RControl = None
+    sca_x: RControl = None
+    sca_y: RControl = None
+    sca_z: RControl = None
+    # the last keyed euler angles, to keep the rotation curves continuous
+    euler: tuple = None
+
+    def __init__(self, data_block: RDataBlock):
+        self.rot_x = data_block.GetControl("Rotation/RotationX")
+        self.rot_y = data_block.GetControl("Rotation/RotationY")
+        self.rot_z = data_block.GetControl("Rotation/RotationZ")
+        self.pos_x = data_block.GetControl("Position/PositionX")
+        if self.pos_x is not None:
+            self.pos_y = data_block.GetControl("Position/PositionY")
+            self.pos_z = data_block.GetControl("Position/PositionZ")
+        self.sca_x = data_block.GetControl("Position/ScaleX")
+        if self.sca_x is not None:
+            self.sca_y = data_block.GetControl("Position/ScaleY")
+            self.sca_z = data_block.GetControl("Position/ScaleZ")
+
+    @staticmethod
+    def from_clip(clip: RIClip, bone: RINode):
+        clip_bone_control: RControl = clip.GetControl("Layer", bone)
+        if clip_bone_control:
+            clip_data_block: RDataBlock = clip_bone_control.GetDataBlock()
+            if clip_data_block:
+                return BoneControls(clip_data_block)
+        return None
+
+
 class LinkActor():
     name: str = "Name"
     object: RIObject = None
@@ -145,12 +270,19 @@ class LinkActor():
     skin_meshes: list = None
     expressions: dict = None
     expression_rotations: dict = None
+    bone_expression_rotations: dict = None
+    expression_rotation_indices: list = None
     face_rotations: dict = None
     face_drivers: dict = None
     use_drivers: bool = False
     visemes: dict = None
     morphs: dict = None
     t_pose: dict = None
+    link_id: str = None
+    pose_plan: list = None
+    pose_arrays: posemath.PoseArrays = None
+    clip: RIClip = None
+    bone_controls: list = None
     alias: list = None
 
     def __init__(self, object):
@@ -162,14 +294,19 @@ class LinkActor():
         self.skin_meshes = []
         self.expressions = {}
         self.expression_rotations = {}
+        self.bone_expression_rotations = {}
+        self.expression_rotation_indices = []
         self.face_rotations = {}
         self.face_drivers = {}
         self.drivers = False
         self.visemes = {}
         self.morphs = {}
         self.t_pose = None
+        self.pose_plan = []
+        self.clip = None
+        self.bone_controls = None
         self.alias = []
-        self.get_link_id()
+        self.link_id = cc.get_link_id(self.object, add_if_missing=True)
 
     def get_avatar(self) -> RIAvatar:
         return self.object
@@ -220,14 +357,25 @@ class LinkActor():
                 return self.object.GetMorphComponent()
         return None
 
-    def get_expression_bone_rotations(self, actor_expressions):
+    def fetch_expression_bone_rotations(self):
+        """Returns the bone rotations of each expression in the facial profile:
+           { expression: { bone_name: [x,y,z,w] } }
+           These take thousands of calls to fetch, so are cached by facial profile
+           and a fingerprint of a sample of the rotations."""
         FC = self.get_face_component()
         SC = self.get_skeleton_component()
+        if not FC or not SC:
+            return {}
         bones = SC.GetSkinBones()
+        sample_bones = [ bone.GetName() for bone in bones if bone.GetName() in FACE_BONES ]
+        cache_key = cc.get_expression_rotation_cache_key(self.object)
+        fingerprint = cc.get_expression_rotation_fingerprint(self.object, sample_bones)
+        rotations = cc.load_expression_rotation_cache(prefs.DATALINK_FOLDER, cache_key, fingerprint)
+        if rotations is not None:
+            return rotations
+
         expressions = FC.GetExpressionNames("")
-        expression_rotations = {}
-        face_rotations = {}
-        face_drivers = {}
+        rotations = {}
         if vars.DEV:
             utils.log_info("Expression Bones:")
 
@@ -241,7 +389,6 @@ class LinkActor():
                     break
             for bone in bones:
                 bone_name = bone.GetName()
-                is_face_driver = False
                 if is_face and bone_name not in FACE_BONES:
                     continue
                 try:
@@ -255,27 +402,62 @@ class LinkActor():
                 euler_angle_x, euler_angle_y, euler_angle_z = cc.quaternion_to_euler_xyz(ERQ, degrees=True)
                 t = abs(euler_angle_x) + abs(euler_angle_y) + abs(euler_angle_z)
                 if t > 0.1:
-                    if expression in actor_expressions:
-                        if is_face:
-                            if expression not in face_rotations:
-                                face_rotations[expression] = {}
-                            face_rotations[expression][bone_name] = ERQ
-                            if expression in FACE_DRIVERS:
-                                driving_bone = FACE_DRIVERS[expression]
-                                if bone_name == driving_bone:
-                                    if driving_bone not in face_drivers:
-                                        face_drivers[driving_bone] = []
-                                    face_drivers[driving_bone].append(expression)
-                                    is_face_driver = True
-                        else:
-                            if expression not in expression_rotations:
-                                expression_rotations[expression] = {}
-                            expression_rotations[expression][bone_name] = ERQ
-                        if vars.DEV:
-                            utils.log_info(f" - {expression} / {bone_name} = ({euler_angle_x:.4f}, {euler_angle_y:.4f}, {euler_angle_z:.4f}){' FACE DRIVER' if is_face_driver else ''}")
+                    if expression not in rotations:
+                        rotations[expression] = {}
+                    rotations[expression][bone_name] = [ERQ.x, ERQ.y, ERQ.z, ERQ.w]
+                    if vars.DEV:
+                        utils.log_info(f" - {expression} / {bone_name} = ({euler_angle_x:.4f}, {euler_angle_y:.4f}, {euler_angle_z:.4f})")
+
+        cc.save_expression_rotation_cache(prefs.DATALINK_FOLDER, cache_key, fingerprint, rotations)
+        return rotations
+
+    def get_expression_bone_rotations(self, actor_expressions):
+        rotations = self.fetch_expression_bone_rotations()
+        expression_rotations = {}
+        face_rotations = {}
+        face_drivers = {}
+
+        for expression, bone_rotations in rotations.items():
+            if expression not in actor_expressions:
+                continue
+            is_face = False
+            for face_prefix in FACIAL_EXPRESSION_PREFIXES:
+                if expression.startswith(face_prefix):
+                    is_face = True
+                    break
+            for bone_name, q in bone_rotations.items():
+                ERQ = RQuaternion(RVector4(q[0], q[1], q[2], q[3]))
+                if is_face:
+                    if expression not in face_rotations:
+                        face_rotations[expression] = {}
+                    face_rotations[expression][bone_name] = ERQ
+                    if expression in FACE_DRIVERS:
+                        driving_bone = FACE_DRIVERS[expression]
+                        if bone_name == driving_bone:
+                            if driving_bone not in face_drivers:
+                                face_drivers[driving_bone] = []
+                            face_drivers[driving_bone].append(expression)
+                            if vars.DEV:
+                                utils.log_info(f" - {expression} / {bone_name} FACE DRIVER")
+                else:
+                    if expression not in expression_rotations:
+                        expression_rotations[expression] = {}
+                    expression_rotations[expression][bone_name] = ERQ
         self.expression_rotations = expression_rotations
         self.face_rotations = face_rotations
         self.face_drivers = face_drivers
+        # per bone list of (shape index, rotation) and the shape indices that have any bone rotations
+        bone_expression_rotations = {}
+        expression_rotation_indices = []
+        for expression, bone_rotations in expression_rotations.items():
+            shape_index = actor_expressions[expression]
+            expression_rotation_indices.append(shape_index)
+            for bone_name, ERQ in bone_rotations.items():
+                if bone_name not in bone_expression_rotations:
+                    bone_expression_rotations[bone_name] = []
+                bone_expression_rotations[bone_name].append((shape_index, ERQ))
+        self.bone_expression_rotations = bone_expression_rotations
+        self.expression_rotation_indices = expression_rotation_indices
 
     def set_template(self, actor_data: dict):
         self.bones = actor_data["bones"]
@@ -300,15 +482,96 @@ class LinkActor():
         if MC:
             pass
         self.get_expression_bone_rotations(self.expressions)
+        self.compile_pose_plan()
 
     def set_t_pose(self, t_pose):
         self.t_pose = t_pose
+        self.compile_pose_plan()
+
+    def set_clip(self, clip: RIClip):
+        """Sets the (newly created) animation clip the actor is keyed into.
+           Any cached control handles belong to the old clip and are dropped."""
+        self.clip = clip
+        self.bone_controls = None
+        self.cache_bone_controls()
+
+    def cache_bone_controls(self):
+        """Resolves the clip layer controls of every bone in the pose plan,
+           so the frame loop only has to set values on them."""
+        self.bone_controls = None
+        if self.clip and self.pose_plan:
+            entry: PoseBone
+            self.bone_controls = [ BoneControls.from_clip(self.clip, entry.bone) if entry.pose_index >= 0 else None
+                                   for entry in self.pose_plan ]
+
+    def clear_control_keys(self):
+        """Forgets the last keyed euler angles of the bone controls, so the next keys start new curves."""
+        if self.bone_controls:
+            for controls in self.bone_controls:
+                if controls:
+                    controls.euler = None
+
+    def get_bone_controls(self, clip: RIClip):
+        """The control handles of the bones in clip, re-resolved if the clip
+           is not the one they were cached for (e.g. a clip made outside of set_clip)."""
+        if self.bone_controls is None or not is_same_clip(clip, self.clip):
+            self.clip = clip
+            self.cache_bone_controls()
+        return self.bone_controls
+
+    def compile_pose_plan(self):
+        """Flattens the skeleton into a list of PoseBone entries, parents before children,
+           so that applying a pose frame needs no recursion or bone name lookups.
+           Requires both the template (pose bone names) and the t-pose."""
+        self.pose_plan = []
+        self.pose_arrays = None
+        SC = self.get_skeleton_component()
+        if not SC or not self.bones:
+            return
+        bone_indices = {}
+        for i, name in enumerate(self.bones):
+            if name not in bone_indices:
+                bone_indices[name] = i
+        identity = [0,0,0,0,0,0,1,1,1,1]
+        t_pose = []
+        stack = [(SC.GetRootBone(), -1)]
+        while stack:
+            bone, parent = stack.pop()
+            source_name = bone.GetName()
+            bone_name = try_get_pose_bone(source_name, self.bones)
+            pose_index = bone_indices.get(bone_name, -1)
+            # don't apply any translation to twist or share bones
+            lock_translation = "Twist" in bone_name or "Share" in bone_name
+            # don't follow twist or share bones that are not in the pose
+            if pose_index == -1 and lock_translation:
+                continue
+            face_driver = self.use_drivers and bone_name in self.face_drivers
+            exp_rotations = self.bone_expression_rotations.get(bone_name)
+            t_pose_data = self.t_pose.get(source_name, identity) if self.t_pose else identity
+            slot = len(self.pose_plan)
+            entry = PoseBone(bone, bone_name, pose_index, parent,
+                             lock_translation, face_driver, exp_rotations, t_pose_data)
+            if face_driver:
+                entry.face_quats = [ (self.expressions[expr], quaternion_tuple(self.face_rotations[expr][bone_name]))
+                                     for expr in self.face_drivers[bone_name]
+                                     if expr in self.face_rotations and bone_name in self.face_rotations[expr] ]
+            self.pose_plan.append(entry)
+            t_pose.extend(t_pose_data)
+            children = bone.GetChildren()
+            for child in reversed(children):
+                stack.append((child, slot))
+        self.pose_arrays = posemath.PoseArrays([ entry.parent for entry in self.pose_plan ],
+                                               [ entry.pose_index for entry in self.pose_plan ],
+                                               [ entry.lock_translation for entry in self.pose_plan ],
+                                               t_pose)
+        # control handles are indexed by plan slot
+        self.cache_bone_controls()
 
     def add_alias(self, link_id):
         actor_link_id = cc.get_link_id(self.object)
         if not actor_link_id:
             utils.log_info(f"Assigning actor link_id: {self.object.GetName()}: {link_id}")
-            cc.set_link_id(self.object, link_id)
+            self.set_link_id(link_id)
             return
         if link_id not in self.alias and actor_link_id != link_id:
             utils.log_info(f"Assigning actor alias: {self.object.GetName()}: {link_id}")
@@ -386,10 +649,700 @@ class LinkActor():
         return False
 
     def get_link_id(self):
-        return cc.get_link_id(self.object, add_if_missing=True)
+        if not self.link_id:
+            self.link_id = cc.get_link_id(self.object, add_if_missing=True)
+        return self.link_id
 
     def set_link_id(self, link_id):
         cc.set_link_id(self.object, link_id)
+        self.link_id = link_id
+
+
+def pack_string(s):
+    buffer = bytearray()
+    buffer += struct.pack("!I", len(s))
+    buffer += bytes(s, encoding="utf-8")
+    return buffer
+
+
+def unpack_string(buffer, offset=0):
+    length = struct.unpack_from("!I", buffer, offset)[0]
+    offset += 4
+    string = str(buffer[offset:offset+length], encoding="utf-8")
+    offset += length
+    return offset, string
+
+
+FRAME_HEADER = struct.Struct("!II")
+FRAME_COUNT = struct.Struct("!I")
+FRAME_TRANSFORM = struct.Struct("!ffffffffff")
+# frame, receiver loop rate, receiver hold time, receiver queue depth, credits
+SEQUENCE_ACK_MESSAGE = struct.Struct("!IffHH")
+# kind, sender timestamp, replier timestamp
+PING_MESSAGE = struct.Struct("!Bdd")
+PING_REQUEST = 0
+PING_REPLY = 1
+
+
+FRAME_SWAP_BYTES = sys.byteorder == "little"
+
+
+def unpack_floats(buffer, offset, count):
+    """Unpacks count network order floats into a flat float array, in one copy."""
+    values = array("f")
+    size = count * values.itemsize
+    values.frombytes(memoryview(buffer)[offset:offset + size])
+    if FRAME_SWAP_BYTES:
+        values.byteswap()
+    return values, offset + size
+
+
+class PoseView():
+    """Indexable view of a flat transform array as a list of per bone transforms:
+       [tx, ty, tz, rx, ry, rz, rw, sx, sy, sz]"""
+    transforms: array = None
+
+    def __init__(self, transforms: array):
+        self.transforms = transforms
+
+    def __len__(self):
+        return len(self.transforms) // 10
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        i = index * 10
+        return self.transforms[i:i + 10]
+
+    def __iter__(self):
+        for index in range(0, len(self)):
+            yield self[index]
+
+
+def get_transform_values(T: RTransform):
+    t: RVector3 = T.T()
+    r: RQuaternion = T.R()
+    s: RVector3 = T.S()
+    return (t.x, t.y, t.z, r.x, r.y, r.z, r.w, s.x, s.y, s.z)
+
+
+def pack_transform_into(buffer, offset, T: RTransform):
+    t: RVector3 = T.T()
+    r: RQuaternion = T.R()
+    s: RVector3 = T.S()
+    FRAME_TRANSFORM.pack_into(buffer, offset, t.x, t.y, t.z, r.x, r.y, r.z, r.w, s.x, s.y, s.z)
+    return offset + FRAME_TRANSFORM.size
+
+
+# element strides of the count prefixed arrays that follow the object transform in an actor's frame block
+SEND_FRAME_STRIDES = (FRAME_TRANSFORM.size, FRAME_TRANSFORM.size, 4, 4) # bones, meshes, expressions, visemes
+RECEIVE_FRAME_STRIDES = (FRAME_TRANSFORM.size, 4) # bones, shapes
+DELTA_KEY_INTERVAL = 30
+DELTA_KEY = 0
+DELTA_CHANGED = 1
+
+
+def get_frame_block_groups(block, offset, strides, head_size=FRAME_TRANSFORM.size):
+    """Returns the (start, end) byte ranges of the value groups in an actor's frame block:
+       the object transform (and codec header), then the count and each element of the count prefixed arrays."""
+    groups = [(offset, offset + head_size)]
+    offset += head_size
+    for stride in strides:
+        count = FRAME_COUNT.unpack_from(block, offset)[0]
+        groups.append((offset, offset + FRAME_COUNT.size))
+        offset += FRAME_COUNT.size
+        for i in range(0, count):
+            groups.append((offset, offset + stride))
+            offset += stride
+    return groups, offset
+
+
+def get_compact_block_strides(block, offset, num_transform_arrays, num_weight_arrays):
+    """Returns the head size and array strides of a compact actor block, from the codec header flags."""
+    flags = codec.COMPACT_HEADER.unpack_from(block, offset + FRAME_TRANSFORM.size)[-1]
+    bone_size = codec.get_bone_struct(flags).size
+    weight_size = codec.get_weight_size(flags)
+    head_size = FRAME_TRANSFORM.size + codec.COMPACT_HEADER.size
+    return head_size, (bone_size,) * num_transform_arrays + (weight_size,) * num_weight_arrays
+
+
+def pack_delta_block_into(buffer, offset, block, previous, groups):
+    """Packs a bitmask of the groups that differ between block and previous,
+       followed by the changed groups."""
+    mask_offset = offset
+    mask_size = (len(groups) + 7) >> 3
+    buffer[offset:offset + mask_size] = bytes(mask_size)
+    offset += mask_size
+    for i, (start, end) in enumerate(groups):
+        if block[start:end] != previous[start:end]:
+            buffer[mask_offset + (i >> 3)] |= 1 << (i & 7)
+            size = end - start
+            buffer[offset:offset + size] = block[start:end]
+            offset += size
+    return offset
+
+
+def unpack_delta_block(buffer, offset, previous, groups):
+    """Rebuilds a full frame block from the previous block and a packed delta block."""
+    block = bytearray(previous)
+    mask_size = (len(groups) + 7) >> 3
+    mask = buffer[offset:offset + mask_size]
+    offset += mask_size
+    for i, (start, end) in enumerate(groups):
+        if mask[i >> 3] & (1 << (i & 7)):
+            size = end - start
+            block[start:end] = buffer[offset:offset + size]
+            offset += size
+    return block, offset
+
+
+class ActorFrameLayout():
+    """The fixed layout of an actor's block in a pose frame."""
+    actor: LinkActor = None
+    header: bytes = None
+    FC: RIFaceComponent = None
+    VC: RIVisemeComponent = None
+    expression_names: list = None
+    expression_struct: struct.Struct = None
+    viseme_count: int = 0
+    viseme_struct: struct.Struct = None
+    size: int = 0
+    num_groups: int = 0
+    frame_codec: str = codec.FLOAT32
+    flags: int = 0
+    # delta frames
+    body_start: int = 0
+    body_end: int = 0
+    previous: bytes = None
+    groups: list = None
+
+    def __init__(self, actor: LinkActor, slot=-1, frame_codec=codec.FLOAT32):
+        self.actor = actor
+        self.frame_codec = frame_codec
+        self.flags = codec.get_codec_flags(frame_codec, False)
+        if slot >= 0:
+            self.header = FRAME_COUNT.pack(slot)
+        else:
+            self.header = bytes(pack_string(actor.name) +
+                                pack_string(actor.get_type()) +
+                                pack_string(actor.get_link_id()))
+        self.FC = actor.get_face_component()
+        self.VC = actor.get_viseme_component()
+        self.expression_names = self.FC.GetExpressionNames("") if self.FC else []
+        self.expression_struct = self.get_weight_struct(len(self.expression_names))
+        self.set_viseme_count(len(self.VC.GetVisemeMorphWeights()) if self.VC else 0)
+
+    def get_weight_struct(self, count):
+        if codec.is_compact(self.frame_codec):
+            return codec.get_weight_struct(self.flags, count)
+        return struct.Struct(f"!{count}f")
+
+    def set_viseme_count(self, count):
+        self.viseme_count = count
+        self.viseme_struct = self.get_weight_struct(count)
+        num_transforms = 1 + len(self.actor.skin_bones) + len(self.actor.skin_meshes)
+        if codec.is_compact(self.frame_codec):
+            # sized for the largest (scaled) compact bones
+            transforms_size = (FRAME_TRANSFORM.size + codec.COMPACT_HEADER.size +
+                               (num_transforms - 1) * codec.COMPACT_BONE_SCALED.size)
+        else:
+            transforms_size = num_transforms * FRAME_TRANSFORM.size
+        self.size = (len(self.header) +
+                     transforms_size +
+                     4 * FRAME_COUNT.size +
+                     self.expression_struct.size +
+                     self.viseme_struct.size)
+        self.num_groups = num_transforms + 4 + len(self.expression_names) + count
+        # the block layout has changed, so the next delta frame must be a key
+        self.previous = None
+        self.groups = None
+
+
+class PoseFrameEncoder():
+    """Packs the pose frames of a fixed set of actors into a single preallocated buffer.
+       The layout of each actor is worked out once from the cached skin bones, meshes and expressions.
+       With an actor table, actors are identified by their slot in the template, otherwise by name, type and link_id.
+       Compact codecs quantize the bone transforms and weights (see codec.py)."""
+    actors: list = None
+    layouts: list = None
+    buffer: bytearray = None
+    delta_buffer: bytearray = None
+    delta_count: int = 0
+    # the last frame encoded and its full size
+    frame: int = None
+    size: int = 0
+    use_actor_table: bool = False
+    frame_codec: str = codec.FLOAT32
+
+    def __init__(self, actors: list, use_actor_table=False, frame_codec=codec.FLOAT32):
+        self.actors = actors
+        self.use_actor_table = use_actor_table
+        self.frame_codec = frame_codec
+        self.layouts = [ ActorFrameLayout(actor, slot if use_actor_table else -1, frame_codec)
+                         for slot, actor in enumerate(actors) ]
+        self.allocate()
+
+    def allocate(self):
+        size = FRAME_HEADER.size
+        delta_size = FRAME_HEADER.size
+        layout: ActorFrameLayout
+        for layout in self.layouts:
+            size += layout.size
+            delta_size += layout.size + 1 + ((layout.num_groups + 7) >> 3)
+        self.buffer = bytearray(size)
+        self.delta_buffer = bytearray(delta_size)
+
+    def encode(self, frame, delta=False):
+        """Returns a memoryview of the encoded frame.
+           The buffer is reused by the next encode, so send (or copy) the frame before then.
+           Delta frames mark each actor block as either a full key block or a delta block,
+           with a key every DELTA_KEY_INTERVAL frames."""
+        buffer = self.buffer
+        FRAME_HEADER.pack_into(buffer, 0, len(self.layouts), frame)
+        offset = FRAME_HEADER.size
+        time = RGlobal.GetTime()
+        layout: ActorFrameLayout
+        for layout in self.layouts:
+            actor = layout.actor
+
+            header_size = len(layout.header)
+            buffer[offset:offset + header_size] = layout.header
+            offset += header_size
+            layout.body_start = offset
+
+            visemes = layout.VC.GetVisemeMorphWeights() if layout.VC else []
+            if len(visemes) != layout.viseme_count:
+                layout.set_viseme_count(len(visemes))
+                self.allocate()
+                return self.encode(frame, delta=delta)
+
+            if codec.is_compact(self.frame_codec):
+                offset = self.pack_compact_body(buffer, offset, layout, time, visemes)
+            else:
+                offset = self.pack_body(buffer, offset, layout, time, visemes)
+
+            layout.body_end = offset
+
+        self.frame = frame
+        self.size = offset
+        if delta:
+            return self.encode_delta(offset)
+        return memoryview(buffer)[:offset]
+
+    def encode_key(self):
+        """Re-packs the frame just encoded as a delta frame of key blocks only,
+           for a receiver that missed the frames before it."""
+        return self.encode_delta(self.size, key=True)
+
+    def pack_body(self, buffer, offset, layout: ActorFrameLayout, time, visemes):
+        actor = layout.actor
+
+        # pack object transform
+        offset = pack_transform_into(buffer, offset, actor.get_object().WorldTransform())
+
+        # pack bone transforms
+        FRAME_COUNT.pack_into(buffer, offset, len(actor.skin_bones))
+        offset += FRAME_COUNT.size
+        bone: RIObject
+        for bone in actor.skin_bones:
+            offset = pack_transform_into(buffer, offset, bone.WorldTransform())
+
+        # pack mesh transforms
+        FRAME_COUNT.pack_into(buffer, offset, len(actor.skin_meshes))
+        offset += FRAME_COUNT.size
+        for bone in actor.skin_meshes:
+            offset = pack_transform_into(buffer, offset, bone.WorldTransform())
+
+        # pack facial expressions
+        FRAME_COUNT.pack_into(buffer, offset, len(layout.expression_names))
+        offset += FRAME_COUNT.size
+        if layout.expression_names:
+            weights = layout.FC.GetExpressionWeights(time, layout.expression_names)
+            layout.expression_struct.pack_into(buffer, offset, *weights)
+            offset += layout.expression_struct.size
+
+        # pack visemes
+        FRAME_COUNT.pack_into(buffer, offset, layout.viseme_count)
+        offset += FRAME_COUNT.size
+        if layout.viseme_count:
+            layout.viseme_struct.pack_into(buffer, offset, *visemes)
+            offset += layout.viseme_struct.size
+
+        # TODO: pack morphs
+
+        return offset
+
+    def pack_compact_body(self, buffer, offset, layout: ActorFrameLayout, time, visemes):
+        actor = layout.actor
+
+        # pack object transform
+        offset = pack_transform_into(buffer, offset, actor.get_object().WorldTransform())
+
+        bone_transforms = [ get_transform_values(bone.WorldTransform()) for bone in actor.skin_bones ]
+        mesh_transforms = [ get_transform_values(mesh.WorldTransform()) for mesh in actor.skin_meshes ]
+
+        # pack codec header
+        tra_min, tra_extent = codec.get_translation_bounds(bone_transforms + mesh_transforms)
+        has_scale = codec.has_scale(bone_transforms) or codec.has_scale(mesh_transforms)
+        flags = codec.get_codec_flags(self.frame_codec, has_scale)
+        if flags != layout.flags:
+            # the bone stride has changed, so the next delta frame must be a key
+            layout.flags = flags
+            layout.previous = None
+        codec.COMPACT_HEADER.pack_into(buffer, offset, *tra_min, tra_extent, flags)
+        offset += codec.COMPACT_HEADER.size
+
+        # pack bone transforms
+        FRAME_COUNT.pack_into(buffer, offset, len(bone_transforms))
+        offset += FRAME_COUNT.size
+        offset = codec.pack_transforms_into(buffer, offset, bone_transforms, tra_min, tra_extent, flags)
+
+        # pack mesh transforms
+        FRAME_COUNT.pack_into(buffer, offset, len(mesh_transforms))
+        offset += FRAME_COUNT.size
+        offset = codec.pack_transforms_into(buffer, offset, mesh_transforms, tra_min, tra_extent, flags)
+
+        # pack facial expressions
+        FRAME_COUNT.pack_into(buffer, offset, len(layout.expression_names))
+        offset += FRAME_COUNT.size
+        if layout.expression_names:
+            weights = layout.FC.GetExpressionWeights(time, layout.expression_names)
+            layout.expression_struct.pack_into(buffer, offset, *codec.quantize_weights(weights, flags))
+            offset += layout.expression_struct.size
+
+        # pack visemes
+        FRAME_COUNT.pack_into(buffer, offset, layout.viseme_count)
+        offset += FRAME_COUNT.size
+        if layout.viseme_count:
+            layout.viseme_struct.pack_into(buffer, offset, *codec.quantize_weights(visemes, flags))
+            offset += layout.viseme_struct.size
+
+        return offset
+
+    def get_block_groups(self, body):
+        if codec.is_compact(self.frame_codec):
+            head_size, strides = get_compact_block_strides(body, 0, 2, 2)
+            return get_frame_block_groups(body, 0, strides, head_size)[0]
+        return get_frame_block_groups(body, 0, SEND_FRAME_STRIDES)[0]
+
+    def encode_delta(self, size, key=False):
+        """Re-packs the full frame just encoded as a delta frame against the previous frame.
+           (The link is TCP, so a receiver sent every frame always has the previous one.)"""
+        if not key:
+            key = self.delta_count % DELTA_KEY_INTERVAL == 0
+            self.delta_count += 1
+        source = memoryview(self.buffer)[:size]
+        buffer = self.delta_buffer
+        buffer[0:FRAME_HEADER.size] = source[0:FRAME_HEADER.size]
+        offset = FRAME_HEADER.size
+        layout: ActorFrameLayout
+        for layout in self.layouts:
+            header_size = len(layout.header)
+            buffer[offset:offset + header_size] = layout.header
+            offset += header_size
+            body = source[layout.body_start:layout.body_end]
+            if key or layout.previous is None:
+                buffer[offset] = DELTA_KEY
+                offset += 1
+                buffer[offset:offset + len(body)] = body
+                offset += len(body)
+                layout.groups = self.get_block_groups(body)
+            else:
+                buffer[offset] = DELTA_CHANGED
+                offset += 1
+                offset = pack_delta_block_into(buffer, offset, body, layout.previous, layout.groups)
+            layout.previous = bytes(body)
+        return memoryview(buffer)[:offset]
+
+
+class FlowControl():
+    """Credit based sliding window flow control for sequence frames.
+       At most window frames, and no more than the receiver's credits, are in flight at once.
+       The window grows by one frame per window of acked frames while the ack latency stays near
+       the lowest seen, and halves (at most once per round trip) when it rises.
+       Each session has its own flow, so a session that falls behind can skip frames:
+       the frames in flight are counted as sent, not by frame number."""
+    adaptive: bool = True
+    window: float = FLOW_INITIAL_WINDOW
+    credits: int = FLOW_MAX_WINDOW
+    batch_size: int = 1
+    sent_frame: int = 0
+    acked_frame: int = 0
+    recover_frame: int = 0
+    send_times: dict = None
+    # frame -> number of frames sent in the message it ends
+    send_counts: dict = None
+    num_in_flight: int = 0
+    latency: float = 0.0
+    min_latency: float = 0.0
+    # when the last frame was acked, or the flow started
+    progress_time: float = 0.0
+    # instrumentation
+    frame_rate: float = 0.0
+    rate_time: float = 0.0
+    rate_frames: int = 0
+    remote_rate: float = 0.0
+    remote_queue: int = 0
+
+    def __init__(self):
+        self.reset(0)
+
+    def reset(self, frame, adaptive=True, batch_size=1):
+        self.adaptive = adaptive
+        self.window = FLOW_INITIAL_WINDOW if adaptive else FLOW_MAX_WINDOW
+        self.credits = FLOW_MAX_WINDOW
+        self.batch_size = batch_size
+        self.sent_frame = frame
+        self.acked_frame = frame
+        self.recover_frame = frame
+        self.send_times = {}
+        self.send_counts = {}
+        self.num_in_flight = 0
+        self.latency = 0.0
+        self.min_latency = 0.0
+        self.progress_time = time.perf_counter()
+        self.frame_rate = 0.0
+        self.rate_time = time.perf_counter()
+        self.rate_frames = 0
+        self.remote_rate = 0.0
+        self.remote_queue = 0
+
+    def in_flight(self):
+        return self.num_in_flight
+
+    def available(self):
+        return max(0, int(min(self.window, self.credits)) - self.in_flight())
+
+    def sent(self, frame, count=1):
+        """Count frames, ending with this frame, were sent in one message."""
+        self.sent_frame = frame
+        self.send_times[frame] = time.perf_counter()
+        self.send_counts[frame] = count
+        self.num_in_flight += count
+
+    def acked(self, frame, credits=None, hold=0.0):
+        """Returns the round trip time of the link for the acked frame:
+           the ack latency less the time the receiver held the frame before acking it."""
+        t = time.perf_counter()
+        if credits is not None:
+            self.credits = max(FLOW_MIN_WINDOW, credits)
+        if frame <= self.acked_frame:
+            return None
+        num_acked = 0
+        for f in [ f for f in self.send_counts if f <= frame ]:
+            num_acked += self.send_counts.pop(f)
+        self.num_in_flight = max(0, self.num_in_flight - num_acked)
+        self.acked_frame = frame
+        self.progress_time = t
+
+        # achieved frame rate
+        self.rate_frames += num_acked
+        if t - self.rate_time >= 1.0:
+            self.frame_rate = self.rate_frames / (t - self.rate_time)
+            self.rate_time = t
+            self.rate_frames = 0
+
+        send_time = self.send_times.pop(frame, None)
+        for f in [ f for f in self.send_times if f < frame ]:
+            del self.send_times[f]
+        if send_time is None:
+            return None
+        latency = t - send_time
+        if self.latency == 0.0:
+            self.latency = self.min_latency = latency
+        else:
+            self.latency = utils.lerp(self.latency, latency, 0.25)
+            # let the base latency drift up slowly, in case the link itself has changed
+            self.min_latency = min(latency, self.min_latency * 1.01)
+
+        if self.adaptive:
+            if self.latency > self.min_latency * FLOW_LATENCY_FACTOR + FLOW_LATENCY_SLACK:
+                # frames are queueing up: back off multiplicatively, once per round trip
+                if frame > self.recover_frame:
+                    self.window = max(FLOW_MIN_WINDOW, self.window / 2)
+                    self.recover_frame = self.sent_frame
+            else:
+                # additive increase
+                self.window = min(FLOW_MAX_WINDOW, self.window + num_acked / self.window)
+        return max(0.0, latency - hold)
+
+    def is_stalled(self, timeout):
+        """Frames are waiting on acks that haven't come for longer than timeout."""
+        return self.in_flight() > 0 and time.perf_counter() - self.progress_time > timeout
+
+    def status(self):
+        return (f"Window: {int(self.window)}  In flight: {self.in_flight()}  "
+                f"Credits: {self.credits}  {self.frame_rate:.1f} fps")
+
+
+class RoundTripEstimator():
+    """Smoothed round trip time and jitter of the link (as TCP estimates them, RFC 6298),
+       and the offset of the remote monotonic clock from ours, from timestamped pings."""
+    srtt: float = 0.0
+    rttvar: float = 0.0
+    min_rtt: float = 0.0
+    clock_offset: float = 0.0
+    samples: int = 0
+    offset_samples: int = 0
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.srtt = 0.0
+        self.rttvar = 0.0
+        self.min_rtt = 0.0
+        self.clock_offset = 0.0
+        self.samples = 0
+        self.offset_samples = 0
+
+    def sample(self, rtt, offset=None):
+        if rtt is None or rtt < 0.0:
+            return
+        if self.samples == 0:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+            self.min_rtt = rtt
+        else:
+            self.rttvar = utils.lerp(self.rttvar, abs(self.srtt - rtt), 0.25)
+            self.srtt = utils.lerp(self.srtt, rtt, 0.125)
+            self.min_rtt = min(self.min_rtt, rtt)
+        if offset is not None:
+            # the offset is only as good as the symmetry of the round trip,
+            # so the samples with the lowest round trip times count the most
+            if self.offset_samples == 0 or rtt <= self.min_rtt:
+                self.clock_offset = offset
+            else:
+                self.clock_offset = utils.lerp(self.clock_offset, offset, 0.125)
+            self.offset_samples += 1
+        self.samples += 1
+
+    def timeout(self):
+        return self.srtt + 4 * self.rttvar
+
+    def status(self):
+        return f"RTT: {self.srtt * 1000:.1f} ms (+/- {self.rttvar * 1000:.1f})"
+
+
+class TakeTrack():
+    """The frames of one actor in a recorded take, as flat arrays:
+       frame numbers, 10 floats per bone per frame and the shape weights of each frame."""
+    frames: array = None
+    transforms: array = None
+    shapes: array = None
+    num_transforms: int = 0
+    num_shapes: int = 0
+
+    def __init__(self, num_transforms, num_shapes):
+        self.frames = array("i")
+        self.transforms = array("f")
+        self.shapes = array("f")
+        self.num_transforms = num_transforms
+        self.num_shapes = num_shapes
+
+    def __len__(self):
+        return len(self.frames)
+
+    def add(self, frame, transforms, shapes):
+        self.frames.append(frame)
+        self.transforms.extend(transforms)
+        self.shapes.extend(shapes)
+
+    def get_frames(self, start, end):
+        """The frame numbers, transforms and (writable) shape weights of frames start to end."""
+        end = min(end, len(self.frames))
+        nt = self.num_transforms
+        ns = self.num_shapes
+        frames = self.frames[start:end]
+        pose_frames = [ self.transforms[i * nt:(i + 1) * nt] for i in range(start, end) ]
+        shape_frames = [ self.shapes[i * ns:(i + 1) * ns] for i in range(start, end) ]
+        return frames, pose_frames, shape_frames
+
+
+class KeyReduction():
+    """Per channel tolerances for dropping keys: rotation (radians), translation and expression weight.
+       The error bound of dropping the keys that linear interpolation reproduces (posemath.reduce_keys)
+       only holds if the kept keys are interpolated linearly, and RControl.SetValue keys with the host's
+       default smooth transition, which can overshoot by far more than the tolerance.
+       linear: the kept bone keys are given linear transitions (RControl.SetKeyTransition), so linear
+       spans are reduced as well. Without it, and for expression weights which have no key transitions,
+       only keys inside spans held within tolerance are dropped (posemath.reduce_held_keys).
+       keep: indices of keys that are always written, e.g. over existing preview keys."""
+    rotation: float = KEY_REDUCE_ROTATION
+    translation: float = KEY_REDUCE_TRANSLATION
+    weight: float = KEY_REDUCE_WEIGHT
+    linear: bool = HAS_KEY_TRANSITIONS
+    keep: list = None
+
+    def __init__(self, rotation=KEY_REDUCE_ROTATION, translation=KEY_REDUCE_TRANSLATION,
+                 weight=KEY_REDUCE_WEIGHT, linear=HAS_KEY_TRANSITIONS, keep=None):
+        self.rotation = rotation
+        self.translation = translation
+        self.weight = weight
+        self.linear = linear
+        self.keep = keep
+
+    def keeping(self, keep):
+        return KeyReduction(self.rotation, self.translation, self.weight, self.linear, keep)
+
+    def reduce(self, xs, values, tolerance, linear=False):
+        """The indices of the keys to write. linear: the kept keys will be interpolated linearly."""
+        if linear:
+            indices = posemath.reduce_keys(xs, values, tolerance)
+        else:
+            indices = posemath.reduce_held_keys(values, tolerance)
+        if self.keep:
+            indices = sorted(set(indices).union(self.keep))
+        return indices
+
+
+class SequenceTake():
+    """A received sequence recorded in memory and only keyed when it ends,
+       so receiving is not held up by keying every frame as it arrives."""
+    tracks: dict = None
+    preview_interval: int = 0
+    reduction: KeyReduction = None
+
+    def __init__(self, preview_interval=RECORD_PREVIEW_INTERVAL, reduction: KeyReduction = None):
+        self.tracks = {}
+        self.preview_interval = preview_interval
+        self.reduction = reduction
+
+    def add(self, actor: LinkActor, frame, transforms, shapes):
+        if actor not in self.tracks:
+            self.tracks[actor] = TakeTrack(len(transforms), len(shapes))
+        self.tracks[actor].add(frame, transforms, shapes)
+
+    def is_preview_frame(self, frame):
+        return self.preview_interval > 0 and frame % self.preview_interval == 0
+
+    def num_frames(self):
+        return max([ len(track) for track in self.tracks.values() ], default=0)
+
+    def commit(self):
+        """Keys the recorded frames of every actor, TAKE_COMMIT_FRAMES at a time,
+           with the bone keys written control by control and reduced when there is a key reduction.
+           FK is baked to IK by end_editing."""
+        actor: LinkActor
+        track: TakeTrack
+        for actor, track in self.tracks.items():
+            # the take's curves start from its first frame, not the last preview frame
+            actor.clear_control_keys()
+            for start in range(0, len(track), TAKE_COMMIT_FRAMES):
+                frames, pose_frames, shape_frames = track.get_frames(start, start + TAKE_COMMIT_FRAMES)
+                times = [ get_frame_time(frame) for frame in frames ]
+                reduction = None
+                if self.reduction:
+                    # preview keys are already in the clip, so they must be overwritten
+                    reduction = self.reduction.keeping([ i for i, frame in enumerate(frames)
+                                                         if self.is_preview_frame(frame) ])
+                apply_poses(actor, times, pose_frames, shape_frames, bake=False, reduction=reduction)
+                if reduction:
+                    apply_expression_curves(actor, times, shape_frames, reduction)
+                else:
+                    for time, pose_data, shape_data in zip(times, pose_frames, shape_frames):
+                        apply_shapes(actor, time, PoseView(pose_data), shape_data, actor.t_pose)
+        self.tracks = {}
 
 
 class LinkData():
@@ -406,14 +1359,25 @@ class LinkData():
     sequence_current_frame: int = 0
     sequence_actors: list = None
     sequence_active: bool = False
-    #
-    ack_rate: float = 0.0
-    ack_time: float = 0.0
+    # received frames held until the end of a recorded sequence
+    sequence_take: SequenceTake = None
+    # pose frame encoders for each group of clients
+    frame_encoders: dict = None
+    actor_slots: list = None
+    delta_blocks: dict = None
+    # Flow Control
+    frame_apply_time: float = 0.0
     #
     stored_selection: list = None
 
     def __init__(self):
-        return
+        self.delta_blocks = {}
+        self.frame_encoders = {}
+
+    def get_slot_actor(self, slot) -> LinkActor:
+        if self.actor_slots and 0 <= slot < len(self.actor_slots):
+            return self.actor_slots[slot]
+        return None
 
     def find_sequence_actor(self, link_id) -> LinkActor:
         for actor in self.sequence_actors:
@@ -425,21 +1389,6 @@ class LinkData():
         return None
 
 
-def pack_string(s):
-    buffer = bytearray()
-    buffer += struct.pack("!I", len(s))
-    buffer += bytes(s, encoding="utf-8")
-    return buffer
-
-
-def unpack_string(buffer, offset=0):
-    length = struct.unpack_from("!I", buffer, offset)[0]
-    offset += 4
-    string: bytearray = buffer[offset:offset+length]
-    offset += length
-    return offset, string.decode(encoding="utf-8")
-
-
 def encode_from_json(json_data):
     json_string = json.dumps(json_data)
     json_bytes = bytearray(json_string, "utf-8")
@@ -589,6 +1538,13 @@ def get_clip_at_or_before(avatar: RIAvatar, time: RTime):
     return found_clip
 
 
+def is_same_clip(a: RIClip, b: RIClip):
+    """Each clip lookup returns a new wrapper, so compare the wrapped clips."""
+    if a is None or b is None:
+        return a is b
+    return a is b or getattr(a, "this", a) == getattr(b, "this", b)
+
+
 def make_avatar_clip(avatar, start_time, num_frames):
     fps = get_fps()
     SC: RISkeletonComponent = avatar.GetSkeletonComponent()
@@ -610,24 +1566,40 @@ def decompose_transform(T: RTransform):
     return t, r, s
 
 
-def apply_pose(actor: LinkActor, time: RTime, pose_data, shape_data, t_pose_data):
+def apply_pose(actor: LinkActor, time: RTime, pose_data, shape_data):
+    """pose_data: flat array of 10 floats per bone (tx,ty,tz,rx,ry,rz,rw,sx,sy,sz)"""
+    apply_poses(actor, [time], [pose_data], [shape_data])
+
+
+def apply_poses(actor: LinkActor, times: list, pose_frames: list, shape_frames: list,
+                bake=True, reduction: KeyReduction = None):
+    """apply_pose for consecutive frames of the same clip,
+       solved together when the pose math engine is in use.
+       A single pose with several times is solved once and keyed at all of them.
+       bake: bake FK to IK at each frame, otherwise it is left to the caller.
+       reduction: reduce the bone keys (pose math engine only)."""
     SC = actor.get_skeleton_component()
     if SC:
-        clip: RIClip = SC.GetClipByTime(time)
+        clip: RIClip = SC.GetClipByTime(times[0])
         if clip:
-            clip_time = clip.SceneTimeToClipTime(time)
-            if len(actor.bones) != len(pose_data):
-                utils.log_error("Bones do not match!")
-                return
-            root_bone: RINode = SC.GetRootBone()
-            root_rot = RQuaternion(RVector4(0,0,0,1))
-            root_tra = RVector3(0,0,0)
-            root_sca = RVector3(1,1,1)
-            apply_world_fk_pose(actor, SC, clip, clip_time,
-                                root_bone, pose_data, shape_data,
-                                t_pose_data, root_rot, root_tra, root_sca)
-            scene_time = clip.ClipTimeToSceneTime(clip_time)
-            SC.BakeFkToIk(scene_time, False)
+            clip_times = [ clip.SceneTimeToClipTime(time) for time in times ]
+            for pose_data in pose_frames:
+                if len(actor.bones) * 10 != len(pose_data):
+                    utils.log_error("Bones do not match!")
+                    return
+            if not actor.pose_plan:
+                actor.compile_pose_plan()
+            if actor.pose_arrays and use_pose_math():
+                apply_solved_fk_poses(actor, clip, clip_times, pose_frames, shape_frames, reduction)
+            elif len(pose_frames) == 1:
+                apply_world_fk_pose(actor, SC, clip, clip_times, pose_frames[0], shape_frames[0])
+            else:
+                for clip_time, pose_data, shape_data in zip(clip_times, pose_frames, shape_frames):
+                    apply_world_fk_pose(actor, SC, clip, [clip_time], pose_data, shape_data)
+            if bake:
+                for clip_time in clip_times:
+                    scene_time = clip.ClipTimeToSceneTime(clip_time)
+                    SC.BakeFkToIk(scene_time, False)
 
 
 def get_pose_local(avatar: RIAvatar):
@@ -679,6 +1651,17 @@ def fetch_transform(D):
     return tra, rot, sca
 
 
+def quaternion_tuple(q: RQuaternion):
+    return (q.x, q.y, q.z, q.w)
+
+
+def fetch_transform_at(D, i):
+    tra = RVector3(D[i], D[i+1], D[i+2])
+    rot = RQuaternion(RVector4(D[i+3], D[i+4], D[i+5], D[i+6]))
+    sca = RVector3(D[i+7], D[i+8], D[i+9])
+    return tra, rot, sca
+
+
 def fetch_pose_root_transform(actor: LinkActor, pose_data):
     SC = actor.get_skeleton_component()
     root_bone = SC.GetRootBone()
@@ -708,22 +1691,29 @@ def try_get_pose_bone(name, bones: list):
     return name
 
 
-def get_expression_counter_rotation(actor: LinkActor, bone_name, expression_weights) -> RQuaternion:
-    """TODO optimize this:
-         store expression_rotation keys as indices not names
-         only need to figure out once which bones are affected and pass that list along"""
-    exp_rotations = actor.expression_rotations
-    R = RQuaternion(RVector4(0,0,0,1))
+def get_expression_weights(actor: LinkActor, shape_data) -> dict:
+    """Returns the weights of the bone rotating expressions that are active in this frame,
+       by shape index."""
+    expression_weights = {}
+    for shape_index in actor.expression_rotation_indices:
+        w = shape_data[shape_index]
+        if w > 0.001:
+            expression_weights[shape_index] = w
+    return expression_weights
+
+
+def get_expression_counter_rotation(exp_rotations: list, expression_weights: dict) -> RQuaternion:
+    """Returns the rotation counteracting the active expressions bone rotations,
+       or None if no active expression rotates this bone."""
+    R = None
     I = RQuaternion(RVector4(0,0,0,1))
-    if True:
-        for exp_name in exp_rotations:
-            exp_index = actor.expressions[exp_name]
-            w = expression_weights[exp_index]
-            if w > 0.001:
-                if bone_name in exp_rotations[exp_name]:
-                    ERQ: RQuaternion = exp_rotations[exp_name][bone_name]
-                    ERQW = I + (ERQ - I)*w
-                    R = R.Multiply(ERQW)
+    for shape_index, ERQ in exp_rotations:
+        if shape_index in expression_weights:
+            w = expression_weights[shape_index]
+            ERQW = I + (ERQ - I)*w
+            R = ERQW if R is None else R.Multiply(ERQW)
+    if R is None:
+        return None
     return R.Inverse()
 
 
@@ -734,46 +1724,148 @@ def apply_world_ik_pose(actor, SC: RISkeletonComponent, clip: RIClip, time: RTim
     set_ik_effector(SC, clip, EHikEffector_RightFoot, time,  rot, tra, sca)
 
 
-def apply_world_fk_pose(actor, SC: RISkeletonComponent, clip, time, bone: RINode, pose_data, shape_data, t_pose_data,
-                        parent_world_rot, parent_world_tra, parent_world_sca):
-    source_name = bone.GetName()
-    bone_name = try_get_pose_bone(source_name, actor.bones)
-
-    if bone_name in actor.bones:
-
-        bone_index = actor.bones.index(bone_name)
-        world_tra, world_rot, world_sca = fetch_pose_transform(pose_data, bone_index)
-        t_pose_tra, t_pose_rot, t_pose_sca = fetch_pose_transform(t_pose_data, source_name)
-        local_rot, local_tra, local_sca = calc_local(world_rot, world_tra, world_sca,
-                                                     parent_world_rot, parent_world_tra, parent_world_sca)
-        # don't apply any translation to twist or share bones
-        if "Twist" in bone_name or "Share" in bone_name:
-            local_tra = t_pose_tra
-        if actor.use_drivers and bone_name in actor.face_drivers:
-            apply_face_drivers(actor, bone_name, shape_data, local_rot, parent_world_rot, t_pose_rot)
-        ec_rot = get_expression_counter_rotation(actor, bone_name, shape_data)
-        set_bone_control(SC, clip, bone, time, ec_rot,
-                         t_pose_rot, t_pose_tra, t_pose_sca,
-                         local_rot, local_tra, local_sca)
-
-        children = bone.GetChildren()
-        for child in children:
-            apply_world_fk_pose(actor, SC, clip, time, child, pose_data, shape_data,
-                                t_pose_data, world_rot, world_tra, world_sca)
-    else:
-
-        # don't follow twist or share bones
-        if "Twist" in bone_name or "Share" in bone_name:
-            return
-
-        t_pose_tra, t_pose_rot, t_pose_sca = fetch_pose_transform(t_pose_data, source_name)
-        world_rot, world_tra, world_sca = calc_world(t_pose_rot, t_pose_tra, t_pose_sca,
-                                                     parent_world_rot, parent_world_tra, parent_world_sca)
+def use_pose_math():
+    """The pose math engine only replaces the host math once it has been checked against it."""
+    global POSE_MATH_CHECKED
+    if not USE_POSE_MATH:
+        return False
+    if POSE_MATH_CHECKED is None:
+        error = get_pose_math_error()
+        POSE_MATH_CHECKED = error < POSE_MATH_TOLERANCE
+        if POSE_MATH_CHECKED:
+            utils.log_info(f"Using pose math engine ({'NumPy' if posemath.HAS_NUMPY else 'Python'})")
+        else:
+            utils.log_warn(f"Pose math engine does not match the host math ({error}), using the host math")
+    return POSE_MATH_CHECKED
+
+
+POSE_MATH_CHECKED = None
+
+
+def get_pose_math_error(count=32):
+    """The largest difference between the pose math engine and the host math,
+       in quaternion products, rotated vectors and XYZ euler angles of random rotations."""
+    rnd = random.Random(0)
+    def random_quaternion():
+        q = [ rnd.gauss(0, 1) for i in range(0, 4) ]
+        l = math.sqrt(sum(v*v for v in q))
+        return tuple(v / l for v in q)
+    error = 0.0
+    for i in range(0, count):
+        a = random_quaternion()
+        b = random_quaternion()
+        v = (rnd.uniform(-1, 1), rnd.uniform(-1, 1), rnd.uniform(-1, 1))
+        QA = RQuaternion(RVector4(*a))
+        QB = RQuaternion(RVector4(*b))
+        QP = QA.Multiply(QB)
+        p = posemath.qmul(a, b)
+        error = max(error, abs(QP.x - p[0]), abs(QP.y - p[1]), abs(QP.z - p[2]), abs(QP.w - p[3]))
+        V = QA.MultiplyVector(RVector3(*v))
+        r = posemath.qrot(a, v)
+        error = max(error, abs(V.x - r[0]), abs(V.y - r[1]), abs(V.z - r[2]))
+        x = y = z = 0
+        E = QP.ToRotationMatrix().ToEulerAngle(EEulerOrder_XYZ, x, y, z)
+        e = posemath.euler_xyz(p)
+        for k in range(0, 3):
+            error = max(error, abs(math.remainder(E[k] - e[k], 2 * math.pi)))
+    return error
+
+
+def apply_world_fk_pose(actor: LinkActor, SC: RISkeletonComponent, clip, times: list, pose_data, shape_data):
+    """Solves the pose once with the host math and keys it at each of the (clip) times,
+       the pose math engine is dispatched to by apply_poses."""
+    plan = actor.pose_plan
+    bone_controls = actor.get_bone_controls(clip)
+    expression_weights = get_expression_weights(actor, shape_data)
+    num_slots = len(plan)
+    world_rots = [None] * num_slots
+    world_tras = [None] * num_slots
+    world_scas = [None] * num_slots
+    root_rot = RQuaternion(RVector4(0,0,0,1))
+    root_tra = RVector3(0,0,0)
+    root_sca = RVector3(1,1,1)
+
+    entry: PoseBone
+    for slot, entry in enumerate(plan):
+
+        parent = entry.parent
+        if parent >= 0:
+            parent_world_rot = world_rots[parent]
+            parent_world_tra = world_tras[parent]
+            parent_world_sca = world_scas[parent]
+        else:
+            parent_world_rot = root_rot
+            parent_world_tra = root_tra
+            parent_world_sca = root_sca
+
+        if entry.pose_index >= 0:
+
+            world_tra, world_rot, world_sca = fetch_transform_at(pose_data, entry.pose_index * 10)
+            local_rot, local_tra, local_sca = calc_local(world_rot, world_tra, world_sca,
+                                                         parent_world_rot, parent_world_tra, parent_world_sca)
+            if entry.lock_translation:
+                local_tra = entry.t_pose_tra
+            if entry.face_driver:
+                apply_face_drivers(actor, entry.name, shape_data, local_rot, parent_world_rot, entry.t_pose_rot)
+            controls = bone_controls[slot]
+            if controls:
+                ec_rot = None
+                if entry.exp_rotations and expression_weights:
+                    ec_rot = get_expression_counter_rotation(entry.exp_rotations, expression_weights)
+                set_bone_control(controls, times, ec_rot,
+                                 entry.t_pose_rot, entry.t_pose_tra, entry.t_pose_sca,
+                                 local_rot, local_tra, local_sca)
+        else:
 
-        children = bone.GetChildren()
-        for child in children:
-            apply_world_fk_pose(actor, SC, clip, time, child, pose_data, shape_data,
-                                t_pose_data, world_rot, world_tra, world_sca)
+            world_rot, world_tra, world_sca = calc_world(entry.t_pose_rot, entry.t_pose_tra, entry.t_pose_sca,
+                                                         parent_world_rot, parent_world_tra, parent_world_sca)
+
+        world_rots[slot] = world_rot
+        world_tras[slot] = world_tra
+        world_scas[slot] = world_sca
+
+
+def apply_solved_fk_poses(actor: LinkActor, clip, times, pose_frames, shape_frames, reduction: KeyReduction = None):
+    """apply_world_fk_pose for consecutive frames, with the whole poses solved by the pose math engine
+       and their euler curves converted together, continuing from the last keys.
+       A single pose is keyed at all the times. Only the control values are set through the host."""
+    plan = actor.pose_plan
+    arrays = actor.pose_arrays
+    bone_controls = actor.get_bone_controls(clip)
+    counter_rot_frames = [ get_expression_counter_rotations(actor, shape_data) for shape_data in shape_frames ]
+    previous = [ bone_controls[slot].euler if bone_controls[slot] else None for slot in arrays.posed ]
+    solutions = posemath.solve_poses(arrays, pose_frames, counter_rot_frames, previous)
+    key_solutions = solutions if len(solutions) == len(times) else [ solutions[0] ] * len(times)
+    for i, slot in enumerate(arrays.posed):
+        entry: PoseBone = plan[slot]
+        if entry.face_quats:
+            t_pose_rot = arrays.t_pose_rot(slot)
+            for solution, shape_data in zip(solutions, shape_frames):
+                for shape_index, weight in posemath.face_driver_weights(solution.local_rots[i],
+                                                                        t_pose_rot, entry.face_quats):
+                    shape_data[shape_index] = weight
+        controls = bone_controls[slot]
+        if controls:
+            # CC/iC doesn't support bone scaling in human animations? so use the t-pose scale
+            set_control_curves(controls, times,
+                               [ solution.euler[i] for solution in key_solutions ],
+                               [ solution.tra[i] for solution in key_solutions ],
+                               arrays.t_pose_sca(slot), reduction)
+
+
+def get_expression_counter_rotations(actor: LinkActor, shape_data) -> dict:
+    """The pose math expression counter rotations of the posed slots in this frame, by slot."""
+    expression_weights = get_expression_weights(actor, shape_data)
+    if not expression_weights:
+        return None
+    counter_rots = {}
+    for slot in actor.pose_arrays.posed:
+        entry: PoseBone = actor.pose_plan[slot]
+        if entry.exp_quats:
+            ec_rot = posemath.expression_counter_rotation(entry.exp_quats, expression_weights)
+            if ec_rot is not None:
+                counter_rots[slot] = ec_rot
+    return counter_rots
 
 
 def calc_world(local_rot: RQuaternion, local_tra: RVector3, local_sca: RVector3,
@@ -806,23 +1898,19 @@ def set_bone_transform(clip, bone, time,
         transform_control.SetValue(time, T)
 
 
-def set_bone_control(SC, clip, bone, time, ec_rot: RQuaternion,
+def set_bone_control(controls: BoneControls, times: list, ec_rot: RQuaternion,
                      t_pose_rot: RQuaternion, t_pose_tra: RVector3, t_pose_sca: RVector3,
                      local_rot: RQuaternion, local_tra: RVector3, local_sca: RVector3):
-    clip_bone_control: RControl = clip.GetControl("Layer", bone)
-    if clip_bone_control:
-        # get local transform relative to T-pose
-        # CC/iC doesn't support bone scaling in human animations? so use the t-pose scale
-        sca = t_pose_sca #local_sca / t_pose_sca
-        tra = local_tra - t_pose_tra
-        # counteract expression rotations
-        exp_local_rot = local_rot.Multiply(ec_rot)
-        # get relative to t-pose
-        rot = exp_local_rot.Multiply(t_pose_rot.Inverse())
-        # apply to clip
-        clip_data_block: RDataBlock = clip_bone_control.GetDataBlock()
-        if clip_data_block:
-            set_control_data(SC, clip_data_block, time, rot, tra, sca)
+    # get local transform relative to T-pose
+    # CC/iC doesn't support bone scaling in human animations? so use the t-pose scale
+    sca = t_pose_sca #local_sca / t_pose_sca
+    tra = local_tra - t_pose_tra
+    # counteract expression rotations
+    exp_local_rot = local_rot.Multiply(ec_rot) if ec_rot is not None else local_rot
+    # get relative to t-pose
+    rot = exp_local_rot.Multiply(t_pose_rot.Inverse())
+    # apply to clip, at each time
+    set_control_keys(controls, times, rot, tra, sca)
 
 
 def set_ik_effector(SC: RISkeletonComponent, clip: RIClip, effector_type, time: RTime,
@@ -836,20 +1924,74 @@ def set_ik_effector(SC: RISkeletonComponent, clip: RIClip, effector_type, time:
 
 def set_control_data(SC: RISkeletonComponent, data_block: RDataBlock, time: RTime,
                      rot: RQuaternion, tra: RVector3, sca: RVector3):
+    set_control_values(BoneControls(data_block), time, rot, tra, sca)
+
+
+def set_control_values(controls: BoneControls, time: RTime,
+                       rot: RQuaternion, tra: RVector3, sca: RVector3):
+    set_control_keys(controls, [time], rot, tra, sca)
+
+
+def set_control_keys(controls: BoneControls, times: list,
+                     rot: RQuaternion, tra: RVector3, sca: RVector3):
+    """Keys the same rotation, translation and scale at each time, converted to euler angles once."""
     rot_matrix: RMatrix3 = rot.ToRotationMatrix()
     x = y = z = 0
     euler = rot_matrix.ToEulerAngle(EEulerOrder_XYZ, x, y, z)
-    data_block.GetControl("Rotation/RotationX").SetValue(time, euler[0])
-    data_block.GetControl("Rotation/RotationY").SetValue(time, euler[1])
-    data_block.GetControl("Rotation/RotationZ").SetValue(time, euler[2])
-    if data_block.GetControl("Position/PositionX") is not None:
-        data_block.GetControl("Position/PositionX").SetValue(time, tra.x)
-        data_block.GetControl("Position/PositionY").SetValue(time, tra.y)
-        data_block.GetControl("Position/PositionZ").SetValue(time, tra.z)
-    if data_block.GetControl("Position/ScaleX") is not None:
-        data_block.GetControl("Position/ScaleX").SetValue(time, sca.x)
-        data_block.GetControl("Position/ScaleY").SetValue(time, sca.y)
-        data_block.GetControl("Position/ScaleZ").SetValue(time, sca.z)
+    euler = posemath.unwrap_euler((euler[0], euler[1], euler[2]), controls.euler)
+    set_control_curves(controls, times, [ euler ] * len(times), [ (tra.x, tra.y, tra.z) ] * len(times),
+                       (sca.x, sca.y, sca.z))
+
+
+def set_control_euler(controls: BoneControls, time: RTime, euler, tra, sca):
+    """euler: XYZ euler angles (radians), tra: (x,y,z), sca: (x,y,z)"""
+    controls.euler = euler
+    controls.rot_x.SetValue(time, euler[0])
+    controls.rot_y.SetValue(time, euler[1])
+    controls.rot_z.SetValue(time, euler[2])
+    if controls.pos_x is not None:
+        controls.pos_x.SetValue(time, tra[0])
+        controls.pos_y.SetValue(time, tra[1])
+        controls.pos_z.SetValue(time, tra[2])
+    if controls.sca_x is not None:
+        controls.sca_x.SetValue(time, sca[0])
+        controls.sca_y.SetValue(time, sca[1])
+        controls.sca_z.SetValue(time, sca[2])
+
+
+def set_control_curves(controls: BoneControls, times: list, euler: list, tra: list, sca,
+                       reduction: KeyReduction = None):
+    """set_control_euler for consecutive frames, a control at a time:
+       euler and tra: a (x,y,z) per frame, sca: (x,y,z) for all frames.
+       With a reduction, only the keys needed to stay within its tolerances are written."""
+    if not times:
+        return
+    controls.euler = euler[-1]
+    xs = [ time.GetValue() for time in times ] if reduction else None
+    for k, control in enumerate((controls.rot_x, controls.rot_y, controls.rot_z)):
+        set_control_curve(control, times, [ e[k] for e in euler ],
+                          xs, reduction, reduction.rotation if reduction else 0.0)
+    if controls.pos_x is not None:
+        for k, control in enumerate((controls.pos_x, controls.pos_y, controls.pos_z)):
+            set_control_curve(control, times, [ t[k] for t in tra ],
+                              xs, reduction, reduction.translation if reduction else 0.0)
+    if controls.sca_x is not None:
+        for k, control in enumerate((controls.sca_x, controls.sca_y, controls.sca_z)):
+            set_control_curve(control, times, [ sca[k] ] * len(times),
+                              xs, reduction, reduction.translation if reduction else 0.0)
+
+
+def set_control_curve(control: RControl, times: list, values: list,
+                      xs: list = None, reduction: KeyReduction = None, tolerance=0.0):
+    if reduction:
+        linear = reduction.linear
+        for i in reduction.reduce(xs, values, tolerance, linear):
+            control.SetValue(times[i], values[i])
+            if linear:
+                control.SetKeyTransition(times[i], ETransitionType_Linear, KEY_TRANSITION_STRENGTH)
+    else:
+        for time, value in zip(times, values):
+            control.SetValue(time, value)
 
 
 def set_transform_control(time, obj: RIObject, loc: RVector3, rot: RQuaternion, sca: RVector3):
@@ -891,19 +2033,10 @@ def apply_face_drivers(actor: LinkActor, bone_name, shape_data,
 
 
 def apply_shapes(actor: LinkActor, time: RTime, pose_data, shape_data, t_pose_data):
-    FC = actor.get_face_component()
     VC = actor.get_viseme_component()
     MC = actor.get_morph_component()
 
-    if FC and actor.expressions:
-        expressions = [expression for expression in actor.expressions]
-        strengths = [shape_data[idx] for idx in actor.expressions.values()]
-        #FC.BeginKeyEditing()
-        FC.AddExpressivenessKey(time, 1.0)
-        res = FC.AddExpressionKeys(time, expressions, strengths, RTime.FromValue(1))
-        if res.IsError():
-            utils.log_error("Failed to set expressions")
-        #FC.EndKeyEditing()
+    apply_expression_keys(actor, [time], shape_data)
 
     # can only have one active viseme key at a time?
     # disabled for now: viseme's need their own system...
@@ -930,19 +2063,579 @@ def apply_shapes(actor: LinkActor, time: RTime, pose_data, shape_data, t_pose_da
 
 
 
+def apply_expression_keys(actor: LinkActor, times: list, shape_data):
+    """Keys the same expression weights at each time, gathered once."""
+    FC = actor.get_face_component()
+    if FC and actor.expressions:
+        expressions = [expression for expression in actor.expressions]
+        strengths = [shape_data[idx] for idx in actor.expressions.values()]
+        #FC.BeginKeyEditing()
+        for time in times:
+            FC.AddExpressivenessKey(time, 1.0)
+            res = FC.AddExpressionKeys(time, expressions, strengths, RTime.FromValue(1))
+            if res.IsError():
+                utils.log_error("Failed to set expressions")
+        #FC.EndKeyEditing()
+
+
+def apply_expression_curves(actor: LinkActor, times: list, shape_frames: list, reduction: KeyReduction):
+    """apply_shapes for consecutive frames, with each expression's weight keys reduced
+       and only the expressions keyed at each time added together."""
+    FC = actor.get_face_component()
+    if not (FC and actor.expressions and times):
+        return
+    keyed = [ ([], []) for time in times ]
+    for expression, shape_index in actor.expressions.items():
+        values = [ shape_data[shape_index] for shape_data in shape_frames ]
+        # expression keys can't be given linear transitions
+        for i in reduction.reduce(None, values, reduction.weight):
+            keyed[i][0].append(expression)
+            keyed[i][1].append(values[i])
+    for time, (expressions, strengths) in zip(times, keyed):
+        if expressions:
+            FC.AddExpressivenessKey(time, 1.0)
+            res = FC.AddExpressionKeys(time, expressions, strengths, RTime.FromValue(1))
+            if res.IsError():
+                utils.log_error("Failed to set expressions")
+
+
+class MessageReader():
+    """Reassembles framed messages from the client socket across timer ticks, without ever blocking.
+       The socket is only read when the selector says it is readable, and at most budget bytes per tick.
+       Headers and payloads are read with recv_into straight into their buffers, each payload into a
+       bytearray preallocated to the size in its header, which is then handed to parse without a copy."""
+    sock: socket.socket = None
+    selector: selectors.BaseSelector = None
+    header: bytearray = None
+    op_code: int = 0
+    payload: bytearray = None
+    received: int = 0
+    budget: int = 0
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(sock, selectors.EVENT_READ)
+        self.header = bytearray(FRAME_HEADER.size)
+        self.reset()
+
+    def reset(self):
+        self.op_code = 0
+        self.payload = None
+        self.received = 0
+
+    def close(self):
+        self.selector.close()
+
+    def is_partial(self):
+        return self.received > 0 or self.payload is not None
+
+    def is_readable(self):
+        return len(self.selector.select(0)) > 0
+
+    def begin(self, budget=RECV_BYTE_BUDGET):
+        self.budget = budget
+
+    def next_message(self):
+        """Returns the next complete (op_code, data) message, or None if there isn't one yet
+           or the byte budget is spent. Raises ConnectionError when the socket closes."""
+        while self.budget > 0:
+            if self.payload is None:
+                view = memoryview(self.header)[self.received:]
+            else:
+                view = memoryview(self.payload)[self.received:]
+            if not self.is_readable():
+                return None
+            try:
+                n = self.sock.recv_into(view, min(len(view), self.budget))
+            except (BlockingIOError, InterruptedError):
+                return None
+            if n == 0:
+                raise ConnectionError("Socket closed by client")
+            self.budget -= n
+            self.received += n
+            if n < len(view):
+                continue
+            if self.payload is None:
+                self.op_code, size = FRAME_HEADER.unpack_from(self.header)
+                if size == 0:
+                    message = (self.op_code, None)
+                    self.reset()
+                    return message
+                self.payload = bytearray(size)
+                self.received = 0
+            else:
+                message = (self.op_code, self.payload)
+                self.reset()
+                return message
+        return None
+
+
+# only the most recent of these messages matters, a newer one replaces any still waiting to be sent
+LATEST_WINS = { OpCodes.CAMERA_SYNC, OpCodes.FRAME_SYNC, OpCodes.POSE_FRAME }
+# logical channels of chunked messages, in order of priority
+CHANNEL_CONTROL = 0
+CHANNEL_BULK = 1
+CONTROL_OPCODES = { OpCodes.HELLO, OpCodes.PING, OpCodes.STOP, OpCodes.DISCONNECT,
+                    OpCodes.DEBUG, OpCodes.NOTIFY, OpCodes.SEQUENCE_ACK }
+# chunk: channel, flags, op_code and total size of the chunked message, then the chunk data
+CHUNK_HEADER = struct.Struct("!BBII")
+CHUNK_FIRST = 1
+CHUNK_LAST = 2
+CHUNK_CANCEL = 4
+CHUNK_SIZE = MAX_CHUNK_SIZE
+
+
+# binary frame data, which doesn't compress well and is time critical
+UNCOMPRESSED_OPCODES = { OpCodes.POSE_FRAME, OpCodes.SEQUENCE_FRAME, OpCodes.SEQUENCE_FRAMES,
+                         OpCodes.SEQUENCE_ACK, OpCodes.CHUNK }
+
+
+def get_channel(op_code):
+    return CHANNEL_CONTROL if (op_code & ~COMPRESSED_FLAG) in CONTROL_OPCODES else CHANNEL_BULK
+
+
+class SendQueue():
+    """Outgoing messages waiting for the (non-blocking) client socket to become writable.
+       Header and payload are written together with sendmsg, without joining them.
+       A message is written straight away when nothing is queued ahead of it, and only copied
+       (if it is a view of a reused buffer) when some of it has to wait.
+       When chunked, messages larger than a chunk go out as CHUNK frames, one chunk at a time,
+       and the control channel is always scheduled before the next bulk chunk."""
+    sock: socket.socket = None
+    channels: list = None
+    # the wire frame being written: header, payload, bytes sent, queue entry
+    current: list = None
+    chunked: bool = False
+    size: int = 0
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.channels = [ deque(), deque() ]
+        self.current = None
+        self.size = 0
+
+    def is_empty(self):
+        return self.current is None and not any(self.channels)
+
+    def is_full(self):
+        return self.size > SEND_HIGH_WATER
+
+    def push(self, op_code, payload):
+        channel = get_channel(op_code) if self.chunked else CHANNEL_BULK
+        if (op_code & ~COMPRESSED_FLAG) in LATEST_WINS:
+            self.remove_stale(op_code & ~COMPRESSED_FLAG)
+        # entry: op_code, payload, bytes of payload framed so far, channel
+        entry = [op_code, payload, 0, channel]
+        self.channels[channel].append(entry)
+        self.size += len(payload) if payload else 0
+        if self.current is None and sum(len(c) for c in self.channels) == 1:
+            self.flush()
+        if isinstance(payload, memoryview):
+            # whatever is still waiting can't stay a view of a buffer the caller will reuse
+            if any(e is entry for e in self.channels[channel]):
+                entry[1] = bytes(payload)
+            if self.current and self.current[3] is entry:
+                self.current[1] = bytes(self.current[1])
+
+    def remove_stale(self, op_code):
+        for i, channel in enumerate(self.channels):
+            # partly sent messages must be finished
+            keep = deque()
+            for entry in channel:
+                if (entry[0] & ~COMPRESSED_FLAG) == op_code and entry[2] == 0:
+                    self.size -= len(entry[1]) if entry[1] else 0
+                else:
+                    keep.append(entry)
+            self.channels[i] = keep
+
+    def cancel(self, channel=CHANNEL_BULK):
+        """Drops everything queued on the channel. A partly sent chunked message is cancelled
+           on the receiving end with a cancel chunk, straight after the chunk being written."""
+        queue = self.channels[channel]
+        partial = queue and queue[0][2] > 0
+        for entry in queue:
+            self.size -= (len(entry[1]) - entry[2]) if entry[1] else 0
+        queue.clear()
+        if partial:
+            queue.append([OpCodes.CHUNK, None, -1, channel])
+
+    def next_frame(self):
+        for queue in self.channels:
+            if not queue:
+                continue
+            entry = queue[0]
+            op_code, payload, offset, channel = entry
+            size = len(payload) if payload else 0
+            if offset < 0:
+                queue.popleft()
+                header = (FRAME_HEADER.pack(OpCodes.CHUNK, CHUNK_HEADER.size) +
+                          CHUNK_HEADER.pack(channel, CHUNK_CANCEL, 0, 0))
+                return [header, None, 0, entry]
+            if not self.chunked or (offset == 0 and size <= CHUNK_SIZE):
+                queue.popleft()
+                self.size -= size
+                return [FRAME_HEADER.pack(op_code, size), payload, 0, entry]
+            n = min(CHUNK_SIZE, size - offset)
+            flags = (CHUNK_FIRST if offset == 0 else 0) | (CHUNK_LAST if offset + n >= size else 0)
+            header = (FRAME_HEADER.pack(OpCodes.CHUNK, CHUNK_HEADER.size + n) +
+                      CHUNK_HEADER.pack(channel, flags, op_code, size))
+            entry[2] += n
+            self.size -= n
+            if flags & CHUNK_LAST:
+                queue.popleft()
+            return [header, memoryview(payload)[offset:offset + n], 0, entry]
+        return None
+
+    def flush(self):
+        """Writes as much as the socket will take without blocking."""
+        while True:
+            if self.current is None:
+                self.current = self.next_frame()
+                if self.current is None:
+                    return
+            header, payload, sent, entry = self.current
+            header_size = len(header)
+            size = header_size + (len(payload) if payload else 0)
+            if sent < header_size:
+                if HAS_SENDMSG:
+                    buffers = [memoryview(header)[sent:]]
+                    if payload:
+                        buffers.append(memoryview(payload))
+                else:
+                    # one send for the header and (the start of) the payload, not a tiny header segment
+                    buffers = [bytes(memoryview(header)[sent:]) +
+                               (bytes(memoryview(payload)[:SEND_JOIN_SIZE]) if payload else b"")]
+            else:
+                buffers = [memoryview(payload)[sent - header_size:]]
+            try:
+                if HAS_SENDMSG:
+                    n = self.sock.sendmsg(buffers)
+                else:
+                    n = self.sock.send(buffers[0])
+            except (BlockingIOError, InterruptedError):
+                return
+            self.current[2] += n
+            if self.current[2] >= size:
+                self.current = None
+
+    def flush_blocking(self, timeout):
+        self.sock.settimeout(timeout)
+        try:
+            self.flush()
+        finally:
+            self.sock.setblocking(False)
+
+
+class ChunkAssembler():
+    """Reassembles chunked messages, separately for each channel.
+       Compressed messages are decompressed as their chunks arrive."""
+    messages: dict = None
+
+    def __init__(self):
+        self.messages = {}
+
+    def add(self, data):
+        """Adds a chunk, returns the (op_code, data) message when it is complete."""
+        channel, flags, op_code, size = CHUNK_HEADER.unpack_from(data)
+        if flags & CHUNK_CANCEL:
+            self.messages.pop(channel, None)
+            return None
+        if flags & CHUNK_FIRST:
+            if op_code & COMPRESSED_FLAG:
+                self.messages[channel] = [op_code & ~COMPRESSED_FLAG, bytearray(), 0, zlib.decompressobj()]
+            else:
+                self.messages[channel] = [op_code, bytearray(size), 0, None]
+        message = self.messages.get(channel)
+        if not message:
+            return None
+        buffer: bytearray = message[1]
+        decompressor = message[3]
+        chunk = memoryview(data)[CHUNK_HEADER.size:]
+        if decompressor:
+            buffer.extend(decompressor.decompress(chunk))
+        else:
+            buffer[message[2]:message[2] + len(chunk)] = chunk
+            message[2] += len(chunk)
+        if flags & CHUNK_LAST:
+            del self.messages[channel]
+            if decompressor:
+                buffer.extend(decompressor.flush())
+            return (message[0], buffer if buffer else None)
+        return None
+
+
+def decompress_payload(data):
+    decompressor = zlib.decompressobj()
+    payload = bytearray(decompressor.decompress(data))
+    payload.extend(decompressor.flush())
+    return payload
+
+
+class LinkIOThread(threading.Thread):
+    """Owns the client socket of the link: reads and reassembles incoming messages into the receive queue
+       and writes outgoing messages through its own SendQueue, so the host UI thread never blocks on the socket.
+       Sends, cancels and the chunking setting are passed over as commands, so the send queue
+       (chunked control/bulk scheduling, latest-wins and cancel) is only ever touched by this thread.
+       deque append and popleft are atomic, so the queues need no locks.
+       Only framing happens here, everything else stays on the main thread."""
+    sock: socket.socket = None
+    receive_queue: deque = None
+    # (command, args) from the main thread: send (op_code, payload), cancel (channel), chunked (bool)
+    commands: deque = None
+    send_queue: SendQueue = None
+    # bytes queued by the main thread and taken into the send queue by the IO thread,
+    # each only updated by its own thread
+    queued_bytes: int = 0
+    taken_bytes: int = 0
+    running: bool = False
+    closed: bool = False
+    error: Exception = None
+
+    def __init__(self, sock: socket.socket):
+        threading.Thread.__init__(self, name="DataLink IO", daemon=True)
+        self.sock = sock
+        self.receive_queue = deque()
+        self.commands = deque()
+        self.send_queue = SendQueue(sock)
+        # written to, to wake the select when there is something to send
+        self.wake_recv, self.wake_send = socket.socketpair()
+        self.running = True
+
+    def send(self, op_code, payload):
+        if isinstance(payload, memoryview):
+            # the caller will reuse the buffer
+            payload = bytes(payload)
+        size = len(payload) if payload else 0
+        self.queued_bytes += size
+        self.command(IO_SEND, (op_code, payload, size))
+
+    def cancel(self, channel=CHANNEL_BULK):
+        self.command(IO_CANCEL, channel)
+
+    def set_chunked(self, chunked):
+        self.command(IO_CHUNKED, chunked)
+
+    def command(self, command, args):
+        self.commands.append((command, args))
+        try:
+            self.wake_send.send(b"\x00")
+        except:
+            pass
+
+    def queued_size(self):
+        """Bytes waiting to be sent: not yet taken by the IO thread, or still in its send queue."""
+        return self.queued_bytes - self.taken_bytes + self.send_queue.size
+
+    def stop(self):
+        self.running = False
+        try:
+            self.wake_send.send(b"\x00")
+        except:
+            pass
+        if threading.current_thread() is not self:
+            self.join(SOCKET_TIMEOUT)
+        self.wake_recv.close()
+        self.wake_send.close()
+
+    def run_commands(self):
+        while self.commands:
+            command, args = self.commands.popleft()
+            if command == IO_SEND:
+                op_code, payload, size = args
+                self.send_queue.push(op_code, payload)
+                self.taken_bytes += size
+            elif command == IO_CANCEL:
+                self.send_queue.cancel(args)
+            elif command == IO_CHUNKED:
+                self.send_queue.chunked = args
+
+    def run(self):
+        self.sock.setblocking(False)
+        reader = MessageReader(self.sock)
+        try:
+            while self.running:
+                self.run_commands()
+                writers = EMPTY_SOCKETS if self.send_queue.is_empty() else [self.sock]
+                r,w,x = select.select([self.sock, self.wake_recv], writers, EMPTY_SOCKETS, IO_THREAD_TIMEOUT)
+                if self.wake_recv in r:
+                    self.wake_recv.recv(4096)
+                if self.sock in r:
+                    reader.begin()
+                    message = reader.next_message()
+                    while message:
+                        self.receive_queue.append(message)
+                        message = reader.next_message()
+                if w:
+                    self.send_queue.flush()
+            # flush anything left to send (i.e. STOP or DISCONNECT)
+            self.run_commands()
+            self.send_queue.flush_blocking(SOCKET_TIMEOUT)
+        except ConnectionError:
+            self.closed = True
+        except Exception as e:
+            self.error = e
+            self.closed = True
+        finally:
+            reader.close()
+
+
+class LinkCapabilities():
+    """The protocol capabilities both ends of the link agreed on in the HELLO exchange.
+       A remote with no capabilities block gets the original protocol:
+       no optional features, FLOAT32 pose frames and no compression.
+       The lossy compact pose frame codecs are only offered with DATALINK_COMPACT_FRAMES."""
+    version: int = 0
+    features: list = None
+    frame_codec: str = codec.FLOAT32
+    compress_threshold: int = 0
+    compress_level: int = COMPRESS_LEVEL
+
+    def __init__(self):
+        self.features = []
+
+    @staticmethod
+    def local():
+        return {
+            "version": CAPABILITIES_VERSION,
+            "features": LINK_FEATURES,
+            "codecs": codec.get_link_codecs(prefs.DATALINK_COMPACT_FRAMES),
+            "compression": { "threshold": COMPRESS_THRESHOLD, "level": COMPRESS_LEVEL },
+        }
+
+    @staticmethod
+    def from_hello(json_data):
+        """The capabilities agreed with the remote's HELLO capabilities block."""
+        return LinkCapabilities.negotiate(json_data.get("Capabilities"))
+
+    @staticmethod
+    def negotiate(remote: dict):
+        agreed = LinkCapabilities()
+        if not remote or remote.get("version", 0) < 1:
+            return agreed
+        agreed.version = min(CAPABILITIES_VERSION, remote["version"])
+        remote_features = remote.get("features", [])
+        agreed.features = [ feature for feature in LINK_FEATURES if feature in remote_features ]
+        agreed.frame_codec = codec.negotiate(remote.get("codecs", []),
+                                             codec.get_link_codecs(prefs.DATALINK_COMPACT_FRAMES))
+        remote_compression = remote.get("compression")
+        if remote_compression:
+            # compress only what both ends think is worth compressing, at our own level
+            agreed.compress_threshold = max(COMPRESS_THRESHOLD, remote_compression.get("threshold", 0))
+            agreed.compress_level = COMPRESS_LEVEL
+        return agreed
+
+    @staticmethod
+    def common(capabilities_list):
+        """The capabilities all the links agreed on, for messages encoded once and sent to all of them."""
+        if not capabilities_list:
+            return LinkCapabilities()
+        if len(capabilities_list) == 1:
+            return capabilities_list[0]
+        common = LinkCapabilities()
+        common.version = min(c.version for c in capabilities_list)
+        common.features = [ feature for feature in LINK_FEATURES
+                            if all(c.has_feature(feature) for c in capabilities_list) ]
+        frame_codecs = set(c.frame_codec for c in capabilities_list)
+        common.frame_codec = frame_codecs.pop() if len(frame_codecs) == 1 else codec.FLOAT32
+        return common
+
+    def has_feature(self, feature):
+        return feature in self.features
+
+    def format_key(self):
+        """Links with the same key can be sent the same encoded messages."""
+        return (tuple(self.features), self.frame_codec)
+
+    def log(self):
+        utils.log_info(f"Link capabilities (v{self.version}): {self.features}")
+        utils.log_info(f"Pose frame codec: {self.frame_codec}")
+        if self.compress_threshold:
+            utils.log_info(f"Compressing messages over {self.compress_threshold} bytes")
+
+
+class LinkSession():
+    """A client connection of the link service: its socket and IO, the remote props,
+       the capabilities negotiated with it, its round trip times and its sequence flow control."""
+    sock: socket.socket = None
+    ip: str = "127.0.0.1"
+    port: int = BLENDER_PORT
+    is_connected: bool = False
+    is_connecting: bool = False
+    ping_timer: float = 0
+    keepalive_timer: float = 0
+    is_data: bool = False
+    # remote props
+    remote_app: str = None
+    remote_version: str = None
+    remote_path: str = None
+    remote_addon: str = None
+    capabilities: LinkCapabilities = None
+    rtt: RoundTripEstimator = None
+    # sequence
+    flow: FlowControl = None
+    in_sequence: bool = False
+    # IO
+    io_thread: LinkIOThread = None
+    reader: MessageReader = None
+    send_queue: SendQueue = None
+    chunks: ChunkAssembler = None
+    read_notifier: QSocketNotifier = None
+    write_notifier: QSocketNotifier = None
+
+    def __init__(self, sock: socket.socket, ip, port):
+        self.sock = sock
+        self.ip = ip
+        self.port = port
+        self.is_connected = False
+        self.is_connecting = True
+        self.keepalive_timer = KEEPALIVE_TIMEOUT_S
+        self.ping_timer = PING_INTERVAL_S
+        self.capabilities = LinkCapabilities()
+        self.rtt = RoundTripEstimator()
+        self.flow = FlowControl()
+
+    def is_open(self):
+        return self.sock is not None and (self.is_connected or self.is_connecting)
+
+    def is_send_blocked(self):
+        if self.send_queue is not None:
+            return self.send_queue.is_full()
+        if self.io_thread is not None:
+            return self.io_thread.queued_size() > SEND_HIGH_WATER
+        return False
+
+    def name(self):
+        return f"{self.ip}:{self.port}"
+
+
+class LinkSessionGroup():
+    """Sessions that agreed on the same capabilities, so messages are encoded once for all of them."""
+    key: tuple = None
+    capabilities: LinkCapabilities = None
+    sessions: list = None
+
+    def __init__(self, capabilities: LinkCapabilities):
+        self.key = capabilities.format_key()
+        self.capabilities = capabilities
+        self.sessions = []
+
+
 class LinkService(QObject):
     timer: QTimer = None
+    idle_timer: QTimer = None
+    idle_time: float = 0
     server_sock: socket.socket = None
-    client_sock: socket.socket = None
     server_sockets = []
-    client_sockets = []
     empty_sockets = []
-    client_ip: str = "127.0.0.1"
-    client_port: int = BLENDER_PORT
+    sessions: list = None
+    # the session whose message is being parsed, replies only go back to it
+    session: LinkSession = None
+    # the group of sessions being encoded for, sends only go to it
+    group: LinkSessionGroup = None
+    # the capabilities all the sessions share, for messages sent to all of them
+    shared_capabilities: LinkCapabilities = None
     is_listening: bool = False
-    is_connected: bool = False
-    is_connecting: bool = False
-    ping_timer: float = 0
     keepalive_timer: float = 0
     time: float = 0
     is_data: bool = False
@@ -967,14 +2660,12 @@ class LinkService(QObject):
     local_app: str = None
     local_version: str = None
     local_path: str = None
-    # remote props
-    remote_app: str = None
-    remote_version: str = None
-    remote_path: str = None
-    remote_addon: str = None
+    server_notifier: QSocketNotifier = None
 
     def __init__(self):
         QObject.__init__(self)
+        self.sessions = []
+        self.shared_capabilities = LinkCapabilities()
         atexit.register(self.service_stop)
 
     def __enter__(self):
@@ -983,6 +2674,83 @@ class LinkService(QObject):
     def __exit__(self):
         self.service_stop()
 
+    def primary(self) -> LinkSession:
+        """The session being replied to, or the first open session."""
+        if self.session:
+            return self.session
+        for session in self.sessions:
+            if session.is_open():
+                return session
+        return None
+
+    @property
+    def is_connected(self):
+        return any(session.is_connected for session in self.sessions)
+
+    @property
+    def is_connecting(self):
+        return any(session.is_connecting for session in self.sessions)
+
+    @property
+    def remote_app(self):
+        session = self.primary()
+        return session.remote_app if session else None
+
+    @property
+    def remote_version(self):
+        session = self.primary()
+        return session.remote_version if session else None
+
+    @property
+    def remote_path(self):
+        session = self.primary()
+        return session.remote_path if session else None
+
+    @property
+    def remote_addon(self):
+        session = self.primary()
+        return session.remote_addon if session else None
+
+    @property
+    def capabilities(self) -> LinkCapabilities:
+        if self.session:
+            return self.session.capabilities
+        if self.group:
+            return self.group.capabilities
+        return self.shared_capabilities
+
+    @property
+    def rtt(self) -> RoundTripEstimator:
+        session = self.primary()
+        return session.rtt if session else RoundTripEstimator()
+
+    def update_capabilities(self):
+        self.shared_capabilities = LinkCapabilities.common([ session.capabilities for session in self.sessions
+                                                             if session.is_connected ])
+
+    def get_session_groups(self, sessions=None):
+        """Groups the sessions (by default the sessions a send would go to) by their capabilities."""
+        if sessions is None:
+            sessions = [self.session] if self.session else self.sessions
+        groups = {}
+        for session in sessions:
+            if session.is_open():
+                key = session.capabilities.format_key()
+                if key not in groups:
+                    groups[key] = LinkSessionGroup(session.capabilities)
+                groups[key].sessions.append(session)
+        return list(groups.values())
+
+    def each_group(self, sessions=None):
+        """Iterates the groups of the sessions, with the service encoding with the group's
+           capabilities and sending only to the group while it is the current one."""
+        for group in self.get_session_groups(sessions):
+            self.group = group
+            try:
+                yield group
+            finally:
+                self.group = None
+
     def start_server(self):
         if not self.server_sock:
             try:
@@ -994,6 +2762,8 @@ class LinkService(QObject):
                 #self.server_sock.setblocking(True)
                 self.server_sockets = [self.server_sock]
                 self.is_listening = True
+                if USE_SOCKET_NOTIFIERS:
+                    self.server_notifier = self.make_notifier(self.server_sock, self.accept)
                 utils.log_info(f"Listening on TCP *:{RL_PORT}")
                 self.listening.emit()
                 self.changed.emit()
@@ -1004,6 +2774,7 @@ class LinkService(QObject):
                 utils.log_error(f"Unable to start server on TCP *:{RL_PORT}")
 
     def stop_server(self):
+        self.server_notifier = self.remove_notifier(self.server_notifier)
         if self.server_sock:
             utils.log_info(f"Closing Server Socket")
             try:
@@ -1017,8 +2788,31 @@ class LinkService(QObject):
         self.server_stopped.emit()
         self.changed.emit()
 
+    def make_notifier(self, sock: socket.socket, func, type=QSocketNotifier.Read):
+        notifier = QSocketNotifier(sock.fileno(), type, self)
+        notifier.activated.connect(lambda *args: func())
+        return notifier
+
+    def remove_notifier(self, notifier: QSocketNotifier):
+        if notifier:
+            notifier.setEnabled(False)
+            notifier.deleteLater()
+        return None
+
+    def update_timer(self):
+        """With socket notifiers, the sockets wake the service when there is something to read,
+           so the timer only needs to run for sequences or the IO thread queues.
+           Ping and keepalive run from the idle timer."""
+        if USE_SOCKET_NOTIFIERS:
+            io_threads = any(session.io_thread for session in self.sessions)
+            if self.is_sequence or io_threads:
+                if not self.timer or not self.timer.isActive():
+                    self.start_timer()
+            else:
+                self.stop_timer()
+
     def start_timer(self):
-        self.time = time.time()
+        self.time = time.perf_counter()
         if not self.timer:
             self.timer = QTimer(self)
             self.timer.setInterval(TIMER_INTERVAL)
@@ -1027,43 +2821,46 @@ class LinkService(QObject):
         utils.log_info(f"Service timer started")
 
     def stop_timer(self):
-        if self.timer:
+        if self.timer and self.timer.isActive():
             self.timer.stop()
             utils.log_info(f"Service timer stopped")
 
+    def start_idle_timer(self):
+        self.idle_time = time.perf_counter()
+        if not self.idle_timer:
+            self.idle_timer = QTimer(self)
+            self.idle_timer.setInterval(IDLE_TIMER_INTERVAL)
+            self.idle_timer.timeout.connect(self.idle_loop)
+        if not self.idle_timer.isActive():
+            self.idle_timer.start()
+
+    def stop_idle_timer(self):
+        if self.idle_timer and self.idle_timer.isActive():
+            self.idle_timer.stop()
+
     def try_start_client(self, host, port):
-        if not self.client_sock:
+        if not self.sessions:
             utils.log_info(f"Attempting to connect")
             try:
                 sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 sock.settimeout(SOCKET_TIMEOUT)
                 sock.connect((host, port))
                 #sock.setblocking(False)
-                self.is_connected = False
-                self.is_connecting = True
-                self.client_sock = sock
-                self.client_sockets = [sock]
-                self.client_ip = self.host_ip
-                self.client_port = self.host_port
-                self.keepalive_timer = KEEPALIVE_TIMEOUT_S
-                self.ping_timer = PING_INTERVAL_S
-                utils.log_info(f"Connecting to data-link server on {self.host_ip}:{self.host_port}")
-                self.send_hello()
+                session = LinkSession(sock, host, port)
+                self.add_session(session)
+                utils.log_info(f"Connecting to data-link server on {host}:{port}")
+                self.send_hello(session)
                 self.connecting.emit()
                 self.changed.emit()
                 return True
             except:
-                self.client_sock = None
-                self.client_sockets = []
-                self.is_connected = False
-                self.is_connecting = False
                 utils.log_info(f"Client socket connect failed!")
                 return False
         else:
             utils.log_info(f"Client already connected!")
             return True
 
-    def send_hello(self):
+    def send_hello(self, session: LinkSession):
         self.local_app = RApplication.GetProductName()
         self.local_version = RApplication.GetProductVersion()
         prefs.check_paths(quiet=True, create=True)
@@ -1073,93 +2870,212 @@ class LinkService(QObject):
             "Version": self.local_version,
             "Path": self.local_path,
             "Plugin": vars.VERSION,
-            "Exe": RApplication.GetProgramPath()
+            "Exe": RApplication.GetProgramPath(),
+            "Capabilities": LinkCapabilities.local(),
         }
-        self.send(OpCodes.HELLO, encode_from_json(json_data))
+        self.send(OpCodes.HELLO, encode_from_json(json_data), session=session)
+
+    def add_session(self, session: LinkSession):
+        self.sessions.append(session)
+        self.start_client_io(session)
 
-    def stop_client(self):
-        if self.client_sock:
-            utils.log_info(f"Closing Client Socket")
+    def start_client_io(self, session: LinkSession):
+        session.chunks = ChunkAssembler()
+        # small messages (acks, pose frames, chunk headers) must not wait on Nagle and delayed ACKs
+        try:
+            session.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except:
+            utils.log_warn(f"Unable to set TCP_NODELAY: {session.name()}")
+        if USE_IO_THREAD:
+            session.io_thread = LinkIOThread(session.sock)
+            session.io_thread.start()
+            utils.log_info(f"Link IO thread started: {session.name()}")
+            self.update_timer()
+        else:
+            # reads and writes never wait on the socket
+            session.sock.setblocking(False)
+            session.reader = MessageReader(session.sock)
+            session.send_queue = SendQueue(session.sock)
+            if USE_SOCKET_NOTIFIERS:
+                session.read_notifier = self.make_notifier(session.sock, lambda: self.recv(session))
+                session.write_notifier = self.make_notifier(session.sock, lambda: self.flush(session),
+                                                            QSocketNotifier.Write)
+                session.write_notifier.setEnabled(False)
+
+    def stop_client_io(self, session: LinkSession):
+        session.read_notifier = self.remove_notifier(session.read_notifier)
+        session.write_notifier = self.remove_notifier(session.write_notifier)
+        if session.send_queue:
+            # finish sending anything queued (i.e. STOP or DISCONNECT)
             try:
-                self.client_sock.shutdown()
-                self.client_sock.close()
+                session.send_queue.flush_blocking(SOCKET_TIMEOUT)
             except:
                 pass
-        self.is_connected = False
-        self.is_connecting = False
-        self.client_sock = None
-        self.client_sockets = []
-        if self.listening:
+            session.send_queue = None
+        if session.io_thread:
+            session.io_thread.stop()
+            session.io_thread = None
+            utils.log_info(f"Link IO thread stopped: {session.name()}")
+        if session.reader:
+            session.reader.close()
+            session.reader = None
+
+    def stop_client(self, session: LinkSession = None):
+        """Closes the session, or all of them."""
+        if session is None:
+            for session in list(self.sessions):
+                self.stop_client(session)
+            return
+        self.stop_client_io(session)
+        if session.sock:
+            utils.log_info(f"Closing Client Socket: {session.name()}")
+            try:
+                session.sock.shutdown()
+                session.sock.close()
+            except:
+                pass
+        session.is_connected = False
+        session.is_connecting = False
+        session.sock = None
+        if session in self.sessions:
+            self.sessions.remove(session)
+        self.update_capabilities()
+        self.update_timer()
+        if self.is_listening and not self.sessions:
             self.keepalive_timer = HANDSHAKE_TIMEOUT_S
         self.client_stopped.emit()
         self.changed.emit()
 
-    def has_client_sock(self):
-        if self.client_sock and (self.is_connected or self.is_connecting):
-            return True
-        else:
-            return False
+    def has_feature(self, feature):
+        """Is the protocol feature supported by both ends of the link,
+           or by all of the links when sending to all of them"""
+        return self.capabilities.has_feature(feature)
+
+    def receive_queue_depth(self):
+        """The number of received messages waiting to be parsed."""
+        session = self.primary()
+        if session and session.io_thread:
+            return len(session.io_thread.receive_queue)
+        return 0
+
+    def send_ping(self, session: LinkSession):
+        self.send(OpCodes.PING, PING_MESSAGE.pack(PING_REQUEST, time.perf_counter(), 0.0), session=session)
+
+    def receive_ping(self, data):
+        kind, sent_time, remote_time = PING_MESSAGE.unpack_from(data)
+        if kind == PING_REQUEST:
+            self.send(OpCodes.PING, PING_MESSAGE.pack(PING_REPLY, sent_time, time.perf_counter()))
+        elif kind == PING_REPLY and self.session:
+            t = time.perf_counter()
+            # assumes the remote timestamp was taken half way through the round trip
+            self.session.rtt.sample(t - sent_time, remote_time - (sent_time + t) / 2)
 
-    def recv(self):
-        self.is_data = False
-        if self.has_client_sock():
-            try:
-                r,w,x = select.select(self.client_sockets, self.empty_sockets, self.empty_sockets, 0)
-            except Exception as e:
-                utils.log_error("Client socket recv:select failed!", e)
-                self.client_lost()
+    def has_client_sock(self):
+        return any(session.is_open() for session in self.sessions)
+
+    def unpack_message(self, session: LinkSession, op_code, data):
+        """Reassembles chunks and decompresses compressed messages.
+           Returns the complete (op_code, data) message, or None if it isn't complete yet."""
+        if op_code == OpCodes.CHUNK:
+            return session.chunks.add(data)
+        if op_code & COMPRESSED_FLAG:
+            return (op_code & ~COMPRESSED_FLAG, decompress_payload(data))
+        return (op_code, data)
+
+    def compress_message(self, capabilities: LinkCapabilities, op_code, binary_data):
+        threshold = capabilities.compress_threshold
+        if (threshold and binary_data and len(binary_data) >= threshold and
+            op_code not in UNCOMPRESSED_OPCODES):
+            compressed = zlib.compress(binary_data, capabilities.compress_level)
+            if len(compressed) < len(binary_data):
+                return op_code | COMPRESSED_FLAG, compressed
+        return op_code, binary_data
+
+    def dispatch(self, session: LinkSession, op_code, data):
+        """Parses a message from the session, anything sent in reply only goes back to it."""
+        self.session = session
+        try:
+            self.parse(op_code, data)
+            self.received.emit(op_code, data)
+        finally:
+            self.session = None
+
+    def recv_queued(self, session: LinkSession):
+        """Parses the messages the session's IO thread has received."""
+        session.is_data = False
+        io_thread = session.io_thread
+        count = 0
+        while io_thread.receive_queue:
+            message = self.unpack_message(session, *io_thread.receive_queue.popleft())
+            if not message:
+                continue
+            op_code, data = message
+            self.dispatch(session, op_code, data)
+            count += 1
+            # parse may have received a disconnect notice
+            if not session.is_open():
+                return
+            session.is_data = len(io_thread.receive_queue) > 0
+            if op_code == OpCodes.SEQUENCE_FRAME or op_code == OpCodes.SEQUENCE_FRAMES:
+                return
+            if op_code == OpCodes.POSE_FRAME:
                 return
+            if count >= MAX_RECEIVE or op_code == OpCodes.NOTIFY:
+                return
+        if io_thread.closed:
+            if io_thread.error:
+                utils.log_error("Client socket IO thread failed!", io_thread.error)
+            else:
+                utils.log_warn("Socket closed by client")
+            self.client_lost(session)
+
+    def recv(self, session: LinkSession = None):
+        """Receives from the session, or from all of them."""
+        if session is None:
+            for session in list(self.sessions):
+                self.recv(session)
+            self.is_data = any(session.is_data for session in self.sessions)
+            return
+        if session.io_thread:
+            self.recv_queued(session)
+            return
+        session.is_data = False
+        if session.is_open() and session.reader:
+            reader = session.reader
+            reader.begin()
             count = 0
-            while r:
-                op_code = None
+            while True:
                 try:
-                    header = self.client_sock.recv(8)
-                    if header == 0:
-                        utils.log_warn("Socket closed by client")
-                        self.client_lost()
-                        return
-                except Exception as e:
-                    utils.log_error("Client socket recv:recv header failed!", e)
-                    self.client_lost()
+                    message = reader.next_message()
+                except ConnectionError:
+                    utils.log_warn("Socket closed by client")
+                    self.client_lost(session)
                     return
-                if header and len(header) == 8:
-                    op_code, size = struct.unpack("!II", header)
-                    data = None
-                    if size > 0:
-                        data = bytearray()
-                        while size > 0:
-                            chunk_size = min(size, MAX_CHUNK_SIZE)
-                            try:
-                                chunk = self.client_sock.recv(chunk_size)
-                            except Exception as e:
-                                utils.log_error("Client socket recv:recv chunk failed!", e)
-                                self.client_lost()
-                                return
-                            data.extend(chunk)
-                            size -= len(chunk)
-                    self.parse(op_code, data)
-                    self.received.emit(op_code, data)
-                    count += 1
-                self.is_data = False
-                if op_code == OpCodes.SEQUENCE_FRAME:
-                    self.is_data = True
+                except Exception as e:
+                    utils.log_error("Client socket recv failed!", e)
+                    self.client_lost(session)
                     return
-                if op_code == OpCodes.POSE_FRAME:
-                    self.is_data = False
+                if not message:
+                    # the rest of a partial message arrives on later ticks
+                    session.is_data = reader.is_partial()
                     return
+                message = self.unpack_message(session, *message)
+                if not message:
+                    continue
+                op_code, data = message
+                self.dispatch(session, op_code, data)
+                count += 1
                 # parse may have received a disconnect notice
-                if not self.has_client_sock():
+                if not session.is_open():
                     return
-                try:
-                    r,w,x = select.select(self.client_sockets, self.empty_sockets, self.empty_sockets, 0)
-                except Exception as e:
-                    utils.log_error("Client socket recv:select (reselect) failed!", e)
-                    self.client_lost()
+                session.is_data = True
+                if op_code == OpCodes.SEQUENCE_FRAME or op_code == OpCodes.SEQUENCE_FRAMES:
+                    return
+                if op_code == OpCodes.POSE_FRAME:
+                    session.is_data = False
+                    return
+                if count >= MAX_RECEIVE or op_code == OpCodes.NOTIFY:
                     return
-                if r:
-                    self.is_data = True
-                    if count >= MAX_RECEIVE or op_code == OpCodes.NOTIFY:
-                        return
 
     def accept(self):
         if self.server_sock and self.is_listening:
@@ -1171,51 +3087,67 @@ class LinkService(QObject):
                     utils.log_error("Server socket accept failed!")
                     self.service_lost()
                     return
-                if self.is_connected:
-                    self.send(OpCodes.DISCONNECT)
-                    self.stop_client()
-                self.client_sock = sock
-                self.client_sockets = [sock]
-                self.client_ip = address[0]
-                self.client_port = address[1]
-                self.is_connected = False
-                self.is_connecting = True
-                self.keepalive_timer = KEEPALIVE_TIMEOUT_S
-                self.ping_timer = PING_INTERVAL_S
-                utils.log_info(f"Incoming connection received from: {address[0]}:{address[1]}")
-                self.send_hello()
-                self.accepted.emit(self.client_ip, self.client_port)
-                self.changed.emit()
+                if len(self.sessions) >= MAX_CLIENTS:
+                    utils.log_warn(f"Too many clients, refusing connection from: {address[0]}:{address[1]}")
+                    try:
+                        sock.sendall(FRAME_HEADER.pack(OpCodes.DISCONNECT, 0))
+                        sock.close()
+                    except:
+                        pass
+                else:
+                    session = LinkSession(sock, address[0], address[1])
+                    self.add_session(session)
+                    utils.log_info(f"Incoming connection received from: {address[0]}:{address[1]}")
+                    self.send_hello(session)
+                    self.accepted.emit(session.ip, session.port)
+                    self.changed.emit()
                 r,w,x = select.select(self.server_sockets, self.empty_sockets, self.empty_sockets, 0)
 
     def parse(self, op_code, data):
-        self.keepalive_timer = KEEPALIVE_TIMEOUT_S
+        session = self.session
+        session.keepalive_timer = KEEPALIVE_TIMEOUT_S
         if op_code == OpCodes.HELLO:
-            utils.log_info(f"Hello Received")
+            utils.log_info(f"Hello Received: {session.name()}")
             if data:
                 json_data = decode_to_json(data)
-                self.remote_app = json_data["Application"]
-                self.remote_version = json_data["Version"]
-                self.remote_path = json_data["Path"]
-                self.remote_addon = json_data.get("Addon", "x.x.x")
-                utils.log_info(f"Connected to: {self.remote_app} {self.remote_version} / {self.remote_addon}")
-                utils.log_info(f"Using file path: {self.remote_path}")
-            self.service_initialize()
+                session.remote_app = json_data["Application"]
+                session.remote_version = json_data["Version"]
+                session.remote_path = json_data["Path"]
+                session.remote_addon = json_data.get("Addon", "x.x.x")
+                session.capabilities = LinkCapabilities.from_hello(json_data)
+                session.capabilities.log()
+                if session.send_queue:
+                    session.send_queue.chunked = session.capabilities.has_feature("CHUNKED")
+                if session.io_thread:
+                    session.io_thread.set_chunked(session.capabilities.has_feature("CHUNKED"))
+                utils.log_info(f"Connected to: {session.remote_app} {session.remote_version} / {session.remote_addon}")
+                utils.log_info(f"Using file path: {session.remote_path}")
+            self.service_initialize(session)
             if data:
                 self.changed.emit()
         elif op_code == OpCodes.PING:
-            utils.log_info(f"Ping Received")
-            pass
+            if data and len(data) == PING_MESSAGE.size:
+                self.receive_ping(data)
+            else:
+                utils.log_info(f"Ping Received")
         elif op_code == OpCodes.STOP:
-            utils.log_info(f"Termination Received")
-            self.service_stop()
+            utils.log_info(f"Termination Received: {session.name()}")
+            if len(self.sessions) > 1:
+                # only the client that sent it is leaving
+                self.stop_client(session)
+            else:
+                self.service_stop()
         elif op_code == OpCodes.DISCONNECT:
-            utils.log_info(f"Disconnection Received")
-            self.service_recv_disconnected()
+            utils.log_info(f"Disconnection Received: {session.name()}")
+            self.service_recv_disconnected(session)
 
     def service_start(self, host, port):
         if not self.is_listening:
-            self.start_timer()
+            self.start_idle_timer()
+            if USE_SOCKET_NOTIFIERS:
+                self.update_timer()
+            else:
+                self.start_timer()
             if SERVER_ONLY:
                 self.start_server()
             else:
@@ -1223,35 +3155,39 @@ class LinkService(QObject):
                     if not CLIENT_ONLY:
                         self.start_server()
 
-    def service_initialize(self):
-        if self.is_connecting:
-            self.is_connecting = False
-            self.is_connected = True
+    def service_initialize(self, session: LinkSession):
+        if session.is_connecting:
+            session.is_connecting = False
+            session.is_connected = True
+            self.update_capabilities()
             self.connected.emit()
             self.changed.emit()
 
-    def service_recv_disconnected(self):
-        self.stop_client()
+    def service_recv_disconnected(self, session: LinkSession):
+        self.stop_client(session)
 
     def service_stop(self):
+        self.cancel_bulk()
         self.send(OpCodes.STOP)
         self.stop_client()
         self.stop_timer()
+        self.stop_idle_timer()
         self.stop_server()
 
     def service_lost(self):
         self.lost_connection.emit()
         self.stop_timer()
+        self.stop_idle_timer()
         self.stop_client()
         self.stop_server()
 
-    def client_lost(self):
+    def client_lost(self, session: LinkSession):
         self.lost_connection.emit()
-        self.stop_client()
+        self.stop_client(session)
 
     def loop(self):
         try:
-            current_time = time.time()
+            current_time = time.perf_counter()
             delta_time = current_time - self.time
             self.time = current_time
             if delta_time > 0:
@@ -1261,30 +3197,15 @@ class LinkService(QObject):
                 #    utils.log_info(f"LinkServer loop timer rate: {self.loop_rate}")
                 self.loop_count += 1
 
-            if self.is_connected:
-                self.ping_timer -= delta_time
-                self.keepalive_timer -= delta_time
-
-                if USE_PING and self.ping_timer <= 0:
-                    self.send(OpCodes.PING)
-
-                if USE_KEEPALIVE and self.keepalive_timer <= 0:
-                    utils.log_info("lost connection!")
-                    self.service_stop()
-
-            elif self.is_listening:
-                self.keepalive_timer -= delta_time
-
-                if USE_KEEPALIVE and self.keepalive_timer <= 0:
-                    utils.log_info("no connection within time limit!")
-                    self.service_stop()
-
             # accept incoming connections
             self.accept()
 
             # receive client data
             self.recv()
 
+            # send anything still queued
+            self.flush()
+
             # run anything in sequence
             if prefs.DATALINK_FRAME_SYNC:
                 self.sequence.emit()
@@ -1297,29 +3218,169 @@ class LinkService(QObject):
             traceback.print_exc()
             return TIMER_INTERVAL
 
+    def idle_loop(self):
+        """Pings idle sessions, so their round trip times stay current when no acks arrive,
+           and drops sessions (or stops listening) past their keepalive time."""
+        try:
+            current_time = time.perf_counter()
+            delta_time = current_time - self.idle_time
+            self.idle_time = current_time
+
+            if self.is_connected:
+                for session in list(self.sessions):
+                    if not session.is_connected:
+                        continue
+                    session.ping_timer -= delta_time
+                    session.keepalive_timer -= delta_time
+
+                    if session.ping_timer <= 0:
+                        if session.capabilities.has_feature("BINARY_ACK"):
+                            # idle round trip probe
+                            self.send_ping(session)
+                        elif USE_PING:
+                            self.send(OpCodes.PING, session=session)
+
+                    if USE_KEEPALIVE and session.keepalive_timer <= 0:
+                        utils.log_info(f"lost connection! {session.name()}")
+                        self.client_lost(session)
+
+            elif self.is_listening:
+                self.keepalive_timer -= delta_time
+
+                if USE_KEEPALIVE and self.keepalive_timer <= 0:
+                    utils.log_info("no connection within time limit!")
+                    self.service_stop()
+
+        except Exception as e:
+            utils.log_error("LinkService idle loop crash!")
+            traceback.print_exc()
 
-    def send(self, op_code, binary_data = None):
+
+    def send(self, op_code, binary_data = None, session: LinkSession = None):
+        """Sends to the session, or in reply to the session being parsed,
+           or to the current group, otherwise to all the open sessions."""
+        session = session or self.session
+        if session:
+            self.send_to([session], op_code, binary_data)
+        elif self.group:
+            self.send_to(self.group.sessions, op_code, binary_data)
+        else:
+            self.send_to(self.sessions, op_code, binary_data)
+
+    def send_to_sequence(self, op_code, binary_data = None):
+        """Sends to the sessions taking part in the sequence."""
+        self.send_to(self.get_sequence_sessions(), op_code, binary_data)
+
+    def send_to(self, sessions, op_code, binary_data = None):
+        """Sends the message to each of the sessions: encoded once, compressed at most once per
+           compression setting, and queued on each session's socket."""
         try:
-            if self.client_sock and (self.is_connected or self.is_connecting):
-                data_length = len(binary_data) if binary_data else 0
-                header = struct.pack("!II", op_code, data_length)
-                data = bytearray()
-                data.extend(header)
-                if binary_data:
-                    data.extend(binary_data)
-                try:
-                    self.client_sock.sendall(data)
-                except Exception as e:
-                    utils.log_error("Client socket sendall failed!")
-                    self.client_lost()
-                    return
-                self.ping_timer = PING_INTERVAL_S
-                self.sent.emit()
+            sessions = [ session for session in sessions if session.is_open() ]
+            if not sessions:
+                return
+            if len(sessions) > 1 and isinstance(binary_data, memoryview):
+                # one copy of a reused encode buffer, shared by the send queues
+                binary_data = bytes(binary_data)
+            compressed = {}
+            for session in sessions:
+                key = (session.capabilities.compress_threshold, session.capabilities.compress_level)
+                if key not in compressed:
+                    compressed[key] = self.compress_message(session.capabilities, op_code, binary_data)
+                self.send_session(session, *compressed[key])
+            self.sent.emit()
 
         except:
             utils.log_error("LinkService send failed!")
             traceback.print_exc()
 
+    def send_session(self, session: LinkSession, op_code, binary_data):
+        if session.send_queue:
+            try:
+                session.send_queue.push(op_code, binary_data)
+            except Exception as e:
+                utils.log_error("Client socket send failed!", e)
+                self.client_lost(session)
+                return
+            self.update_write_notifier(session)
+            session.ping_timer = PING_INTERVAL_S
+            return
+        if session.io_thread:
+            session.io_thread.send(op_code, binary_data)
+            session.ping_timer = PING_INTERVAL_S
+            return
+        data_length = len(binary_data) if binary_data else 0
+        header = struct.pack("!II", op_code, data_length)
+        data = bytearray()
+        data.extend(header)
+        if binary_data:
+            data.extend(binary_data)
+        try:
+            session.sock.sendall(data)
+        except Exception as e:
+            utils.log_error("Client socket sendall failed!")
+            self.client_lost(session)
+            return
+        session.ping_timer = PING_INTERVAL_S
+
+    def flush(self, session: LinkSession = None):
+        """Sends what is queued for the session, or for all of them."""
+        if session is None:
+            for session in list(self.sessions):
+                self.flush(session)
+            return
+        if session.send_queue and session.is_open():
+            try:
+                session.send_queue.flush()
+            except Exception as e:
+                utils.log_error("Client socket send failed!", e)
+                self.client_lost(session)
+                return
+            self.update_write_notifier(session)
+
+    def update_write_notifier(self, session: LinkSession):
+        if session.write_notifier and session.send_queue:
+            session.write_notifier.setEnabled(not session.send_queue.is_empty())
+
+    def cancel_bulk(self):
+        """Drops any bulk messages still waiting to be sent."""
+        for session in self.sessions:
+            if session.send_queue:
+                session.send_queue.cancel(CHANNEL_BULK)
+                self.update_write_notifier(session)
+            if session.io_thread:
+                session.io_thread.cancel(CHANNEL_BULK)
+
+    def get_sequence_sessions(self):
+        return [ session for session in self.sessions if session.in_sequence and session.is_open() ]
+
+    def start_sequence_flow(self, frame, adaptive=True, batch_size=1):
+        """The connected sessions take part in the sequence from the frame after this one."""
+        for session in self.sessions:
+            if session.is_connected:
+                session.in_sequence = True
+                session.flow.reset(frame, adaptive, batch_size)
+
+    def end_sequence_flow(self, session: LinkSession = None):
+        for s in self.sessions:
+            if session is None or s is session:
+                s.in_sequence = False
+
+    def sequence_available(self, session: LinkSession):
+        """The number of frames the session can be sent now, by its own window and credits.
+           A session with more queued than its socket can keep up with is sent nothing until it drains."""
+        if session.is_send_blocked():
+            return 0
+        return session.flow.available()
+
+    def get_stalled_sessions(self, timeout=SEQUENCE_STALL_TIMEOUT):
+        """The sequence sessions that have acked nothing for longer than timeout,
+           while another session is keeping up."""
+        sessions = self.get_sequence_sessions()
+        stalled = [ session for session in sessions if session.flow.is_stalled(timeout) ]
+        if len(stalled) < len(sessions):
+            return stalled
+        return []
+
     def start_sequence(self, func=None):
         self.is_sequence = True
         if func:
@@ -1328,11 +3389,14 @@ class LinkService(QObject):
             try: self.sequence.disconnect()
             except: pass
         self.changed.emit()
+        self.update_timer()
         self.timer.setInterval(1000/60)
 
     def stop_sequence(self):
         self.is_sequence = False
-        self.timer.setInterval(TIMER_INTERVAL)
+        if self.timer:
+            self.timer.setInterval(TIMER_INTERVAL)
+        self.update_timer()
         try: self.sequence.disconnect()
         except: pass
         self.changed.emit()
@@ -1381,6 +3445,7 @@ class DataLink(QObject):
     callback_id = None
     # UI
     label_header: QLabel = None
+    label_flow: QLabel = None
     button_link: QPushButton = None
     textbox_host: QLineEdit = None
     combo_target: QComboBox = None
@@ -1475,6 +3540,7 @@ class DataLink(QObject):
         qt.spacing(layout, 10)
 
         self.label_status = qt.label(layout, "...", style=qt.STYLE_RL_DESC, no_size=True)
+        self.label_flow = qt.label(layout, "", style=qt.STYLE_RL_DESC, no_size=True)
 
         qt.spacing(layout, 10)
 
@@ -1908,6 +3974,9 @@ class DataLink(QObject):
         if op_code == OpCodes.SEQUENCE_FRAME:
             self.receive_sequence_frame(data)
 
+        if op_code == OpCodes.SEQUENCE_FRAMES:
+            self.receive_sequence_frames(data)
+
         if op_code == OpCodes.SEQUENCE_END:
             self.receive_sequence_end(data)
 
@@ -1940,6 +4009,16 @@ class DataLink(QObject):
         if self.is_connected():
             self.service.send(op_code, data)
 
+    def use_feature(self, feature):
+        if self.service:
+            return self.service.has_feature(feature)
+        return False
+
+    def get_frame_codec(self):
+        if self.service:
+            return self.service.capabilities.frame_codec
+        return codec.FLOAT32
+
     def is_sequence_running(self):
         return self.data.sequence_active and self.service.is_sequence
 
@@ -2339,7 +4418,7 @@ class DataLink(QObject):
             "actors": actor_data
         }
         actor: LinkActor
-        for actor in actors:
+        for slot, actor in enumerate(actors):
             SC: RISkeletonComponent = actor.get_skeleton_component()
             FC: RIFaceComponent = actor.get_face_component()
             VC: RIVisemeComponent = actor.get_viseme_component()
@@ -2367,12 +4446,15 @@ class DataLink(QObject):
                 "name": actor.name,
                 "type": actor.get_type(),
                 "link_id": actor.get_link_id(),
+                "slot": slot,
                 "bones": bones,
                 "meshes": meshes,
                 "expressions": expressions,
                 "visemes": visemes,
                 "morphs": morphs,
             })
+        # the frame layouts depend on the skin bones & meshes just gathered
+        self.data.frame_encoders = {}
         return encode_from_json(character_template)
 
     def encode_pose_data(self, actors):
@@ -2405,75 +4487,17 @@ class DataLink(QObject):
             })
         return encode_from_json(data)
 
-    def encode_pose_frame_data(self, actors: list):
-        data = bytearray()
-        data += struct.pack("!II", len(actors), get_current_frame())
-        actor: LinkActor
-        for actor in actors:
-            SC: RISkeletonComponent = actor.get_skeleton_component()
-            FC: RIFaceComponent = actor.get_face_component()
-            VC: RIVisemeComponent = actor.get_viseme_component()
-            MC: RIMorphComponent = actor.get_morph_component()
-
-            skin_bones = actor.skin_bones
-            skin_meshes = actor.skin_meshes
-
-            data += pack_string(actor.name)
-            data += pack_string(actor.get_type())
-            data += pack_string(actor.get_link_id())
-
-            # pack object transform
-            T: RTransform = actor.get_object().WorldTransform()
-            t: RVector3 = T.T()
-            r: RQuaternion = T.R()
-            s: RVector3 = T.S()
-            data += struct.pack("!ffffffffff", t.x, t.y, t.z, r.x, r.y, r.z, r.w, s.x, s.y, s.z)
-
-            # pack bone transforms
-            data += struct.pack("!I", len(skin_bones))
-            bone: RIObject
-            for bone in skin_bones:
-                T: RTransform = bone.WorldTransform()
-                t: RVector3 = T.T()
-                r: RQuaternion = T.R()
-                s: RVector3 = T.S()
-                data += struct.pack("!ffffffffff", t.x, t.y, t.z, r.x, r.y, r.z, r.w, s.x, s.y, s.z)
-
-            # pack mesh transforms
-            data += struct.pack("!I", len(skin_meshes))
-            bone: RIObject
-            for bone in skin_meshes:
-                T: RTransform = bone.WorldTransform()
-                t: RVector3 = T.T()
-                r: RQuaternion = T.R()
-                s: RVector3 = T.S()
-                data += struct.pack("!ffffffffff", t.x, t.y, t.z, r.x, r.y, r.z, r.w, s.x, s.y, s.z)
-
-            # pack facial expressions
-            if FC:
-                names = FC.GetExpressionNames("")
-                weights = FC.GetExpressionWeights(RGlobal.GetTime(), names)
-                data += struct.pack("!I", len(names))
-                for weight in weights:
-                    data += struct.pack("!f", weight)
-            else:
-                data += struct.pack("!I", 0)
-
-            # pack visemes
-            if VC:
-                names = VC.GetVisemeNames()
-                weights = VC.GetVisemeMorphWeights()
-                data += struct.pack("!I", len(weights))
-                for weight in weights:
-                    data += struct.pack("!f", weight)
-            else:
-                data += struct.pack("!I", 0)
-
-            # TODO: pack morphs
-            if MC:
-                pass
+    def get_frame_encoder(self, actors: list) -> PoseFrameEncoder:
+        """The pose frame encoder of the current group of clients."""
+        key = self.service.capabilities.format_key() if self.service else None
+        encoder = self.data.frame_encoders.get(key)
+        if not encoder or encoder.actors is not actors:
+            encoder = PoseFrameEncoder(actors, self.use_feature("ACTOR_TABLE"), self.get_frame_codec())
+            self.data.frame_encoders[key] = encoder
+        return encoder
 
-        return data
+    def encode_pose_frame_data(self, actors: list, delta=False):
+        return self.get_frame_encoder(actors).encode(get_current_frame(), delta=delta)
 
     def encode_sequence_data(self, actors):
         fps = get_fps()
@@ -2811,9 +4835,10 @@ class DataLink(QObject):
             self.send(OpCodes.TEMPLATE, template_data)
             # store the actors
             self.data.sequence_actors = actors
-            # send pose frame data
-            pose_frame_data = self.encode_pose_frame_data(actors)
-            self.send(OpCodes.POSE_FRAME, pose_frame_data)
+            # send pose frame data, encoded once for each group of clients
+            for group in self.service.each_group():
+                pose_frame_data = self.encode_pose_frame_data(actors)
+                self.send(OpCodes.POSE_FRAME, pose_frame_data)
 
     def send_sequence(self):
 
@@ -2824,6 +4849,7 @@ class DataLink(QObject):
             self.data.sequence_current_frame -= 1
             self.update_link_status(f"Sequence Aborted: {self.data.sequence_current_frame}")
             self.stop_sequence()
+            self.service.cancel_bulk()
             self.send_sequence_end()
             return
 
@@ -2846,13 +4872,110 @@ class DataLink(QObject):
             self.send(OpCodes.TEMPLATE, template_data)
             # start the sending sequence
             self.data.sequence_actors = actors
+            batch_size = MAX_BATCH_FRAMES if prefs.DATALINK_OFFLINE_SEQUENCE else 1
+            self.service.start_sequence_flow(current_frame - 1, adaptive=prefs.MATCH_CLIENT_RATE, batch_size=batch_size)
             self.start_sequence(func=self.send_sequence_frame)
-            self.data.ack_rate = 60
-            self.data.ack_time = 0
+            self.update_sequence(None if prefs.DATALINK_OFFLINE_SEQUENCE else FLOW_TIMER_RATE, 1, 0)
 
     def send_sequence_frame(self):
         if not self.data.sequence_active or not self.data.sequence_actors:
             return
+        # a client that has stopped acking altogether leaves the sequence
+        for session in self.service.get_stalled_sessions():
+            self.drop_sequence_session(session)
+        sessions = self.service.get_sequence_sessions()
+        self.update_flow_status()
+        # each client is paced by its own window: the scene moves on as fast as the fastest client can take it,
+        # and a client that falls behind skips to the latest frames, rather than holding back the others.
+        room = { session: self.get_sequence_room(session) for session in sessions }
+        count = min(max(room.values(), default=0), self.get_sequence_frames_left())
+        actors = self.data.sequence_actors
+        last_frames = { session: session.flow.sent_frame for session in sessions }
+        # each frame is encoded once for each group of clients that agreed on the same format,
+        # clients with batching get their frames in batches of up to their batch size:
+        # frame count, then each frame's size and pose frame data.
+        batches = {}
+        for i in range(count):
+            is_last = self.begin_sequence_frame()
+            frame = self.data.sequence_current_frame
+            for group in self.service.each_group(sessions):
+                # a client with room for n frames is sent the last n frames
+                receivers = [ session for session in group.sessions
+                              if room[session] >= count - i and frame > last_frames[session] ]
+                if not receivers:
+                    continue
+                for pose_data, to_sessions in self.encode_sequence_frame(actors, receivers, last_frames):
+                    if self.use_feature("BATCH_FRAMES"):
+                        pose_data = bytes(pose_data)
+                        for session in to_sessions:
+                            batches.setdefault(session, []).append(pose_data)
+                    else:
+                        self.service.send_to(to_sessions, OpCodes.SEQUENCE_FRAME, pose_data)
+                        for session in to_sessions:
+                            session.flow.sent(frame)
+                for session in receivers:
+                    last_frames[session] = frame
+            if not is_last:
+                self.next_sequence_frame()
+        # clients sent the same frames share the same batches
+        shared = {}
+        for session, frames in batches.items():
+            shared.setdefault((tuple(map(id, frames)), session.flow.batch_size), []).append(session)
+        for (_, batch_size), to_sessions in shared.items():
+            frames = batches[to_sessions[0]]
+            frame = last_frames[to_sessions[0]] - len(frames)
+            for start in range(0, len(frames), batch_size):
+                batch_frames = frames[start:start + batch_size]
+                batch = bytearray(FRAME_COUNT.pack(len(batch_frames)))
+                for pose_data in batch_frames:
+                    batch.extend(FRAME_COUNT.pack(len(pose_data)))
+                    batch.extend(pose_data)
+                self.service.send_to(to_sessions, OpCodes.SEQUENCE_FRAMES, batch)
+                # the batch is acknowledged by its last frame
+                for session in to_sessions:
+                    session.flow.sent(frame + start + len(batch_frames), len(batch_frames))
+        # check for end: each client's sequence ends once it has been sent the last frame
+        end_frame = get_end_frame()
+        for session in sessions:
+            if session.flow.sent_frame >= end_frame:
+                self.send_sequence_end(session)
+        if not self.service.get_sequence_sessions():
+            self.stop_sequence()
+            self.send_sequence_end()
+
+    def get_sequence_room(self, session: LinkSession):
+        """The number of frames to send the session now: what its window allows,
+           up to a batch (or FLOW_MAX_SEND_COUNT frames, if more) at a time."""
+        available = self.service.sequence_available(session)
+        if session.capabilities.has_feature("BATCH_FRAMES"):
+            return min(available, max(session.flow.batch_size, FLOW_MAX_SEND_COUNT))
+        return min(available, FLOW_MAX_SEND_COUNT)
+
+    def get_sequence_frames_left(self):
+        """The number of frames from the current sequence frame to the end.
+           (The last frame stays current until every client has been sent it.)"""
+        fps = get_fps()
+        return max(0, get_end_frame() - fps.GetFrameIndex(self.data.sequence_current_frame_time) + 1)
+
+    def encode_sequence_frame(self, actors, sessions, last_frames):
+        """Yields the current frame encoded for the sessions of the current group, with the sessions to send it to.
+           With delta frames, a session that wasn't sent the frame before is sent key blocks only.
+           The encode buffer is reused, so send (or copy) each frame before the next."""
+        if not self.use_feature("DELTA_FRAMES"):
+            yield self.encode_pose_frame_data(actors), sessions
+            return
+        encoder = self.get_frame_encoder(actors)
+        in_step = [ session for session in sessions if last_frames[session] == encoder.frame ]
+        behind = [ session for session in sessions if session not in in_step ]
+        if in_step:
+            yield encoder.encode(get_current_frame(), delta=True), in_step
+        else:
+            encoder.encode(get_current_frame())
+        if behind:
+            yield encoder.encode_key(), behind
+
+    def begin_sequence_frame(self):
+        """Moves to the current sequence frame, returns whether it is the last frame of the sequence."""
         # set/fetch the current frame in the sequence
         if RGlobal.GetTime() != self.data.sequence_current_frame_time:
             RGlobal.SetTime(self.data.sequence_current_frame_time)
@@ -2863,24 +4986,35 @@ class DataLink(QObject):
         current_frame = get_current_frame()
         self.data.sequence_current_frame = current_frame
         self.update_link_status(f"Sending Sequence Frame: {current_frame}")
-        num_frames = current_frame - self.data.sequence_start_frame
-        # send current sequence frame actor poses
-        pose_data = self.encode_pose_frame_data(self.data.sequence_actors)
-        self.send(OpCodes.SEQUENCE_FRAME, pose_data)
-        # check for end
-        if current_frame >= get_end_frame():
-            self.stop_sequence()
-            self.send_sequence_end()
-            return
-        # advance to next frame
+        return current_frame >= get_end_frame()
+
+    def next_sequence_frame(self):
         self.data.sequence_current_frame_time = next_frame(self.data.sequence_current_frame_time)
 
-    def send_sequence_end(self):
+    def drop_sequence_session(self, session: LinkSession):
+        """Ends the sequence early for a session, telling both ends where its take stops."""
+        frame = session.flow.acked_frame
+        message = f"{session.name()} stopped responding, its sequence ends at frame {frame}"
+        utils.log_warn(message)
+        self.update_link_status(message)
+        self.service.send(OpCodes.NOTIFY,
+                          encode_from_json({ "message": f"Sequence stopped at frame {frame}: client not responding" }),
+                          session=session)
+        self.send_sequence_end(session)
+
+    def send_sequence_end(self, session: LinkSession = None):
+        """Ends the sequence, or only the session's part in it."""
         actors = self.data.sequence_actors
+        if session:
+            if actors:
+                self.service.send(OpCodes.SEQUENCE_END, self.encode_sequence_data(actors), session=session)
+            self.service.end_sequence_flow(session)
+            return
         if actors:
             sequence_data = self.encode_sequence_data(actors)
-            self.send(OpCodes.SEQUENCE_END, sequence_data)
+            self.service.send_to_sequence(OpCodes.SEQUENCE_END, sequence_data)
             self.data.sequence_actors = None
+        self.service.end_sequence_flow()
         if self.data.stored_selection:
             RScene.SelectObjects(self.data.stored_selection)
 
@@ -2897,6 +5031,7 @@ class DataLink(QObject):
         SC = actor.get_skeleton_component()
         clip = SC.AddClip(t0)
         clip.SetLength(length)
+        actor.set_clip(clip)
 
         FC = actor.get_face_component()
         FC.AddClip(t0, "Expressions", length)
@@ -2915,9 +5050,14 @@ class DataLink(QObject):
         t_pose = get_pose_local(actor.object) if actor.is_avatar() else None
         actor.set_t_pose(t_pose)
 
-    def decode_pose_frame_data(self, pose_data):
-        count, frame = struct.unpack_from("!II", pose_data)
-        offset = 8
+    def decode_pose_frame_data(self, pose_data, delta=False):
+        """Decodes a pose frame into flat float arrays per actor:
+             transforms: 10 floats per bone (tx,ty,tz,rx,ry,rz,rw,sx,sy,sz)
+             shapes: 1 float per shape weight
+           with pose as a per bone list view of the transforms.
+           Delta frames are rebuilt against the previous frame's actor blocks."""
+        count, frame = FRAME_HEADER.unpack_from(pose_data)
+        offset = FRAME_HEADER.size
         actors_list = []
         pose_json = {
             "count": count,
@@ -2925,57 +5065,111 @@ class DataLink(QObject):
             "actors": actors_list,
         }
 
+        use_actor_table = self.use_feature("ACTOR_TABLE")
+        compact = codec.is_compact(self.get_frame_codec())
+        decode_actor_block = self.decode_compact_actor_block if compact else self.decode_actor_block
         for i in range(0, count):
-            pose = []
-            shapes = []
-            offset, name = unpack_string(pose_data, offset)
-            offset, character_type = unpack_string(pose_data, offset)
-            offset, link_id = unpack_string(pose_data, offset)
-            actor = self.data.find_sequence_actor(link_id)
-            actor_data = {
-                "name": name,
-                "type": character_type,
-                "link_id": link_id,
-                "actor": actor,
-                "transform": None,
-                "pose": pose,
-                "shapes": shapes,
-            }
+            if use_actor_table:
+                slot = FRAME_COUNT.unpack_from(pose_data, offset)[0]
+                offset += FRAME_COUNT.size
+                actor = self.data.get_slot_actor(slot)
+                name = actor.name if actor else ""
+                character_type = actor.get_type() if actor else ""
+                link_id = actor.get_link_id() if actor else ""
+            else:
+                offset, name = unpack_string(pose_data, offset)
+                offset, character_type = unpack_string(pose_data, offset)
+                offset, link_id = unpack_string(pose_data, offset)
+                actor = self.data.find_sequence_actor(link_id)
+
+            if delta:
+                kind = pose_data[offset]
+                offset += 1
+                if kind == DELTA_CHANGED:
+                    if i not in self.data.delta_blocks:
+                        utils.log_error(f"Delta frame {frame} received without a key frame!")
+                        break
+                    previous, groups = self.data.delta_blocks[i]
+                    block, offset = unpack_delta_block(pose_data, offset, previous, groups)
+                    self.data.delta_blocks[i] = (block, groups)
+                    block_offset = 0
+                else:
+                    block = pose_data
+                    block_offset = offset
+                    if compact:
+                        head_size, strides = get_compact_block_strides(pose_data, offset, 1, 1)
+                        groups, offset = get_frame_block_groups(pose_data, offset, strides, head_size)
+                    else:
+                        groups, offset = get_frame_block_groups(pose_data, offset, RECEIVE_FRAME_STRIDES)
+                    groups = [ (start - block_offset, end - block_offset) for start, end in groups ]
+                    self.data.delta_blocks[i] = (bytes(pose_data[block_offset:offset]), groups)
+                transform, transforms, shapes, block_end = decode_actor_block(block, block_offset)
+            else:
+                transform, transforms, shapes, offset = decode_actor_block(pose_data, offset)
 
             if actor:
-                actors_list.append(actor_data)
-            tx,ty,tz,rx,ry,rz,rw,sx,sy,sz = struct.unpack_from("!ffffffffff", pose_data, offset)
-            offset += 40
-            actor_data["transform"] = [tx,ty,tz,rx,ry,rz,rw,sx,sy,sz]
-
-            num_bones = struct.unpack_from("!I", pose_data, offset)[0]
-            offset += 4
-            for i in range(0, num_bones):
-                tx,ty,tz,rx,ry,rz,rw,sx,sy,sz = struct.unpack_from("!ffffffffff", pose_data, offset)
-                offset += 40
-                pose.append([tx,ty,tz,rx,ry,rz,rw,sx,sy,sz])
-
-            num_shapes = struct.unpack_from("!I", pose_data, offset)[0]
-            offset += 4
-            for i in range(0, num_shapes):
-                weight = struct.unpack_from("!f", pose_data, offset)[0]
-                offset += 4
-                shapes.append(weight)
+                actors_list.append({
+                    "name": name,
+                    "type": character_type,
+                    "link_id": link_id,
+                    "actor": actor,
+                    "transform": transform,
+                    "transforms": transforms,
+                    "pose": PoseView(transforms),
+                    "shapes": shapes,
+                })
 
         return pose_json
 
+    def decode_actor_block(self, block, offset):
+        transform = list(FRAME_TRANSFORM.unpack_from(block, offset))
+        offset += FRAME_TRANSFORM.size
+
+        num_bones = FRAME_COUNT.unpack_from(block, offset)[0]
+        offset += FRAME_COUNT.size
+        transforms, offset = unpack_floats(block, offset, num_bones * 10)
+
+        num_shapes = FRAME_COUNT.unpack_from(block, offset)[0]
+        offset += FRAME_COUNT.size
+        shapes, offset = unpack_floats(block, offset, num_shapes)
+
+        return transform, transforms, shapes, offset
+
+    def decode_compact_actor_block(self, block, offset):
+        transform = list(FRAME_TRANSFORM.unpack_from(block, offset))
+        offset += FRAME_TRANSFORM.size
+
+        min_x, min_y, min_z, tra_extent, flags = codec.COMPACT_HEADER.unpack_from(block, offset)
+        offset += codec.COMPACT_HEADER.size
+
+        num_bones = FRAME_COUNT.unpack_from(block, offset)[0]
+        offset += FRAME_COUNT.size
+        transforms, offset = codec.unpack_transforms(block, offset, num_bones, (min_x, min_y, min_z), tra_extent, flags)
+
+        num_shapes = FRAME_COUNT.unpack_from(block, offset)[0]
+        offset += FRAME_COUNT.size
+        shapes, offset = codec.unpack_weights(block, offset, num_shapes, flags)
+
+        return transform, transforms, shapes, offset
+
     def receive_character_template(self, data):
         self.update_link_status(f"Character Templates Received")
         template_json = decode_to_json(data)
         count = template_json["count"]
-        for actor_data in template_json["actors"]:
+        # frames can refer to the actors by their slot in the template
+        self.data.actor_slots = [None] * count
+        self.data.delta_blocks = {}
+        for index, actor_data in enumerate(template_json["actors"]):
             name = actor_data["name"]
             character_type = actor_data["type"]
             link_id = actor_data["link_id"]
+            slot = actor_data.get("slot", index)
             actor = self.data.find_sequence_actor(link_id)
             if actor:
                 utils.log_info(f"Character Template Received: {name}")
                 actor.set_template(actor_data)
+                if 0 <= slot < count:
+                    self.data.actor_slots[slot] = actor
             else:
                 utils.log_error(f"Unable to find actor: {name} ({link_id})")
             utils.log_info(f" - character using expression drivers: {actor.use_drivers}")
@@ -3032,10 +5226,9 @@ class DataLink(QObject):
         for actor_data in pose_frame_data["actors"]:
             actor: LinkActor = actor_data["actor"]
             actor.begin_editing()
-            apply_pose(actor, scene_time, actor_data["pose"], actor_data["shapes"], actor.t_pose)
-            apply_pose(actor, scene_time2, actor_data["pose"], actor_data["shapes"], actor.t_pose)
-            apply_shapes(actor, scene_time, actor_data["pose"], actor_data["shapes"], actor.t_pose)
-            apply_shapes(actor, scene_time2, actor_data["pose"], actor_data["shapes"], actor.t_pose)
+            # solve once and key both times, end_editing bakes FK to IK
+            apply_poses(actor, [scene_time, scene_time2], [actor_data["transforms"]], [actor_data["shapes"]], bake=False)
+            apply_expression_keys(actor, [scene_time, scene_time2], actor_data["shapes"])
             actor.end_editing(scene_time)
         for actor_data in pose_frame_data["actors"]:
             actor: LinkActor = actor_data["actor"]
@@ -3076,6 +5269,12 @@ class DataLink(QObject):
                 actor.begin_editing()
                 actors.append(actor)
         self.data.sequence_actors = actors
+        # record the frames and key them all at the end of the sequence
+        if prefs.DATALINK_RECORD_SEQUENCE:
+            reduction = KeyReduction() if prefs.DATALINK_REDUCE_KEYS else None
+            self.data.sequence_take = SequenceTake(RECORD_PREVIEW_INTERVAL, reduction)
+        else:
+            self.data.sequence_take = None
         # refresh actor timelines
         refresh_timeline(actors)
         # move to end of range
@@ -3087,35 +5286,101 @@ class DataLink(QObject):
         #utils.start_timer("fetch_transforms")
 
     def receive_sequence_frame(self, data):
-        sequence_frame_data = self.decode_pose_frame_data(data)
-        if not sequence_frame_data:
-            return
+        receive_time = time.perf_counter()
+        frame = self.apply_sequence_frames([data])
+        if frame is not None:
+            # send sequence frame ack
+            self.send_sequence_ack(frame, time.perf_counter() - receive_time)
+
+    def receive_sequence_frames(self, data):
+        receive_time = time.perf_counter()
+        count = FRAME_COUNT.unpack_from(data)[0]
+        offset = FRAME_COUNT.size
+        frames = []
+        for i in range(0, count):
+            size = FRAME_COUNT.unpack_from(data, offset)[0]
+            offset += FRAME_COUNT.size
+            frames.append(memoryview(data)[offset:offset + size])
+            offset += size
+        frame = self.apply_sequence_frames(frames)
+        # one ack for the whole batch
+        if frame is not None:
+            self.send_sequence_ack(frame, time.perf_counter() - receive_time)
+
+    def apply_sequence_frames(self, frames: list):
+        """Applies the actor poses of consecutive sequence frames, returns the last frame number.
+           Each actor's poses are applied together, so their rotation curves are converted in one pass.
+           When recording, the frames go into the take and only preview frames are applied."""
+        start_time = time.perf_counter()
+        delta = self.use_feature("DELTA_FRAMES")
+        # decode in order, delta frames depend on the frame before
+        frame_datas = []
+        for data in frames:
+            sequence_frame_data = self.decode_pose_frame_data(data, delta=delta)
+            if sequence_frame_data:
+                frame_datas.append(sequence_frame_data)
+        if not frame_datas:
+            return None
         # clear selected objects, only if needed as this triggers UI updates
         if RScene.GetSelectedObjects():
             RScene.ClearSelectObjects()
-        frame = sequence_frame_data["frame"]
-        scene_time = get_frame_time(frame)
-        if scene_time > RGlobal.GetEndTime():
-            RGlobal.SetEndTime(scene_time)
-        if scene_time < RGlobal.GetStartTime():
-            RGlobal.SetStartTime(scene_time)
+        take = self.data.sequence_take
+        actor_frames = {}
+        for sequence_frame_data in frame_datas:
+            frame = sequence_frame_data["frame"]
+            scene_time = get_frame_time(frame)
+            if scene_time > RGlobal.GetEndTime():
+                RGlobal.SetEndTime(scene_time)
+            if scene_time < RGlobal.GetStartTime():
+                RGlobal.SetStartTime(scene_time)
+            for actor_data in sequence_frame_data["actors"]:
+                actor: LinkActor = actor_data["actor"]
+                if take:
+                    take.add(actor, frame, actor_data["transforms"], actor_data["shapes"])
+                    if not take.is_preview_frame(frame):
+                        continue
+                if actor not in actor_frames:
+                    actor_frames[actor] = []
+                actor_frames[actor].append((scene_time, actor_data))
         self.data.sequence_current_frame_time = scene_time
         self.data.sequence_current_frame = frame
-        self.update_link_status(f"Sequence Frame: {frame} Received")
+        self.update_link_status(f"Sequence Frame: {frame} {'Recorded' if take else 'Received'}")
         # update all actor poses
-        for actor_data in sequence_frame_data["actors"]:
-            actor: LinkActor = actor_data["actor"]
-            apply_pose(actor, scene_time, actor_data["pose"], actor_data["shapes"], actor.t_pose)
-            apply_shapes(actor, scene_time, actor_data["pose"], actor_data["shapes"], actor.t_pose)
-        # send sequence frame ack
-        self.send_sequence_ack(frame)
+        for actor, actor_frame_datas in actor_frames.items():
+            apply_poses(actor,
+                        [ scene_time for scene_time, actor_data in actor_frame_datas ],
+                        [ actor_data["transforms"] for scene_time, actor_data in actor_frame_datas ],
+                        [ actor_data["shapes"] for scene_time, actor_data in actor_frame_datas ])
+            for scene_time, actor_data in actor_frame_datas:
+                apply_shapes(actor, scene_time, actor_data["pose"], actor_data["shapes"], actor.t_pose)
+        apply_time = (time.perf_counter() - start_time) / len(frame_datas)
+        if self.data.frame_apply_time == 0.0:
+            self.data.frame_apply_time = apply_time
+        else:
+            self.data.frame_apply_time = utils.lerp(self.data.frame_apply_time, apply_time, 0.1)
+        return frame
 
-    def send_sequence_ack(self, frame):
+    def get_receive_credits(self):
+        """The number of frames this end can apply in RECEIVE_CREDIT_TIME."""
+        if self.data.frame_apply_time <= 0.0:
+            return FLOW_INITIAL_WINDOW
+        credits = round(RECEIVE_CREDIT_TIME / self.data.frame_apply_time)
+        return max(FLOW_MIN_WINDOW, min(FLOW_MAX_WINDOW, credits))
+
+    def send_sequence_ack(self, frame, hold=0.0):
         # encode sequence ack
-        data = encode_from_json({
-            "frame": frame,
-            "rate": self.service.loop_rate,
-        })
+        if self.use_feature("BINARY_ACK"):
+            data = SEQUENCE_ACK_MESSAGE.pack(frame,
+                                             self.service.loop_rate,
+                                             hold,
+                                             min(65535, self.service.receive_queue_depth()),
+                                             self.get_receive_credits())
+        else:
+            data = encode_from_json({
+                "frame": frame,
+                "rate": self.service.loop_rate,
+                "credits": self.get_receive_credits(),
+            })
         # send sequence ack
         self.send(OpCodes.SEQUENCE_ACK, data)
 
@@ -3129,6 +5394,11 @@ class DataLink(QObject):
         scene_end_time = get_frame_time(self.data.sequence_end_frame)
         actor: LinkActor
         RScene.ClearSelectObjects()
+        take = self.data.sequence_take
+        if take:
+            self.update_link_status(f"Keying Recorded Sequence: {take.num_frames()} frames ...")
+            take.commit()
+            self.data.sequence_take = None
         for actor in self.data.sequence_actors:
             actor.end_editing(scene_start_time)
             RScene.SelectObject(actor.object)
@@ -3140,42 +5410,49 @@ class DataLink(QObject):
         #utils.log_timer("fetch_transforms", name="fetch_transforms")
 
     def receive_sequence_ack(self, data):
-        json_data = decode_to_json(data)
-        ack_frame = json_data["frame"]
-        server_rate = json_data["rate"]
-        delta_frames = self.data.sequence_current_frame - ack_frame
-        if prefs.MATCH_CLIENT_RATE:
-            if self.data.ack_time == 0.0:
-                self.data.ack_time = time.time()
-                self.data.ack_rate = 120
-                rate = 120
-                count = 4
-            else:
-                t = time.time()
-                delta_time = max(t - self.data.ack_time, 1/120)
-                self.data.ack_time = t
-                ack_rate = (1.0 / delta_time)
-                self.data.ack_rate = utils.lerp(self.data.ack_rate, ack_rate, 0.25)
-
-                if delta_frames > 30:
-                    rate = 5
-                    count = 1
-                elif delta_frames > 20:
-                    rate = 15
-                    count = 1
-                elif delta_frames > 10:
-                    rate = 30
-                    count = 1
-                elif delta_frames > 5:
-                    rate = 60
-                    count = 2
-                else:
-                    rate = 120
-                    count = 4
-
-            self.update_sequence(rate, count, delta_frames)
+        # the ack is from the session being parsed
+        session: LinkSession = self.service.session
+        if not session:
+            return
+        flow = session.flow
+        if self.use_feature("BINARY_ACK"):
+            ack_frame, rate, hold, queue_depth, credits = SEQUENCE_ACK_MESSAGE.unpack_from(data)
+            flow.remote_rate = rate
+            flow.remote_queue = queue_depth
+            session.rtt.sample(flow.acked(ack_frame, credits, hold))
+        else:
+            json_data = decode_to_json(data)
+            ack_frame = json_data["frame"]
+            credits = json_data.get("credits")
+            flow.acked(ack_frame, credits)
+        if self.use_feature("BATCH_FRAMES"):
+            self.update_batch_size(session)
+        # with no live preview, send as fast as the window allows
+        rate = None if prefs.DATALINK_OFFLINE_SEQUENCE else FLOW_TIMER_RATE
+        self.update_sequence(rate, 1, flow.in_flight())
+        self.update_flow_status()
+
+    def update_batch_size(self, session: LinkSession):
+        """Sizes the session's sequence batches to cover the ack latency of its link,
+           so there is always a batch in flight while the last one is acknowledged."""
+        if prefs.DATALINK_OFFLINE_SEQUENCE:
+            session.flow.batch_size = MAX_BATCH_FRAMES
         else:
-            self.update_sequence(120, 4, delta_frames)
+            fps = get_fps().ToFloat()
+            session.flow.batch_size = max(1, min(MAX_BATCH_FRAMES, round(session.flow.latency * fps)))
+
+    def update_flow_status(self):
+        if self.label_flow:
+            sessions = self.service.get_sequence_sessions()
+            lines = []
+            for session in sessions:
+                status = session.flow.status()
+                if session.rtt.samples:
+                    status += "  " + session.rtt.status()
+                if len(sessions) > 1:
+                    status = f"{session.name()}  {status}"
+                lines.append(status)
+            self.label_flow.setText("\n".join(lines))
 
     def receive_character_import(self,data):
         json_data = decode_to_json(data)
@@ -3291,4 +5568,4 @@ def test():
     utils.log_always("")
     utils.log_always("TEST")
     utils.log_always("====")
-    tests.test()
\ No newline at end of file
+    tests.test()
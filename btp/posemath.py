@@ -0,0 +1,548 @@
+# Copyright (C) 2023 Victor Soupday
+# This file is part of CC/iC-Blender-Pipeline-Plugin <https://github.com/soupday/CC/iC-Blender-Pipeline-Plugin>
+#
+# CC/iC-Blender-Pipeline-Plugin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CC/iC-Blender-Pipeline-Plugin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CC/iC-Blender-Pipeline-Plugin.  If not, see <https://www.gnu.org/licenses/>.
+
+# Pose math over whole skeletons, without host objects.
+#
+# Solves a received world space pose into the T-pose relative local rotations (as XYZ euler angles)
+# and translations the bone controls are keyed with, for all the bones of an actor at once.
+# Uses NumPy when it is available, otherwise plain Python.
+#
+# Conventions follow the host math:
+#   transforms: (tx,ty,tz,rx,ry,rz,rw,sx,sy,sz)
+#   quaternions: (x,y,z,w), a.Multiply(b) = a * b
+#   XYZ euler: R = Rx * Ry * Rz
+
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HAS_NUMPY = np is not None
+IDENTITY = (0.0, 0.0, 0.0, 1.0)
+TWO_PI = 2.0 * math.pi
+REDUCE_NUMPY_SPAN = 64
+FORWARD = (0.0, -1.0, 0.0)
+
+
+class PoseArrays():
+    """An actor's compiled pose plan as flat arrays, by plan slot (parents before children):
+       parent slot (-1 for the root), pose index (-1 if the bone is not in the pose),
+       translation lock and the T-pose transform (10 floats per slot)."""
+    num_slots: int = 0
+    parents: list = None
+    pose_indices: list = None
+    locked: list = None
+    t_pose: list = None
+    # slots in the pose
+    posed: list = None
+    # slots not in the pose, by depth in the skeleton
+    levels: list = None
+    # NumPy copies
+    np_parents = None
+    np_pose_indices = None
+    np_posed = None
+    np_locked = None
+    np_t_pose = None
+    np_levels: list = None
+
+    def __init__(self, parents, pose_indices, locked, t_pose):
+        self.num_slots = len(parents)
+        self.parents = list(parents)
+        self.pose_indices = list(pose_indices)
+        self.locked = list(locked)
+        self.t_pose = [ float(v) for v in t_pose ]
+        self.posed = [ slot for slot in range(self.num_slots) if self.pose_indices[slot] >= 0 ]
+        depths = [0] * self.num_slots
+        levels = {}
+        for slot in range(self.num_slots):
+            parent = self.parents[slot]
+            depths[slot] = depths[parent] + 1 if parent >= 0 else 0
+            if self.pose_indices[slot] < 0:
+                levels.setdefault(depths[slot], []).append(slot)
+        self.levels = [ levels[depth] for depth in sorted(levels) ]
+        if HAS_NUMPY:
+            # parents of the root point to an extra identity slot at the end
+            self.np_parents = np.array([ p if p >= 0 else self.num_slots for p in self.parents ], dtype=np.intp)
+            self.np_pose_indices = np.array(self.pose_indices, dtype=np.intp)
+            self.np_posed = np.array(self.posed, dtype=np.intp)
+            self.np_locked = np.array([ self.locked[slot] for slot in self.posed ], dtype=bool)
+            self.np_t_pose = np.array(self.t_pose, dtype=np.float64).reshape(self.num_slots, 10)
+            self.np_levels = [ np.array(level, dtype=np.intp) for level in self.levels ]
+
+    def t_pose_rot(self, slot):
+        i = slot * 10
+        return tuple(self.t_pose[i+3:i+7])
+
+    def t_pose_sca(self, slot):
+        i = slot * 10
+        return tuple(self.t_pose[i+7:i+10])
+
+
+class PoseSolution():
+    """The solved pose of the posed slots, in the order of PoseArrays.posed:
+       local rotations (x,y,z,w), T-pose relative rotations (x,y,z,w), XYZ euler angles and translations."""
+    slots: list = None
+    local_rots: list = None
+    rots = None
+    euler: list = None
+    tra: list = None
+
+    def __init__(self, slots, local_rots, rots, tra):
+        self.slots = slots
+        self.local_rots = local_rots
+        self.rots = rots
+        self.tra = tra
+
+
+def solve_pose(arrays: PoseArrays, pose_data, counter_rots: dict = None, previous=None, use_numpy=None):
+    """Solves the world space pose (10 floats per pose bone) into the values the bone controls are keyed with.
+       counter_rots: the rotation counteracting the active expressions, by slot, applied in local space.
+       previous: the previously keyed euler angles of the posed slots (or None), to stay continuous with.
+       use_numpy: None to choose the backend by the number of frames (see solve_poses)."""
+    return solve_poses(arrays, [pose_data], [counter_rots], previous, use_numpy)[0]
+
+
+def solve_poses(arrays: PoseArrays, pose_frames, counter_rot_frames=None, previous=None, use_numpy=None):
+    """solve_pose for consecutive frames, with the euler curves of all the frames converted in one pass.
+       With NumPy the frames are solved together as well. NumPy's per call overhead makes it slower
+       than plain Python for a single pose, so by default it is only used for batches."""
+    if use_numpy is None:
+        use_numpy = len(pose_frames) > 1
+    numpy = use_numpy and HAS_NUMPY
+    if numpy:
+        solutions = solve_poses_numpy(arrays, pose_frames, counter_rot_frames)
+    else:
+        solutions = [ solve_pose_python(arrays, pose_data, counter_rot_frames[i] if counter_rot_frames else None)
+                      for i, pose_data in enumerate(pose_frames) ]
+    curves = euler_xyz_curves([ solution.rots for solution in solutions ], previous, numpy)
+    for solution, euler in zip(solutions, curves):
+        solution.euler = euler
+    return solutions
+
+
+def euler_xyz_curves(rot_frames, previous=None, use_numpy=HAS_NUMPY):
+    """Converts (frames x bones) quaternions into XYZ euler angles, unwrapped so each key
+       stays continuous with the one before it, starting from the previous keys (bones, None for no key).
+       Returns a list of frames of (x,y,z) per bone."""
+    if not rot_frames or not len(rot_frames[0]):
+        return [ [] for rots in rot_frames ]
+    if use_numpy and HAS_NUMPY:
+        return euler_xyz_curves_numpy(rot_frames, previous)
+    return euler_xyz_curves_python(rot_frames, previous)
+
+
+# Plain Python
+#
+
+def qmul(a, b):
+    ax, ay, az, aw = a
+    bx, by, bz, bw = b
+    return (aw*bx + ax*bw + ay*bz - az*by,
+            aw*by - ax*bz + ay*bw + az*bx,
+            aw*bz + ax*by - ay*bx + az*bw,
+            aw*bw - ax*bx - ay*by - az*bz)
+
+
+def qconj(q):
+    return (-q[0], -q[1], -q[2], q[3])
+
+
+def qinverse(q):
+    n = q[0]*q[0] + q[1]*q[1] + q[2]*q[2] + q[3]*q[3]
+    if n < 1e-12:
+        return IDENTITY
+    return (-q[0] / n, -q[1] / n, -q[2] / n, q[3] / n)
+
+
+def qrot(q, v):
+    """Rotates the vector by the (unit) quaternion."""
+    qx, qy, qz, qw = q
+    vx, vy, vz = v
+    # t = 2 * cross(q.xyz, v)
+    tx = 2.0 * (qy*vz - qz*vy)
+    ty = 2.0 * (qz*vx - qx*vz)
+    tz = 2.0 * (qx*vy - qy*vx)
+    # v + w * t + cross(q.xyz, t)
+    return (vx + qw*tx + qy*tz - qz*ty,
+            vy + qw*ty + qz*tx - qx*tz,
+            vz + qw*tz + qx*ty - qy*tx)
+
+
+def cross(a, b):
+    return (a[1]*b[2] - a[2]*b[1], a[2]*b[0] - a[0]*b[2], a[0]*b[1] - a[1]*b[0])
+
+
+def dot(a, b):
+    return a[0]*b[0] + a[1]*b[1] + a[2]*b[2]
+
+
+def normalized(v):
+    length = math.sqrt(dot(v, v))
+    if length < 1e-12:
+        return v
+    return (v[0] / length, v[1] / length, v[2] / length)
+
+
+def euler_xyz(q):
+    """XYZ euler angles (radians) of the quaternion's rotation matrix."""
+    x, y, z, w = q
+    r00 = 1.0 - 2.0*(y*y + z*z)
+    r01 = 2.0*(x*y - w*z)
+    r02 = 2.0*(x*z + w*y)
+    r10 = 2.0*(x*y + w*z)
+    r11 = 1.0 - 2.0*(x*x + z*z)
+    r12 = 2.0*(y*z - w*x)
+    r22 = 1.0 - 2.0*(x*x + y*y)
+    if r02 >= 1.0:
+        return (math.atan2(r10, r11), math.pi / 2, 0.0)
+    if r02 <= -1.0:
+        return (-math.atan2(r10, r11), -math.pi / 2, 0.0)
+    return (math.atan2(-r12, r22), math.asin(r02), math.atan2(-r01, r00))
+
+
+def unwrap_angle(angle, previous):
+    """The angle, plus or minus whole turns, closest to the previous angle."""
+    return angle + TWO_PI * round((previous - angle) / TWO_PI)
+
+
+def unwrap_euler(euler, previous):
+    """Of the XYZ euler angles and their equivalent (x+pi, pi-y, z+pi), the one closest to the previous key,
+       with each angle unwrapped to within half a turn of it."""
+    if previous is None:
+        return euler
+    x, y, z = euler
+    px, py, pz = previous
+    a = (unwrap_angle(x, px), unwrap_angle(y, py), unwrap_angle(z, pz))
+    b = (unwrap_angle(x + math.pi, px), unwrap_angle(math.pi - y, py), unwrap_angle(z + math.pi, pz))
+    da = abs(a[0] - px) + abs(a[1] - py) + abs(a[2] - pz)
+    db = abs(b[0] - px) + abs(b[1] - py) + abs(b[2] - pz)
+    return b if db < da else a
+
+
+def euler_xyz_curves_python(rot_frames, previous=None):
+    keys = list(previous) if previous else None
+    curves = []
+    for rots in rot_frames:
+        euler = [ euler_xyz(q) for q in rots ]
+        if keys:
+            euler = [ unwrap_euler(e, p) for e, p in zip(euler, keys) ]
+        curves.append(euler)
+        keys = euler
+    return curves
+
+
+def solve_pose_python(arrays: PoseArrays, pose_data, counter_rots: dict = None):
+    n = arrays.num_slots
+    parents = arrays.parents
+    pose_indices = arrays.pose_indices
+    T = arrays.t_pose
+    world_rots = [None] * n
+    world_tras = [None] * n
+    world_scas = [None] * n
+    slots = []
+    local_rots = []
+    rots = []
+    tra = []
+    for slot in range(n):
+        parent = parents[slot]
+        if parent >= 0:
+            pw_rot, pw_tra, pw_sca = world_rots[parent], world_tras[parent], world_scas[parent]
+        else:
+            pw_rot, pw_tra, pw_sca = IDENTITY, (0.0, 0.0, 0.0), (1.0, 1.0, 1.0)
+        t = slot * 10
+        t_pose_tra = (T[t], T[t+1], T[t+2])
+        t_pose_rot = (T[t+3], T[t+4], T[t+5], T[t+6])
+        pose_index = pose_indices[slot]
+        if pose_index >= 0:
+            i = pose_index * 10
+            world_tra = (pose_data[i], pose_data[i+1], pose_data[i+2])
+            world_rot = (pose_data[i+3], pose_data[i+4], pose_data[i+5], pose_data[i+6])
+            world_sca = (pose_data[i+7], pose_data[i+8], pose_data[i+9])
+            # local
+            pw_rot_inv = qconj(pw_rot)
+            local_rot = qmul(pw_rot_inv, world_rot)
+            if arrays.locked[slot]:
+                local_tra = t_pose_tra
+            else:
+                d = qrot(pw_rot_inv, (world_tra[0] - pw_tra[0], world_tra[1] - pw_tra[1], world_tra[2] - pw_tra[2]))
+                local_tra = (d[0] / world_sca[0], d[1] / world_sca[1], d[2] / world_sca[2])
+            # relative to the T-pose
+            rot = local_rot
+            if counter_rots and slot in counter_rots:
+                rot = qmul(rot, counter_rots[slot])
+            rot = qmul(rot, qinverse(t_pose_rot))
+            slots.append(slot)
+            local_rots.append(local_rot)
+            rots.append(rot)
+            tra.append((local_tra[0] - t_pose_tra[0], local_tra[1] - t_pose_tra[1], local_tra[2] - t_pose_tra[2]))
+        else:
+            world_rot = qmul(pw_rot, t_pose_rot)
+            d = qrot(pw_rot, (t_pose_tra[0] * pw_sca[0], t_pose_tra[1] * pw_sca[1], t_pose_tra[2] * pw_sca[2]))
+            world_tra = (d[0] + pw_tra[0], d[1] + pw_tra[1], d[2] + pw_tra[2])
+            world_sca = (T[t+7], T[t+8], T[t+9])
+        world_rots[slot] = world_rot
+        world_tras[slot] = world_tra
+        world_scas[slot] = world_sca
+    return PoseSolution(slots, local_rots, rots, tra)
+
+
+# NumPy
+#
+
+def qmul_np(a, b):
+    ax, ay, az, aw = a[..., 0], a[..., 1], a[..., 2], a[..., 3]
+    bx, by, bz, bw = b[..., 0], b[..., 1], b[..., 2], b[..., 3]
+    return np.stack((aw*bx + ax*bw + ay*bz - az*by,
+                     aw*by - ax*bz + ay*bw + az*bx,
+                     aw*bz + ax*by - ay*bx + az*bw,
+                     aw*bw - ax*bx - ay*by - az*bz), axis=-1)
+
+
+def qconj_np(q):
+    return q * np.array((-1.0, -1.0, -1.0, 1.0))
+
+
+def qinverse_np(q):
+    n = np.sum(q * q, axis=-1, keepdims=True)
+    return qconj_np(q) / np.maximum(n, 1e-12)
+
+
+def qrot_np(q, v):
+    u = q[..., :3]
+    t = 2.0 * np.cross(u, v)
+    return v + q[..., 3:4] * t + np.cross(u, t)
+
+
+def euler_xyz_np(q):
+    """XYZ euler angles (radians) of an (..., 4) quaternion array."""
+    x, y, z, w = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    r00 = 1.0 - 2.0*(y*y + z*z)
+    r01 = 2.0*(x*y - w*z)
+    r02 = 2.0*(x*z + w*y)
+    r10 = 2.0*(x*y + w*z)
+    r11 = 1.0 - 2.0*(x*x + z*z)
+    r12 = 2.0*(y*z - w*x)
+    r22 = 1.0 - 2.0*(x*x + y*y)
+    ex = np.arctan2(-r12, r22)
+    ey = np.arcsin(np.clip(r02, -1.0, 1.0))
+    ez = np.arctan2(-r01, r00)
+    # gimbal lock: only x - z (or x + z) is defined, so z = 0
+    upper = r02 >= 1.0
+    lower = r02 <= -1.0
+    if np.any(upper) or np.any(lower):
+        gimbal = np.arctan2(r10, r11)
+        ex = np.where(upper, gimbal, np.where(lower, -gimbal, ex))
+        ez = np.where(upper | lower, 0.0, ez)
+    return np.stack((ex, ey, ez), axis=-1)
+
+
+def unwrap_euler_np(E, P):
+    """unwrap_euler for (bones, 3) arrays of euler angles and previous keys."""
+    A = E + TWO_PI * np.round((P - E) / TWO_PI)
+    B = np.stack((E[:, 0] + math.pi, math.pi - E[:, 1], E[:, 2] + math.pi), axis=-1)
+    B += TWO_PI * np.round((P - B) / TWO_PI)
+    use_b = np.abs(B - P).sum(axis=-1) < np.abs(A - P).sum(axis=-1)
+    return np.where(use_b[:, None], B, A)
+
+
+def euler_xyz_curves_numpy(rot_frames, previous=None):
+    E = euler_xyz_np(np.asarray(rot_frames, dtype=np.float64).reshape(len(rot_frames), -1, 4))
+    # bones without a previous key start from their first frame
+    P = E[0].copy()
+    if previous:
+        for i, p in enumerate(previous):
+            if p is not None:
+                P[i] = p
+    # each frame depends on the one before, the bones are done at once
+    for f in range(len(E)):
+        E[f] = unwrap_euler_np(E[f], P)
+        P = E[f]
+    return E.tolist()
+
+
+def solve_poses_numpy(arrays: PoseArrays, pose_frames, counter_rot_frames=None):
+    """solve_pose_python for a batch of frames at once, as (frames, slots, ...) arrays."""
+    n = arrays.num_slots
+    F = len(pose_frames)
+    P = np.asarray(pose_frames, dtype=np.float64).reshape(F, -1, 10)
+    TP = arrays.np_t_pose
+    posed = arrays.np_posed
+    # world transforms with an identity slot for the parent of the root
+    W = np.zeros((F, n + 1, 10))
+    W[:, n, 6:10] = 1.0
+    W[:, posed] = P[:, arrays.np_pose_indices[posed]]
+    # bones not in the pose follow their parents in the T-pose, a level at a time
+    for level in arrays.np_levels:
+        PW = W[:, arrays.np_parents[level]]
+        W[:, level, 3:7] = qmul_np(PW[..., 3:7], TP[level, 3:7])
+        W[:, level, 0:3] = qrot_np(PW[..., 3:7], TP[level, 0:3] * PW[..., 7:10]) + PW[..., 0:3]
+        W[:, level, 7:10] = TP[level, 7:10]
+    # local transforms of the posed bones
+    PW = W[:, arrays.np_parents[posed]]
+    WP = W[:, posed]
+    TPP = TP[posed]
+    pw_rot_inv = qconj_np(PW[..., 3:7])
+    local_rot = qmul_np(pw_rot_inv, WP[..., 3:7])
+    local_tra = qrot_np(pw_rot_inv, WP[..., 0:3] - PW[..., 0:3]) / WP[..., 7:10]
+    local_tra[:, arrays.np_locked] = TPP[arrays.np_locked, 0:3]
+    # relative to the T-pose
+    rot = local_rot
+    if counter_rot_frames and any(counter_rot_frames):
+        C = np.zeros((F, len(arrays.posed), 4))
+        C[..., 3] = 1.0
+        for f, counter_rots in enumerate(counter_rot_frames):
+            if counter_rots:
+                for i, slot in enumerate(arrays.posed):
+                    if slot in counter_rots:
+                        C[f, i] = counter_rots[slot]
+        rot = qmul_np(rot, C)
+    rot = qmul_np(rot, qinverse_np(TPP[:, 3:7]))
+    tra = local_tra - TPP[:, 0:3]
+    slots = list(arrays.posed)
+    return [ PoseSolution(slots, local_rot[f].tolist(), rot[f], tra[f].tolist()) for f in range(F) ]
+
+
+# Curves
+#
+
+def reduce_keys(xs, values, tolerance, use_numpy=HAS_NUMPY):
+    """The indices of the keys to keep, so that linear interpolation between the kept keys
+       stays within tolerance of every value (Ramer-Douglas-Peucker on the value error).
+       The first and last keys are always kept."""
+    n = len(values)
+    if n <= 2:
+        return list(range(n))
+    xs = list(xs)
+    values = list(values)
+    # NumPy only pays off on long spans
+    np_xs = np_values = None
+    if use_numpy and HAS_NUMPY:
+        np_xs = np.asarray(xs, dtype=np.float64)
+        np_values = np.asarray(values, dtype=np.float64)
+    keep = [False] * n
+    keep[0] = keep[n - 1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        if np_xs is not None and b - a > REDUCE_NUMPY_SPAN:
+            worst = get_worst_key_numpy(np_xs, np_values, a, b, tolerance)
+        else:
+            worst = get_worst_key(xs, values, a, b, tolerance)
+        if worst >= 0:
+            keep[worst] = True
+            stack.append((a, worst))
+            stack.append((worst, b))
+    return [ i for i in range(n) if keep[i] ]
+
+
+def get_worst_key(xs, values, a, b, tolerance):
+    """The key between a and b furthest from the line from a to b, or -1 if none are beyond tolerance."""
+    xa = xs[a]
+    va = values[a]
+    slope = (values[b] - va) / (xs[b] - xa)
+    worst = -1
+    worst_error = tolerance
+    for i in range(a + 1, b):
+        error = abs(values[i] - (va + slope * (xs[i] - xa)))
+        if error > worst_error:
+            worst = i
+            worst_error = error
+    return worst
+
+
+def get_worst_key_numpy(xs, values, a, b, tolerance):
+    xa = xs[a]
+    va = values[a]
+    slope = (values[b] - va) / (xs[b] - xa)
+    errors = np.abs(values[a+1:b] - (va + slope * (xs[a+1:b] - xa)))
+    i = int(np.argmax(errors))
+    return a + 1 + i if errors[i] > tolerance else -1
+
+
+def reduce_held_keys(values, tolerance):
+    """The indices of the keys to keep, dropping only keys inside spans where the value holds
+       within tolerance, for keys that are not interpolated linearly. The first two and last two
+       keys of each held span are kept, so the span is flat however the keys are interpolated
+       (a smooth transition between equal keys with equal neighbours has no overshoot).
+       The first and last keys are always kept."""
+    n = len(values)
+    values = list(values)
+    # half the tolerance either side of the first value of the span
+    hold = tolerance * 0.5
+    keep = []
+    a = 0
+    while a < n:
+        va = values[a]
+        b = a
+        while b + 1 < n and abs(values[b + 1] - va) <= hold:
+            b += 1
+        keep.extend(sorted({ a, min(a + 1, b), max(b - 1, a), b }))
+        a = b + 1
+    return keep
+
+
+# Expressions
+#
+
+def expression_counter_rotation(exp_rotations, expression_weights: dict):
+    """The rotation counteracting the weighted expression bone rotations (shape index, (x,y,z,w)),
+       or None if no active expression rotates the bone."""
+    R = None
+    for shape_index, ERQ in exp_rotations:
+        if shape_index in expression_weights:
+            w = expression_weights[shape_index]
+            # unnormalized blend from the identity, as the host quaternion arithmetic does it
+            ERQW = (ERQ[0] * w, ERQ[1] * w, ERQ[2] * w, 1.0 + (ERQ[3] - 1.0) * w)
+            R = ERQW if R is None else qmul(R, ERQW)
+    if R is None:
+        return None
+    return qinverse(R)
+
+
+def signed_angle_between_vectors(v1, v2, axis):
+    axis = normalized(axis)
+    v1p = normalized(project_vector_around_axis(v1, axis))
+    v2p = normalized(project_vector_around_axis(v2, axis))
+    angle = math.acos(max(-1.0, min(1.0, dot(v1p, v2p))))
+    if dot(cross(v1p, v2p), axis) < 0:
+        angle = -angle
+    return angle
+
+
+def project_vector_around_axis(v, axis):
+    d = dot(v, axis)
+    return (v[0] - axis[0] * d, v[1] - axis[1] * d, v[2] - axis[2] * d)
+
+
+def face_driver_weights(local_rot, t_pose_rot, expr_rotations):
+    """The expression weights that produce the face bone's pose rotation,
+       for each expression (shape index, (x,y,z,w) expression bone rotation) driven by the bone."""
+    weights = []
+    local_pose = qmul(qinverse(t_pose_rot), local_rot)
+    pose_dir = qrot(local_pose, FORWARD)
+    for shape_index, ERQ in expr_rotations:
+        expr_dir = qrot(ERQ, FORWARD)
+        expr_axis = cross(expr_dir, FORWARD)
+        angle_pose = signed_angle_between_vectors(FORWARD, pose_dir, expr_axis)
+        angle_expr = signed_angle_between_vectors(FORWARD, expr_dir, expr_axis)
+        if abs(angle_expr) < 1e-9:
+            continue
+        weights.append((shape_index, min(1.0, max(0.0, angle_pose / angle_expr))))
+    return weights
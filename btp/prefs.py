@@ -35,6 +35,10 @@ DEFAULT_MORPH_SLIDER_PATH: str = "Custom/Blender"
 AUTO_START_SERVICE: bool = False
 MATCH_CLIENT_RATE: bool = True
 DATALINK_FRAME_SYNC: bool = False
+DATALINK_OFFLINE_SEQUENCE: bool = False
+DATALINK_RECORD_SEQUENCE: bool = False
+DATALINK_REDUCE_KEYS: bool = False
+DATALINK_COMPACT_FRAMES: bool = False
 CC_USE_FACIAL_PROFILE: bool = True
 CC_USE_HIK_PROFILE: bool = True
 CC_USE_FACIAL_EXPRESSIONS: bool = True
@@ -77,6 +81,10 @@ class Preferences(QObject):
     checkbox_auto_start_service: QCheckBox = None
     checkbox_match_client_rate: QCheckBox = None
     checkbox_datalink_frame_sync: QCheckBox = None
+    checkbox_datalink_offline_sequence: QCheckBox = None
+    checkbox_datalink_record_sequence: QCheckBox = None
+    checkbox_datalink_reduce_keys: QCheckBox = None
+    checkbox_datalink_compact_frames: QCheckBox = None
     checkbox_cc_use_facial_profile: QCheckBox = None
     checkbox_cc_use_hik_profile: QCheckBox = None
     checkbox_cc_use_facial_expressions: QCheckBox = None
@@ -138,6 +146,10 @@ class Preferences(QObject):
         self.checkbox_auto_start_service = qt.checkbox(col, "Auto-start Link Server", AUTO_START_SERVICE, update=self.update_checkbox_auto_start_service)
         self.checkbox_match_client_rate = qt.checkbox(col, "Match Client Rate", MATCH_CLIENT_RATE, update=self.update_checkbox_match_client_rate)
         self.checkbox_datalink_frame_sync = qt.checkbox(col, "Sequence Frame Sync", DATALINK_FRAME_SYNC, update=self.update_checkbox_datalink_frame_sync)
+        self.checkbox_datalink_offline_sequence = qt.checkbox(col, "Offline Sequence Transfer", DATALINK_OFFLINE_SEQUENCE, update=self.update_checkbox_datalink_offline_sequence)
+        self.checkbox_datalink_record_sequence = qt.checkbox(col, "Record Sequence, Key At End", DATALINK_RECORD_SEQUENCE, update=self.update_checkbox_datalink_record_sequence)
+        self.checkbox_datalink_reduce_keys = qt.checkbox(col, "Reduce Recorded Keys", DATALINK_REDUCE_KEYS, update=self.update_checkbox_datalink_reduce_keys)
+        self.checkbox_datalink_compact_frames = qt.checkbox(col, "Compact (Quantized) Pose Frames", DATALINK_COMPACT_FRAMES, update=self.update_checkbox_datalink_compact_frames)
 
         qt.spacing(layout, 10)
         qt.separator(layout, 1)
@@ -296,6 +308,42 @@ class Preferences(QObject):
         write_temp_state()
         self.no_update = False
 
+    def update_checkbox_datalink_offline_sequence(self):
+        global DATALINK_OFFLINE_SEQUENCE
+        if self.no_update:
+            return
+        self.no_update = True
+        DATALINK_OFFLINE_SEQUENCE = self.checkbox_datalink_offline_sequence.isChecked()
+        write_temp_state()
+        self.no_update = False
+
+    def update_checkbox_datalink_record_sequence(self):
+        global DATALINK_RECORD_SEQUENCE
+        if self.no_update:
+            return
+        self.no_update = True
+        DATALINK_RECORD_SEQUENCE = self.checkbox_datalink_record_sequence.isChecked()
+        write_temp_state()
+        self.no_update = False
+
+    def update_checkbox_datalink_reduce_keys(self):
+        global DATALINK_REDUCE_KEYS
+        if self.no_update:
+            return
+        self.no_update = True
+        DATALINK_REDUCE_KEYS = self.checkbox_datalink_reduce_keys.isChecked()
+        write_temp_state()
+        self.no_update = False
+
+    def update_checkbox_datalink_compact_frames(self):
+        global DATALINK_COMPACT_FRAMES
+        if self.no_update:
+            return
+        self.no_update = True
+        DATALINK_COMPACT_FRAMES = self.checkbox_datalink_compact_frames.isChecked()
+        write_temp_state()
+        self.no_update = False
+
     def update_checkbox_export_morph_materials(self):
         global EXPORT_MORPH_MATERIALS
         if self.no_update:
@@ -478,6 +526,10 @@ def read_temp_state():
     global AUTO_START_SERVICE
     global MATCH_CLIENT_RATE
     global DATALINK_FRAME_SYNC
+    global DATALINK_OFFLINE_SEQUENCE
+    global DATALINK_RECORD_SEQUENCE
+    global DATALINK_REDUCE_KEYS
+    global DATALINK_COMPACT_FRAMES
     global CC_USE_FACIAL_PROFILE
     global CC_USE_HIK_PROFILE
     global CC_USE_FACIAL_EXPRESSIONS
@@ -516,6 +568,10 @@ def read_temp_state():
             AUTO_START_SERVICE = get_attr(temp_state_json, "auto_start_service", False)
             MATCH_CLIENT_RATE = get_attr(temp_state_json, "match_client_rate", True)
             DATALINK_FRAME_SYNC = get_attr(temp_state_json, "datalink_frame_sync", False)
+            DATALINK_OFFLINE_SEQUENCE = get_attr(temp_state_json, "datalink_offline_sequence", False)
+            DATALINK_RECORD_SEQUENCE = get_attr(temp_state_json, "datalink_record_sequence", False)
+            DATALINK_REDUCE_KEYS = get_attr(temp_state_json, "datalink_reduce_keys", False)
+            DATALINK_COMPACT_FRAMES = get_attr(temp_state_json, "datalink_compact_frames", False)
             CC_USE_FACIAL_PROFILE = get_attr(temp_state_json, "cc_use_facial_profile", True)
             CC_USE_HIK_PROFILE = get_attr(temp_state_json, "cc_use_hik_profile", True)
             CC_USE_FACIAL_EXPRESSIONS = get_attr(temp_state_json, "cc_use_facial_expressions", True)
@@ -550,6 +606,10 @@ def write_temp_state():
     global AUTO_START_SERVICE
     global MATCH_CLIENT_RATE
     global DATALINK_FRAME_SYNC
+    global DATALINK_OFFLINE_SEQUENCE
+    global DATALINK_RECORD_SEQUENCE
+    global DATALINK_REDUCE_KEYS
+    global DATALINK_COMPACT_FRAMES
     global CC_USE_FACIAL_PROFILE
     global CC_USE_HIK_PROFILE
     global CC_USE_FACIAL_EXPRESSIONS
@@ -586,6 +646,10 @@ def write_temp_state():
         "auto_start_service": AUTO_START_SERVICE,
         "match_client_rate": MATCH_CLIENT_RATE,
         "datalink_frame_sync": DATALINK_FRAME_SYNC,
+        "datalink_offline_sequence": DATALINK_OFFLINE_SEQUENCE,
+        "datalink_record_sequence": DATALINK_RECORD_SEQUENCE,
+        "datalink_reduce_keys": DATALINK_REDUCE_KEYS,
+        "datalink_compact_frames": DATALINK_COMPACT_FRAMES,
         "cc_use_facial_profile": CC_USE_FACIAL_PROFILE,
         "cc_use_hik_profile": CC_USE_HIK_PROFILE,
         "cc_use_facial_expressions": CC_USE_FACIAL_EXPRESSIONS,
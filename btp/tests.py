@@ -14,9 +14,9 @@
 # You should have received a copy of the GNU General Public License
 # along with CC/iC-Blender-Pipeline-Plugin.  If not, see <https://www.gnu.org/licenses/>.
 
-import os, json, RLPy
+import os, json, math, random, time, RLPy
 from RLPy import *
-from . import cc, utils, vars
+from . import cc, codec, posemath, utils, vars
 
 
 BONES = []
@@ -409,3 +409,182 @@ def test_face():
     FC.LoadProfile(path)
     # broken for non-standard humanoids
     return
+
+
+def random_pose_transform(tra_range, scaled, origin=(0.0, 0.0, 0.0)):
+    x, y, z, w = [ random.gauss(0, 1) for i in range(0, 4) ]
+    l = math.sqrt(x*x + y*y + z*z + w*w)
+    s = [ random.uniform(0.5, 2.0) for i in range(0, 3) ] if scaled else [1.0, 1.0, 1.0]
+    return (origin[0] + random.uniform(-tra_range, tra_range),
+            origin[1] + random.uniform(-tra_range, tra_range),
+            origin[2] + random.uniform(-tra_range, tra_range),
+            x / l, y / l, z / l, w / l, s[0], s[1], s[2])
+
+
+def codec_error_test(num_bones=100, num_weights=150, frames=100, tra_range=200.0, origin=(5000.0, 0.0, -3000.0)):
+    """Measures the worst case error of the compact pose codecs against float32,
+       for an actor away from the origin, and the payload size of a bone block and a weight block."""
+    for frame_codec in codec.LINK_CODECS:
+        for scaled in [False, True]:
+            max_dt = max_angle = max_ds = max_dw = 0.0
+            for f in range(0, frames):
+                transforms = [ random_pose_transform(tra_range, scaled, origin) for i in range(0, num_bones) ]
+                weights = [ random.uniform(0.0, 1.0) for i in range(0, num_weights) ]
+                r_min, r_extent = codec.get_translation_bounds(transforms)
+                flags = codec.get_codec_flags(frame_codec, codec.has_scale(transforms))
+                bone_size = codec.get_bone_struct(flags).size
+                weight_struct = codec.get_weight_struct(flags, num_weights)
+                buffer = bytearray(num_bones * bone_size + weight_struct.size)
+                offset = codec.pack_transforms_into(buffer, 0, transforms, r_min, r_extent, flags)
+                weight_struct.pack_into(buffer, offset, *codec.quantize_weights(weights, flags))
+                values, offset = codec.unpack_transforms(buffer, 0, num_bones, r_min, r_extent, flags)
+                decoded_weights, offset = codec.unpack_weights(buffer, offset, num_weights, flags)
+                for i, T in enumerate(transforms):
+                    D = values[i*10:i*10 + 10]
+                    dt, angle = codec.get_transform_error(T, D)
+                    max_dt = max(max_dt, dt)
+                    max_angle = max(max_angle, angle)
+                    max_ds = max(max_ds, abs(T[7] - D[7]), abs(T[8] - D[8]), abs(T[9] - D[9]))
+                for w, d in zip(weights, decoded_weights):
+                    max_dw = max(max_dw, abs(w - d))
+            float_size = num_bones * 40 + num_weights * 4
+            ratio = float_size / len(buffer)
+            print(f"{frame_codec} scale: {scaled} - translation: {max_dt:.5f} (range {tra_range}) "
+                  f"rotation: {math.degrees(max_angle):.5f} deg scale: {max_ds:.5f} weight: {max_dw:.5f} "
+                  f"- size: {len(buffer)} / {float_size} ({ratio:.2f}x)")
+            # error bounds: half a quantization step on each axis, plus float32 rounding away from the origin
+            step = 2 * tra_range / codec.TRANSLATION_STEPS
+            assert max_dt <= math.sqrt(3) * (step / 2 + 0.001)
+            assert math.degrees(max_angle) < 0.01
+            assert not scaled or max_ds < 0.002
+            assert max_dw <= (codec.WEIGHT_MAX - codec.WEIGHT_MIN) / (255 if frame_codec == codec.COMPACT8 else 65535)
+
+
+def random_skeleton_pose(num_bones, posed_fraction=0.8):
+    """A random bone hierarchy (parents before children) with a T-pose and a world space pose."""
+    parents = [-1] + [ random.randrange(0, i) for i in range(1, num_bones) ]
+    pose_indices = []
+    count = 0
+    for i in range(0, num_bones):
+        if i == 0 or random.random() < posed_fraction:
+            pose_indices.append(count)
+            count += 1
+        else:
+            pose_indices.append(-1)
+    locked = [ random.random() < 0.2 for i in range(0, num_bones) ]
+    t_pose = []
+    for i in range(0, num_bones):
+        t_pose.extend(random_pose_transform(10.0, False))
+    pose_data = []
+    for i in range(0, count):
+        pose_data.extend(random_pose_transform(100.0, False))
+    return posemath.PoseArrays(parents, pose_indices, locked, t_pose), pose_data
+
+
+def pose_math_test(num_bones=150, frames=100):
+    """Compares the NumPy and Python pose math engines and times them."""
+    arrays, pose_data = random_skeleton_pose(num_bones)
+    backends = [False, True] if posemath.HAS_NUMPY else [False]
+    solutions = {}
+    for use_numpy in backends:
+        start = time.perf_counter()
+        for f in range(0, frames):
+            solution = posemath.solve_pose(arrays, pose_data, use_numpy=use_numpy)
+        duration = (time.perf_counter() - start) / frames
+        solutions[use_numpy] = solution
+        print(f"{'NumPy' if use_numpy else 'Python'}: {len(solution.slots)} bones - {duration * 1000:.3f} ms / pose")
+    if posemath.HAS_NUMPY:
+        a = solutions[False]
+        b = solutions[True]
+        assert list(a.slots) == list(b.slots)
+        max_angle = max_dt = 0.0
+        for i in range(0, len(a.slots)):
+            for k in range(0, 3):
+                max_angle = max(max_angle, abs(math.remainder(a.euler[i][k] - b.euler[i][k], 2 * math.pi)))
+                max_dt = max(max_dt, abs(a.tra[i][k] - b.tra[i][k]))
+        print(f"NumPy / Python difference - rotation: {math.degrees(max_angle):.6f} deg translation: {max_dt:.6f}")
+        assert math.degrees(max_angle) < 0.01
+        assert max_dt < 0.001
+
+
+def euler_curve_test(num_bones=150, frames=300):
+    """Converts spinning bone rotations into euler curves, checks they stay continuous
+       and still give the same rotations, and times the backends."""
+    axes = []
+    for i in range(0, num_bones):
+        x, y, z = [ random.gauss(0, 1) for i in range(0, 3) ]
+        l = math.sqrt(x*x + y*y + z*z)
+        axes.append((x / l, y / l, z / l, random.uniform(0.05, 0.3)))
+    rot_frames = []
+    for f in range(0, frames):
+        rots = []
+        for x, y, z, speed in axes:
+            s = math.sin(f * speed / 2)
+            rots.append((x * s, y * s, z * s, math.cos(f * speed / 2)))
+        rot_frames.append(rots)
+    backends = [False, True] if posemath.HAS_NUMPY else [False]
+    for use_numpy in backends:
+        start = time.perf_counter()
+        curves = posemath.euler_xyz_curves(rot_frames, use_numpy=use_numpy)
+        duration = time.perf_counter() - start
+        max_step = max_error = 0.0
+        for f in range(0, frames):
+            for b in range(0, num_bones):
+                e = curves[f][b]
+                q = posemath.qmul(posemath.qmul((math.sin(e[0] / 2), 0, 0, math.cos(e[0] / 2)),
+                                                (0, math.sin(e[1] / 2), 0, math.cos(e[1] / 2))),
+                                  (0, 0, math.sin(e[2] / 2), math.cos(e[2] / 2)))
+                d = abs(sum(q[k] * rot_frames[f][b][k] for k in range(0, 4)))
+                max_error = max(max_error, math.degrees(2 * math.acos(min(1.0, d))))
+                if f > 0:
+                    p = curves[f - 1][b]
+                    max_step = max(max_step, abs(e[0] - p[0]), abs(e[1] - p[1]), abs(e[2] - p[2]))
+        print(f"{'NumPy' if use_numpy else 'Python'}: {frames} x {num_bones} - {duration * 1000:.3f} ms "
+              f"- largest step: {math.degrees(max_step):.3f} deg rotation error: {max_error:.6f} deg")
+        assert max_error < 0.01
+        # no 360 degree spins between keys
+        assert max_step < math.pi
+
+
+def key_reduction_test(frames=1000, tolerance=0.001):
+    """Reduces constant, held, linear and noisy curves, checks linear interpolation between the keys
+       kept for linear transitions, and the held spans between the keys kept for any transition,
+       stay within tolerance, and shows how many keys are kept."""
+    xs = [ f * 1000 / 60 for f in range(0, frames) ]
+    curves = {
+        "constant": [ 0.5 ] * frames,
+        "held": [ float(f // 100) for f in range(0, frames) ],
+        "linear": [ 0.01 * f for f in range(0, frames) ],
+        "sine": [ math.sin(f * 0.05) for f in range(0, frames) ],
+        "noise": [ random.uniform(-0.0002, 0.0002) for f in range(0, frames) ],
+    }
+    backends = [False, True] if posemath.HAS_NUMPY else [False]
+    for use_numpy in backends:
+        for name, values in curves.items():
+            start = time.perf_counter()
+            keys = posemath.reduce_keys(xs, values, tolerance, use_numpy=use_numpy)
+            duration = time.perf_counter() - start
+            assert keys[0] == 0 and keys[-1] == frames - 1
+            max_error = 0.0
+            for a, b in zip(keys, keys[1:]):
+                slope = (values[b] - values[a]) / (xs[b] - xs[a])
+                for i in range(a, b + 1):
+                    max_error = max(max_error, abs(values[i] - (values[a] + slope * (xs[i] - xs[a]))))
+            print(f"Linear {'NumPy' if use_numpy else 'Python'} {name}: {len(keys)} / {frames} keys "
+                  f"- error: {max_error:.6f} - {duration * 1000:.3f} ms")
+            assert max_error <= tolerance + 1e-9
+    for name, values in curves.items():
+        start = time.perf_counter()
+        keys = posemath.reduce_held_keys(values, tolerance)
+        duration = time.perf_counter() - start
+        assert keys[0] == 0 and keys[-1] == frames - 1
+        kept = set(keys)
+        max_error = 0.0
+        for a, b in zip(keys, keys[1:]):
+            if b - a > 1:
+                # the keys either side of a gap have held neighbours, so smooth transitions stay flat
+                assert a - 1 in kept and b + 1 in kept
+                span = values[a-1:b+2]
+                max_error = max(max_error, max(span) - min(span))
+        print(f"Held {name}: {len(keys)} / {frames} keys - error: {max_error:.6f} - {duration * 1000:.3f} ms")
+        assert max_error <= tolerance + 1e-9